@@ -1,9 +1,15 @@
-from bot import BotActions
+from core import BotActions
+from utils.hashcache import HashCache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import tempfile
+import hashlib
 import click
+import queue
 import os
 import time
 
-bot = BotActions()  # initializes a telegram BOT.
+bot = BotActions()  # initializes a telegram BOT. Rate limits, flood control waits and retries of transient errors are handled inside it.
 
 @click.group()
 def cli():
@@ -27,44 +33,287 @@ def fetch_files(path, path_in_server):
             files_to_process.append((file_path, target_directory, file))
     return files_to_process
 
+class ByteBudget:
+    """Limits bytes held in memory by a pipeline. `acquire(n)` blocks until n more bytes fit in limit, a single item bigger than limit is let in when nothing else is held."""
+    def __init__(self, limit: int) -> None:
+        self._limit = limit
+        self._used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, amount: int):
+        with self._cond:
+            while self._used > 0 and self._used + amount > self._limit:
+                self._cond.wait()
+            self._used += amount
+
+    def release(self, amount: int):
+        with self._cond:
+            self._used -= amount
+            self._cond.notify_all()
+
+
+class TransferStats:
+    """Counters of a bulk transfer, printed as a single live progress line."""
+    def __init__(self, total_files: int) -> None:
+        self.total_files = total_files
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0    # Unchanged files, already in cloud.
+        self.linked = 0     # Duplicates of content already in cloud, added without uploading.
+        self.bytes = 0
+        self._start = time.time()
+        self._last_report = 0
+        self._lock = threading.Lock()
+
+    def add(self, success: bool, num_bytes: int = 0):
+        with self._lock:
+            if success:
+                self.done += 1
+                self.bytes += num_bytes
+            else:
+                self.failed += 1
+
+    def add_skipped(self, linked: bool = False):
+        with self._lock:
+            if linked:
+                self.linked += 1
+            else:
+                self.skipped += 1
+
+    def report(self, force: bool = False):
+        now = time.time()
+        if not force and now - self._last_report < 1:   # At most once a second.
+            return False
+        self._last_report = now
+        elapsed = max(now - self._start, 1e-6)
+        click.echo(f"\r[{self.done + self.failed + self.skipped + self.linked}/{self.total_files}] {self.done} done, {self.linked} linked, {self.skipped} unchanged, {self.failed} failed | {self.done / elapsed:.1f} files/s | {self.bytes / elapsed / 1024 / 1024:.2f} MB/s   ", nl=force)
+        return True
+
+    @property
+    def elapsed(self) -> float:
+        return time.time() - self._start
+
+
+def run_upload_pipeline(files_to_process: list[tuple[str, str, str]], workers: int, readers: int, max_in_flight_mb: int, retries: int, hash_cache: HashCache = None, deduplicate: bool = True):
+    """Uploads files through a pipeline of stages connected by bounded queues:\n
+       producer (file list) -> readers (hash, read, compress & encrypt small files) -> upload workers -> commit (adds records to schema, one at a time, reports progress).
+       Readers hash each file (SHA-256, cached by path / size / mtime in `hash_cache`). A file already in it's target folder with same content is skipped,
+       and if `deduplicate` is set, a file whose content is already in cloud elsewhere is linked to those messages instead of being uploaded again.
+       A changed file (same name, different content) replaces it's previous version in target folder.
+       Bytes read but not yet uploaded are limited to `max_in_flight_mb`. Each file is retried upto `retries` times on it's own, Returns list of (file_path, error) that failed.
+    """
+    to_read, to_upload, to_commit = queue.Queue(maxsize=readers * 2), queue.Queue(maxsize=workers * 2), queue.Queue()
+    budget = ByteBudget(max_in_flight_mb * 1024 * 1024)
+    stats = TransferStats(len(files_to_process))
+    failures = []
+    readers_left, readers_lock = [readers], threading.Lock()
+
+    def produce():
+        for item in files_to_process:
+            to_read.put(item)
+        for _ in range(readers):
+            to_read.put(None)   # One stop signal per reader.
+
+    def get_sha256(file_path: str, content: bytes = None) -> str:
+        if hash_cache is None:
+            return hashlib.sha256(content).hexdigest() if content is not None else HashCache.hash_file(file_path)
+        if content is None:
+            return hash_cache.get_sha256(file_path)
+        stat = os.stat(file_path)
+        sha256 = hash_cache.get(file_path, stat)
+        if sha256 is None:
+            sha256 = hashlib.sha256(content).hexdigest()
+            hash_cache.put(file_path, stat, sha256)
+        return sha256
+
+    def read():
+        try:
+            with bot.background_lane():
+                while (item := to_read.get()) is not None:
+                    file_path, target_directory, file = item
+                    held = 0    # Bytes of budget this item holds, handed over to upload stage along with it.
+                    try:
+                        file_size = os.path.getsize(file_path)
+                        content = None
+                        if file_size <= bot._part_size:     # Small file, read here (hashed from memory, encrypted below), so that upload workers only upload.
+                            budget.acquire(file_size)
+                            held = file_size
+                            with open(file_path, 'rb') as file_binary:
+                                content = file_binary.read()
+                        sha256 = get_sha256(file_path, content)
+                        duplicate = None
+                        previous = [record["message_id"] for record in bot.get_file_records(target_directory, file) if "message_id" in record]  # Older versions of a changed file, replaced once new one is in.
+                        if bot.is_file_in_schema(target_directory, file, sha256):
+                            action = "unchanged"
+                        elif deduplicate and (duplicate := bot.find_duplicate(sha256, file_size, target_directory)) is not None:
+                            action = "link"
+                        else:
+                            action = "upload"
+                        if action != "upload":
+                            budget.release(held)
+                            held = 0
+                            to_commit.put((item, action, duplicate, None, file_size, previous))
+                        elif content is not None:
+                            prepared, compression = bot.prepare_file(content, file)
+                            to_upload.put((item, (prepared, compression), len(content), held, sha256, previous))
+                            held = 0
+                        else:   # Big file is read part by part while uploading, upto `UPLOAD_WORKERS` parts at a time.
+                            held = min(file_size, bot._upload_workers * bot._part_size)
+                            budget.acquire(held)
+                            to_upload.put((item, None, file_size, held, sha256, previous))
+                            held = 0
+                    except Exception as err:    # A file that can't be read / prepared fails on it's own, the pipeline goes on.
+                        budget.release(held)
+                        to_commit.put((item, "failed", False, f"Unable to read: {err}" if isinstance(err, OSError) else str(err), 0, []))
+        finally:
+            with readers_lock:
+                readers_left[0] -= 1
+                if readers_left[0] == 0:    # Last reader to finish stops all upload workers.
+                    for _ in range(workers):
+                        to_upload.put(None)
+
+    def upload():
+        try:
+            with bot.background_lane():     # Bulk job, Let UI requests go first.
+                while (job := to_upload.get()) is not None:
+                    item, prepared, plain_size, held, sha256, previous = job
+                    file_path, _, file = item
+                    try:
+                        for attempt in range(1, retries + 1):
+                            if prepared is not None:
+                                file_info, err = bot.upload_record(None, file, prepared_part=prepared[0], plain_size=plain_size, sha256=sha256, compression=prepared[1])
+                            else:
+                                with open(file_path, 'rb') as file_binary:
+                                    file_info, err = bot.upload_record(file_binary, file)
+                            if file_info is not False:
+                                break
+                            if attempt < retries:
+                                click.echo(f"\nUpload of '{file_path}' failed (attempt {attempt}/{retries}), retrying. Error: {err}")
+                                time.sleep(min(2 ** attempt, 30))
+                    except Exception as error:  # Ex: file deleted / locked since it was read.
+                        file_info, err = False, f"Unable to read: {error}" if isinstance(error, OSError) else str(error)
+                    finally:
+                        budget.release(held)
+                    to_commit.put((item, "upload", file_info, err, plain_size, previous))
+        finally:
+            to_commit.put(None)     # Commit stage waits for one from every worker.
+
+    threads = [threading.Thread(target=produce, daemon=True)]
+    threads += [threading.Thread(target=read, daemon=True) for _ in range(readers)]
+    threads += [threading.Thread(target=upload, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    workers_done = 0
+    while workers_done < workers:   # Commit stage, Schema is only changed from here.
+        try:
+            result = to_commit.get(timeout=1)
+        except queue.Empty:
+            bot.sync_schema()
+            stats.report()
+            continue
+        if result is None:
+            workers_done += 1
+            continue
+        (file_path, target_directory, file), action, file_info, err, plain_size, previous = result
+        res = False
+        if action == "unchanged":
+            res = True
+            stats.add_skipped()
+        elif action == "link":
+            res, err = bot.link_file(file_info, file, target_directory, wait=False)
+            if res is True:
+                stats.add_skipped(linked=True)
+        elif file_info is not False:
+            res, err = bot.add_file_record(file_info, target_directory, wait=False)   # Journal is synced once a second, not after every file.
+            if res is True:
+                stats.add(True, plain_size)
+        if res is True and action != "unchanged":
+            for message_id in previous:     # Changed file, previous version is dropped (it's messages too, unless linked elsewhere).
+                bot.delete_file(target_directory, message_id)
+        if res is not True:
+            stats.add(False)
+            failures.append((file_path, err))
+            click.echo(f"\nFailed to upload '{file_path}' to '{target_directory}': {err}")
+        if stats.report():
+            bot.sync_schema()
+            if hash_cache is not None:
+                hash_cache.save()
+    for thread in threads:
+        thread.join()
+    bot.sync_schema()
+    if hash_cache is not None:
+        hash_cache.save()
+    stats.report(force=True)
+    return stats, failures
+
+
 @cli.command()
 @click.option('--path', type=click.Path(exists=True, file_okay=False, dir_okay=True), required=True, help='Absolute path to the folder to be processed (Use forward slash "/" as path separator), all subdirectories will be processed too.')
 @click.option('--path_in_server', default=None, help='Path to the folder in server UI where all the current files will be placed, (Use forward slash "/" as path separator), Default is, A new base_dir in root folder in server.')
 @click.option('--dry_run', is_flag=True, default=False, help='Set this option to do a crawl check, not do the actual upload!!')
-def upload(path: str, path_in_server: str, dry_run: bool):
-    """Upload all files in each and every subdirectory in the specified path. Replicates local directory structure in cloud UI as well."""
+@click.option('--workers', default=4, show_default=True, help='Number of files uploaded in parallel.')
+@click.option('--readers', default=2, show_default=True, help='Number of files read & encrypted in parallel, ahead of uploads.')
+@click.option('--max_in_flight_mb', default=256, show_default=True, help='Limit on file content (MB) read into memory but not yet uploaded.')
+@click.option('--retries', default=3, show_default=True, help='Upload attempts per file, before giving up on it.')
+@click.option('--no_dedup', is_flag=True, default=False, help='Upload files even if same content is already in cloud in another folder (Default is to add them as links to existing copy). Unchanged files in target folder are always skipped.')
+@click.option('--chunked', is_flag=True, default=False, help='Upload big files through chunk store, only chunks (parts of content) not already in cloud are uploaded. Default is `CHUNK_STORE` setting from env.')
+@click.option('--hash_cache', default=None, help='Local file where content hashes of backed up files are cached (by path, size & modification time), Default is `hash_cache.json` next to schema.')
+def upload(path: str, path_in_server: str, dry_run: bool, workers: int, readers: int, max_in_flight_mb: int, retries: int, no_dedup: bool, chunked: bool, hash_cache: str):
+    """Upload all files in each and every subdirectory in the specified path. Replicates local directory structure in cloud UI as well.\n
+       Incremental, Files already in cloud with same name & content are skipped, So re-running a backup only uploads new / changed files.
+    """
     files_to_process = fetch_files(path, path_in_server)
     total_no_of_files = len(files_to_process)
+    if dry_run:
+        for file_path, target_directory, file in files_to_process:
+            click.echo(f"Would upload '{file_path}' as '{file}' to '{target_directory}' in server.")    # [Ex: If selected path is `c:/users/never/gonna/give` --> the folder structure replicated in server schema will be starting from `give`]
+        click.echo(f"Dry run, {total_no_of_files} files would be uploaded.")
+        return
     choice = bool(input(f"You are about to upload {total_no_of_files} files, Do you wish to proceed? Press any key, enter to proceed."))
     if choice is not False:
-        processed_files = 0  # Total attempts.
-        success = 0          # Successful uploads.
-        start_time = time.time()    # start time
-        while len(files_to_process) > 0:
-            for file_path, target_directory, file in files_to_process.copy():
-                with open(file_path, 'rb') as file_binary:
-                    click.echo(f"Process Attempt Number: {success}. Attempting to upload file '{file}' to '{target_directory}' in server!")    # [Ex: If selected path is `c:/users/never/gonna/give` --> the folder structure replicated in server schema will be starting from `give`]
-                    if not dry_run:
-                        res, err = bot.upload_file(file_binary, file, True, target_directory)
-                        time.sleep(1)  # Avoid DDOS Bro. Better to Increase this if you have patience.
-                    else:
-                        res, err = True, ""  # Return dummy response in case of dry run.
-                    processed_files += 1    # file processed
-                    if res is True:
-                        click.echo(f"Successfully uploaded the file '{file}' to '{target_directory}'.")
-                        success += 1        # Successful process.
-                        files_to_process.remove((file_path, target_directory, file))   # remove file record from process list, once it is successfully uploaded.
-                    else:
-                        click.echo(err)
-                        if "Flood control" in err:
-                            click.echo("[Flood Control] - Waiting for 35 seconds, as telegram is afraid that you are DDOS-ing it!!")
-                            time.sleep(35)  # If telegram complained a flood control, we just need to stop.
-
-            click.echo(f"One round of processing completed ({success} / {total_no_of_files} successful uploads). Will retry failed batch of files (if any) in 20 seconds...")
-            if len(files_to_process) > 0:   # Avoid time waste if no pending files are there.
-                time.sleep(20)
-        end_time = time.time()  # end time.
-        click.echo(f"Process finished in {round(end_time - start_time, 2)} seconds, Successfully uploaded {success} files out of a total of {total_no_of_files} files!!")
+        if chunked:
+            bot._chunk_store_enabled = True
+        cache = HashCache(hash_cache or os.path.join(os.path.dirname(bot._schema_filepath), "hash_cache.json"))
+        stats, failures = run_upload_pipeline(files_to_process, max(workers, 1), max(readers, 1), max_in_flight_mb, max(retries, 1), hash_cache=cache, deduplicate=not no_dedup)
+        click.echo(f"Process finished in {round(stats.elapsed, 2)} seconds, Successfully uploaded {stats.done} files out of a total of {total_no_of_files} files!! ({stats.skipped} unchanged, {stats.linked} linked to existing copies)")
+        for file_path, err in failures:
+            click.echo(f"Failed: {file_path} - {err}")
+
+
+def is_already_downloaded(file_path: str, file_info: dict) -> bool:
+    """True if a local file matches the record, compared by size (and content hash, if record has one). Records without size info only check that file exists."""
+    if not os.path.isfile(file_path):
+        return False
+    expected_size = file_info.get("total_size")
+    if isinstance(expected_size, int) and os.path.getsize(file_path) != expected_size:
+        return False
+    if file_info.get("sha256"):
+        return HashCache.hash_file(file_path) == file_info["sha256"]
+    return True
+
+
+def download_to_file(file_info: dict, file_path: str):
+    """Streams a file from cloud into a temp file next to `file_path`, renames it to `file_path` once complete. Memory used is one download buffer, not whole file. Returns a tuple of (bytes written, error)."""
+    stream, err = bot.stream_file(file_info["file_id"])
+    if stream is False:
+        return False, err
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=f".{os.path.basename(file_path)}.", suffix=".download")
+    written = 0
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            for chunk in stream:
+                tmp_file.write(chunk)
+                written += len(chunk)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        if isinstance(file_info.get("total_size"), int) and written != file_info["total_size"]:
+            raise IOError(f"Expected {file_info['total_size']} bytes, got {written} bytes.")
+        os.replace(tmp_path, file_path)     # A crash / failure never leaves a partially written file at `file_path`.
+        return written, None
+    except Exception as err:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False, str(err)
 
 
 @cli.command()
@@ -72,63 +321,66 @@ def upload(path: str, path_in_server: str, dry_run: bool):
 @click.option('--path_in_server', default=None, help='Path to the folder in server UI, ALL the files in all the directories inside the pointed folder will be downloaded, (Use forward slash "/" as path separator), Default is, All files in cloud starting from root folder.')
 @click.option('--dry_run', is_flag=True, default=False, help='Set this option to do a crawl check, not do the actual download!!')
 @click.option('--force', is_flag=True, default=False, help='Set this option to True if you want to re-download even if the file in question is already present in your local.')
-def download(path: str, path_in_server: str, dry_run: bool, force: bool):
-    _, sub_schema, err = bot._ops.get_contents_in_directory(path_in_server, bot._schema, files_only=False)   # Get bot files and folders inside this directory.
-    if sub_schema is False:
-        click.echo(f"Something went wrong! Error: {err}")
-    else:
-        file_list = []  # A list of tuples, Each tuple is local_path, file_name
-
-        def process_sub_schema(schema_dict: dict, base_path="./Downloads/", path_in_server: str = ""):
-            """Iterates through all nested keys in given schema dictionary, adds each file in each sub_directory to file_list. Same can be looped through during download"""
-            for key, value in schema_dict.items():
-                current_path = os.path.join(base_path, path_in_server, key) if key != "root" else os.path.join(base_path, path_in_server)  # root key doesn't need to be created.
-                if isinstance(value, dict):
-                    process_sub_schema(value, current_path)
-                elif key == "root" and isinstance(value, list):
-                    for file_info in value:
-                        file_path = os.path.join(current_path, file_info["filename"])
-                        file_list.append((current_path, file_info["filename"], file_info["file_id"]))  # current_path is location of file, filename is name of file, id is used to download from telegram channel.
-                        click.echo(f"File: {file_path}")
-
-        click.echo("Summary of file structure that will be created, if you choose to accept it..")
-        process_sub_schema(sub_schema, path, path_in_server)  # Just verify number of files across all directories, populate list of files to download.
-        choice = bool(input(f"You are about to download {len(file_list)} files from server. Press any key and Enter to continue..."))
-        if choice is True:
-            start_time = time.time()
-            success = 0
-            total_files = len(file_list)
-            while len(file_list) > 0:   # Actual download happens
-                for path, file_name, file_id in file_list.copy():
-                    file_path = os.path.join(path, file_name)
-                    if not os.path.exists(path):
-                        click.echo(f"Creating Directory: {path}")
-                        os.makedirs(path)
-                    if not os.path.exists(file_path) or force:   # leave if already files is present, do it anyway if force flag is specified.
-                        if not dry_run:
-                            file_in_bytes, err = bot.download_file(file_id)  # Download from server if this is not a dry run.
-                        else:
-                            file_in_bytes, err = "True", ""
-                        if file_in_bytes is not False:  # if download is success.
-                            if not dry_run:
-                                with open(file_path, 'wb') as fp: fp.write(file_in_bytes)
-                                time.sleep(1)
-                            file_list.remove((path, file_name, file_id))
-                            success += 1
-                            click.echo(f"Successfully downloaded, saved the file: {file_path}")
-                        else:
-                            click.echo(f"Something went wrong while downloading '{file_path}', Error: {err}")
-                            if "Flood control" in err:
-                                click.echo("[Flood Control] - Waiting for 35 seconds, as telegram is afraid that you are DDOS-ing it!!")
-                                time.sleep(35)
-                            time.sleep(1)
-                    else:
-                        click.echo(f"Skip downloading of '{file_path}', as it is already present! Run with `--force` arg set, to force download everything.")
-                click.echo(f"Finished one round of downloads ({success} / {total_files} downloads). Will process the failure (if any) in 20 seconds")
-                if len(file_list) > 0:
-                    time.sleep(20)  # Wait time before retry.
-            end_time = time.time()
-            click.echo(f"Downloaded a total of {total_files} files in {round(end_time-start_time, 2)} seconds!")
+@click.option('--workers', default=4, show_default=True, help='Number of files downloaded in parallel.')
+@click.option('--retries', default=3, show_default=True, help='Download attempts per file, before giving up on it.')
+def download(path: str, path_in_server: str, dry_run: bool, force: bool, workers: int, retries: int):
+    """Download all files in a folder in server (with all sub folders) to a local folder, replicating folder structure. Files already present locally (same size / checksum) are skipped."""
+    files_in_server = bot.list_files(path_in_server or "")    # Get all files inside this directory, with their folder paths.
+    if files_in_server is False:
+        click.echo(f"Something went wrong! Error: Invalid Path - {path_in_server}")
+        return
+    file_list = []  # A list of tuples, Each tuple is record, local file path.
+    click.echo("Summary of file structure that will be created, if you choose to accept it..")
+    for file_info, folder_path in files_in_server:
+        file_path = os.path.join(path, *[folder for folder in folder_path.split("/") if folder], file_info["filename"])
+        if not force and is_already_downloaded(file_path, file_info):
+            click.echo(f"Skip downloading of '{file_path}', as it is already present! Run with `--force` arg set, to force download everything.")
+            continue
+        file_list.append((file_info, file_path))
+        click.echo(f"File: {file_path}")
+    if dry_run:
+        click.echo(f"Dry run, {len(file_list)} files would be downloaded.")
+        return
+    choice = bool(input(f"You are about to download {len(file_list)} files from server. Press any key and Enter to continue..."))
+    if choice is True:
+        stats = TransferStats(len(file_list))
+        lane = bot.background_lane
+
+        def download_one(file_info: dict, file_path: str):
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with lane():    # Bulk job, Let UI requests go first.
+                for attempt in range(1, retries + 1):
+                    written, err = download_to_file(file_info, file_path)
+                    if written is not False:
+                        return written, None
+                    if attempt < retries:
+                        time.sleep(min(2 ** attempt, 30))
+            return False, err
+
+        failures = []
+        with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="download") as executor:
+            futures = {executor.submit(download_one, file_info, file_path): file_path for file_info, file_path in file_list}
+            for future in as_completed(futures):
+                written, err = future.result()
+                stats.add(written is not False, written or 0)
+                if written is False:
+                    failures.append((futures[future], err))
+                    click.echo(f"\nSomething went wrong while downloading '{futures[future]}', Error: {err}")
+                stats.report()
+        stats.report(force=True)
+        click.echo(f"Downloaded {stats.done} of {len(file_list)} files in {round(stats.elapsed, 2)} seconds!")
+        for file_path, err in failures:
+            click.echo(f"Failed: {file_path} - {err}")
+
+
+@cli.command()
+@click.option('--grace_seconds', default=None, type=int, help='Only chunks unreferenced and older than this are deleted, Default is `CHUNK_GC_GRACE_SECONDS` from env (3600).')
+def gc(grace_seconds: int):
+    """Deletes chunks in chunk store that no file refers to anymore (left behind by interrupted uploads, failed deletes), prints chunk store stats."""
+    result = bot.collect_garbage(grace_seconds)
+    click.echo(f"Deleted {result['collected_chunks']} unreferenced chunks, freed {result['freed_bytes'] / 1024 / 1024:.2f} MB.")
+    stats = bot.get_chunk_stats()
+    click.echo(f"Chunk store: {stats['chunks']} chunks, {stats['stored_bytes'] / 1024 / 1024:.2f} MB stored for {stats['referenced_bytes'] / 1024 / 1024:.2f} MB of file content (dedup ratio {stats['dedup_ratio']}).")
 
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,92 @@
+"""Compression ratio and CPU cost of each codec / level used by `COMPRESSION`, on a mixed corpus of synthetic files (logs, JSON, CSV, source, binary, already compressed media). Or on real files with `--path`.
+
+Run from repo root: `python -m benchmarks.compression_benchmark --size_mb 8`
+"""
+from utils.compression import CODECS, DEFAULT_LEVELS, SAMPLE_SIZE, is_codec_available, is_worth_compressing, compress, iter_decompressed
+import random
+import click
+import json
+import time
+import zlib
+import os
+
+WORDS = ["GET", "POST", "user", "session", "upload", "download", "schema", "error", "timeout", "retry", "cache", "folder", "file", "share", "token", "backup"]
+
+
+def build_corpus(size: int, seed: int = 7) -> dict[str, bytes]:
+    """A few `size` byte synthetic files of different kinds, named with the extension they would have."""
+    rng = random.Random(seed)
+    def fill(make_line) -> bytes:
+        lines, total = [], 0
+        while total < size:
+            line = make_line().encode('utf8')
+            lines.append(line)
+            total += len(line)
+        return b"".join(lines)[:size]
+    return {
+        "app.log": fill(lambda: f"2024-05-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d} INFO {rng.choice(WORDS)} {rng.choice(WORDS)} id={rng.randint(0, 10 ** 6)} took {rng.random():.3f}s\n"),
+        "events.json": fill(lambda: json.dumps({"id": rng.randint(0, 10 ** 9), "type": rng.choice(WORDS), "tags": rng.sample(WORDS, 3), "value": rng.random()}) + "\n"),
+        "table.csv": fill(lambda: ",".join([str(rng.randint(0, 99999)), rng.choice(WORDS), f"{rng.uniform(-1000, 1000):.2f}", rng.choice(WORDS) + rng.choice(WORDS)]) + "\n"),
+        "module.py": fill(lambda: f"    def {rng.choice(WORDS)}_{rng.randint(0, 999)}(self, {rng.choice(WORDS)}: int) -> str:\n        return self._{rng.choice(WORDS)}({rng.choice(WORDS)})\n"),
+        "disk.img": bytes(rng.getrandbits(8) if rng.random() < 0.3 else 0 for _ in range(min(size, 2 * 1024 * 1024))) * max(size // (2 * 1024 * 1024), 1),
+        "photo.jpg": rng.randbytes(size),     # Stands in for already compressed media.
+        "archive.zip": zlib.compress(rng.randbytes(size // 2) + bytes(size // 2)),
+    }
+
+
+def load_files(path: str, limit: int) -> dict[str, bytes]:
+    corpus = {}
+    for root, _, files in os.walk(path):
+        for file in files:
+            with open(os.path.join(root, file), 'rb') as local_file:
+                corpus[os.path.relpath(os.path.join(root, file), path)] = local_file.read(limit)
+    return corpus
+
+
+def measure(data: bytes, codec: str, level: int):
+    """Returns (compressed size, compress cpu seconds, decompress cpu seconds)."""
+    start = time.process_time()
+    compressed = compress(data, codec, level)
+    compress_seconds = time.process_time() - start
+    start = time.process_time()
+    plain_size = sum(len(plain) for plain in iter_decompressed([compressed[i:i + 256 * 1024] for i in range(0, len(compressed), 256 * 1024)], codec))
+    decompress_seconds = time.process_time() - start
+    assert plain_size == len(data)
+    return len(compressed), compress_seconds, decompress_seconds
+
+
+@click.command()
+@click.option('--size_mb', default=8, help='Size of each synthetic file in MB.')
+@click.option('--path', default=None, type=click.Path(exists=True, file_okay=False), help='Benchmark files in this folder instead of synthetic corpus.')
+@click.option('--levels', default=None, help='Comma separated levels to try per codec, Default is codec default + a fast & a strong level.')
+def main(size_mb: int, path: str, levels: str):
+    corpus = load_files(path, size_mb * 1024 * 1024) if path else build_corpus(size_mb * 1024 * 1024)
+    codecs = [codec for codec in CODECS if is_codec_available(codec)]
+    if len(codecs) < len(CODECS):
+        click.echo(f"Skipping codecs that are not installed: {[codec for codec in CODECS if codec not in codecs]}")
+    level_choices = {codec: sorted({1, DEFAULT_LEVELS[codec], 9 if codec == "zlib" else 19}) for codec in codecs}
+    if levels:
+        level_choices = {codec: [int(level) for level in levels.split(",")] for codec in codecs}
+    click.echo(f"{'file':<16}{'codec':<10}{'sampled':>8}{'ratio':>8}{'comp MB/s':>11}{'decomp MB/s':>13}")
+    totals = {}
+    for name, data in corpus.items():
+        size = len(data) / 1024 / 1024
+        for codec in codecs:
+            for level in level_choices[codec]:
+                compressed_size, compress_seconds, decompress_seconds = measure(data, codec, level)
+                chosen = is_worth_compressing(name, data[:SAMPLE_SIZE], codec, level)    # What upload would decide for this file.
+                total = totals.setdefault(f"{codec}-{level}", [0, 0, 0.0, 0.0])
+                total[0] += len(data)
+                total[1] += compressed_size if chosen else len(data)
+                total[2] += compress_seconds if chosen else 0
+                total[3] += decompress_seconds if chosen else 0
+                click.echo(f"{name[:15]:<16}{codec + '-' + str(level):<10}{'yes' if chosen else 'skip':>8}{len(data) / max(compressed_size, 1):>8.2f}{size / max(compress_seconds, 1e-9):>11.1f}{size / max(decompress_seconds, 1e-9):>13.1f}")
+    click.echo("\nWhole corpus, as uploads would do it (skipped files are sent as they are):")
+    click.echo(f"{'codec':<10}{'ratio':>8}{'cpu s/GB (comp)':>17}{'cpu s/GB (decomp)':>19}")
+    for key, (plain_size, stored_size, compress_seconds, decompress_seconds) in totals.items():
+        gigabytes = plain_size / 1024 ** 3
+        click.echo(f"{key:<10}{plain_size / stored_size:>8.2f}{compress_seconds / gigabytes:>17.1f}{decompress_seconds / gigabytes:>19.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""Local stand-in for the Telegram Bot API, So transfer performance can be measured (and compared over time) without telegram and it's flood limits.
+
+Implements what the app uses: `sendDocument`, `getFile`, file download, `deleteMessage` / `deleteMessages`, `copyMessage` and `getChatMembersCount`. Documents are kept in a local folder.
+Latency (added to every request), a bandwidth cap (shared by all uploads / downloads), `RetryAfter` (429) injection and an error rate (500s) are configurable, to see how app holds up on a slow / flaky telegram.
+Used by `benchmarks.throughput`, or on it's own: `python -m benchmarks.fake_bot_api --port 8081 --latency-ms 50 --bandwidth-mbps 20`,
+with `TELEGRAM_API_URL=http://127.0.0.1:8081/bot` and `TELEGRAM_FILE_URL=http://127.0.0.1:8081/file/bot` in env of the app.
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from utils.ratelimit import TokenBucket
+import urllib.parse
+import collections
+import itertools
+import threading
+import tempfile
+import random
+import shutil
+import click
+import json
+import time
+import os
+
+THROTTLE_CHUNK_SIZE = 64 * 1024     # Bytes moved per token of bandwidth cap.
+
+
+class FakeBotApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # Keep-alive, like telegram.
+    server: "FakeBotApiServer"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode('utf8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fail(self, status: int, description: str, **parameters):
+        self._reply({"ok": False, "error_code": status, "description": description, **({"parameters": parameters} if parameters else {})}, status)
+
+    def _read_body(self) -> bytes:
+        """Request body (plain or chunked transfer encoding), read within bandwidth cap."""
+        api, chunks = self.server.api, []
+        if "chunked" in self.headers.get("Transfer-Encoding", ""):
+            while (length := int(self.rfile.readline().strip() or b"0", 16)) > 0:
+                chunks.append(self.rfile.read(length))
+                self.rfile.readline()   # CRLF after chunk.
+                api.throttle(length)
+            self.rfile.readline()
+        else:
+            remaining = int(self.headers.get("Content-Length", 0))
+            while remaining > 0 and (chunk := self.rfile.read(min(remaining, THROTTLE_CHUNK_SIZE))):
+                chunks.append(chunk)
+                remaining -= len(chunk)
+                api.throttle(len(chunk))
+        body = b"".join(chunks)
+        api.count("bytes_received", len(body))
+        return body
+
+    def _parse_params(self, body: bytes) -> tuple[dict, tuple[str, bytes] | None]:
+        """Params of a call (query string, json, form or multipart fields), and the uploaded document as (file name, content) if there is one."""
+        params = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+        content_type, document = self.headers.get_content_type(), None
+        if content_type == "application/json":
+            params.update(json.loads(body or b"{}"))
+        elif content_type == "application/x-www-form-urlencoded":
+            params.update(urllib.parse.parse_qsl(body.decode('utf8')))
+        elif content_type == "multipart/form-data":
+            boundary = self.headers.get_param("boundary").encode('latin-1')
+            for part in body.split(b"--" + boundary)[1:-1]:
+                head, _, content = part.partition(b"\r\n\r\n")
+                content = content[:-2]  # CRLF before next boundary.
+                disposition = dict(item.strip().split("=", 1) for item in head.decode('utf8').split(";")[1:] if "=" in item)
+                name, file_name = disposition.get("name", "").strip('"'), disposition.get("filename", "").strip('"')
+                if file_name:
+                    document = (file_name, content)
+                else:
+                    params[name] = content.decode('utf8')
+        return params, document
+
+    def _inject_failure(self, flood_control: bool = True) -> bool:
+        """Answers with a flood control wait (Bot API calls only, file downloads don't get them) or a server error, as often as configured. True if it did."""
+        api = self.server.api
+        roll = api.random()
+        if flood_control and roll < api.retry_after_rate:
+            api.count("injected_retry_after")
+            self._fail(429, f"Too Many Requests: retry after {api.retry_after}", retry_after=api.retry_after)
+            return True
+        if roll < api.retry_after_rate + api.error_rate:
+            api.count("injected_errors")
+            self._fail(500, "Internal Server Error")
+            return True
+        return False
+
+    def do_GET(self):
+        if not self.path.startswith("/file/"):
+            return self.do_POST()
+        api = self.server.api
+        api.count("download")
+        time.sleep(api.latency)
+        if self._inject_failure(flood_control=False):
+            return
+        document_path = api.get_document_path(urllib.parse.unquote(urllib.parse.urlsplit(self.path).path).rsplit("/", 1)[-1])
+        if document_path is None:
+            return self._fail(404, "Not Found")
+        with open(document_path, 'rb') as document:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(os.fstat(document.fileno()).st_size))
+            self.end_headers()
+            while chunk := document.read(THROTTLE_CHUNK_SIZE):
+                api.throttle(len(chunk))
+                self.wfile.write(chunk)
+                api.count("bytes_sent", len(chunk))
+
+    def do_POST(self):
+        api = self.server.api
+        body = self._read_body()
+        method = urllib.parse.urlsplit(self.path).path.rsplit("/", 1)[-1]
+        api.count(method)
+        time.sleep(api.latency)
+        if self._inject_failure():
+            return
+        handler = getattr(self, f"_call_{method}", None)
+        if handler is None:
+            return self._fail(404, "Not Found")
+        params, document = self._parse_params(body)
+        try:
+            self._reply({"ok": True, "result": handler(params, document)})
+        except LookupError as err:  # Unknown file / message, as telegram reports it.
+            self._fail(400, f"Bad Request: {err.args[0]}")
+
+    def _call_getMe(self, params: dict, document):
+        return {"id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot"}
+
+    def _call_sendDocument(self, params: dict, document):
+        if document is None:
+            raise LookupError("there is no document in the request")
+        message_id, file_id = self.server.api.add_document(document[1])
+        return {"message_id": message_id, "date": int(time.time()), "chat": {"id": int(params.get("chat_id", -100)), "type": "channel"}, "caption": params.get("caption", ""),
+                "document": {"file_id": file_id, "file_unique_id": f"U{file_id}", "file_name": document[0], "file_size": len(document[1])}}
+
+    def _call_getFile(self, params: dict, document):
+        file_id = params.get("file_id", "")
+        document_path = self.server.api.get_document_path(file_id)
+        if document_path is None:
+            raise LookupError("invalid file_id")
+        return {"file_id": file_id, "file_unique_id": f"U{file_id}", "file_size": os.path.getsize(document_path), "file_path": f"documents/{file_id}"}
+
+    def _call_deleteMessage(self, params: dict, document):
+        if not self.server.api.delete_message(int(params.get("message_id", 0))):
+            raise LookupError("message to delete not found")
+        return True
+
+    def _call_deleteMessages(self, params: dict, document):
+        message_ids = params.get("message_ids", [])
+        for message_id in json.loads(message_ids) if isinstance(message_ids, str) else message_ids:
+            self.server.api.delete_message(int(message_id))
+        return True
+
+    def _call_copyMessage(self, params: dict, document):
+        api = self.server.api
+        if not api.has_message(int(params.get("message_id", 0))):
+            raise LookupError("message to copy not found")
+        if not params.get("chat_id"):
+            raise LookupError("chat not found")
+        return {"message_id": api.add_document(None)[0]}
+
+    def _call_getChatMembersCount(self, params: dict, document):
+        return self.server.api.members
+
+    _call_getChatMemberCount = _call_getChatMembersCount
+
+
+class FakeBotApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+    api: "FakeBotApi"
+
+
+class FakeBotApi:
+    """Fake Bot API server on localhost, serving in a background thread once started. Use as a context manager, or `start()` / `stop()`.\n
+       `latency` seconds are added to every request, `bandwidth` (bytes per second, 0 for no cap) is shared by everything sent / received.
+       `retry_after_rate` of Bot API calls are answered with flood control (wait `retry_after` seconds), `error_rate` of all requests with a 500. `seed` makes injected failures repeatable.
+    """
+    def __init__(self, port: int = 0, latency: float = 0.0, bandwidth: float = 0, retry_after_rate: float = 0.0, retry_after: int = 1, error_rate: float = 0.0,
+                 members: int = 2, storage_folder: str = None, seed: int = None) -> None:
+        self.latency, self.retry_after_rate, self.retry_after, self.error_rate, self.members = latency, retry_after_rate, retry_after, error_rate, members
+        self._bandwidth = TokenBucket(bandwidth / THROTTLE_CHUNK_SIZE, burst=4) if bandwidth > 0 else None
+        self._random = random.Random(seed)
+        self._owns_storage = storage_folder is None
+        self._storage_folder = storage_folder or tempfile.mkdtemp(prefix="fake_bot_api_")
+        os.makedirs(self._storage_folder, exist_ok=True)
+        self._message_ids = itertools.count(1)
+        self._messages: dict[int, str | None] = {}  # message id -> file id of it's document (None for copies).
+        self._stats = collections.Counter()
+        self._lock = threading.Lock()
+        self._server = FakeBotApiServer(("127.0.0.1", port), FakeBotApiHandler)
+        self._server.api = self
+        self.port = self._server.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}/bot"
+        self.file_url = f"http://127.0.0.1:{self.port}/file/bot"
+
+    def get_env(self) -> dict[str, str]:
+        """Env vars that point the app to this server."""
+        return {"TELEGRAM_API_URL": self.url, "TELEGRAM_FILE_URL": self.file_url}
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._owns_storage:
+            shutil.rmtree(self._storage_folder, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def reset(self):
+        """Drops every message and document (Ex: between benchmark runs), stats are kept."""
+        with self._lock:
+            file_ids, self._messages = [file_id for file_id in self._messages.values() if file_id is not None], {}
+        for file_id in file_ids:
+            os.remove(os.path.join(self._storage_folder, file_id))
+
+    def get_file_ids(self) -> list[str]:
+        with self._lock:
+            return [file_id for file_id in self._messages.values() if file_id is not None]
+
+    def random(self) -> float:
+        with self._lock:
+            return self._random.random()
+
+    def throttle(self, num_bytes: int):
+        """Waits till `num_bytes` fit in bandwidth cap."""
+        if self._bandwidth is None:
+            return
+        for _ in range(max(1, -(-num_bytes // THROTTLE_CHUNK_SIZE))):
+            self._bandwidth.acquire()
+
+    def count(self, stat: str, amount: int = 1):
+        with self._lock:
+            self._stats[stat] += amount
+
+    def get_stats(self) -> dict:
+        """Calls per method, injected failures and bytes received / sent so far."""
+        with self._lock:
+            return dict(self._stats)
+
+    def add_document(self, content: bytes | None) -> tuple[int, str | None]:
+        """Saves a document as a new message, returns a tuple of (message id, file id). `None` content adds a message without a document."""
+        with self._lock:
+            message_id = next(self._message_ids)
+        file_id = f"F{message_id}" if content is not None else None
+        if file_id is not None:
+            with open(os.path.join(self._storage_folder, file_id), 'wb') as document:
+                document.write(content)
+        with self._lock:
+            self._messages[message_id] = file_id
+        return message_id, file_id
+
+    def get_document_path(self, file_id: str) -> str | None:
+        document_path = os.path.join(self._storage_folder, os.path.basename(file_id))
+        return document_path if file_id and os.path.isfile(document_path) else None
+
+    def has_message(self, message_id: int) -> bool:
+        with self._lock:
+            return message_id in self._messages
+
+    def delete_message(self, message_id: int) -> bool:
+        """Deletes a message and it's document, False if there's no such message."""
+        with self._lock:
+            if message_id not in self._messages:
+                return False
+            file_id = self._messages.pop(message_id)
+        if file_id is not None:
+            os.remove(os.path.join(self._storage_folder, file_id))
+        return True
+
+
+@click.command()
+@click.option('--port', default=8081, help='Port to listen on (localhost).')
+@click.option('--latency-ms', default=0.0, help='Added to every request.')
+@click.option('--bandwidth-mbps', default=0.0, help='Cap on MB per second sent / received, shared by all requests. 0 for no cap.')
+@click.option('--retry-after-rate', default=0.0, help='Share of Bot API calls answered with flood control (429).')
+@click.option('--retry-after', default=1, help='Seconds a flood control answer asks to wait.')
+@click.option('--error-rate', default=0.0, help='Share of requests answered with a server error (500).')
+@click.option('--storage', default=None, help='Folder documents are kept in, Default is a temp folder removed on exit.')
+def main(port: int, latency_ms: float, bandwidth_mbps: float, retry_after_rate: float, retry_after: int, error_rate: float, storage: str):
+    with FakeBotApi(port, latency_ms / 1000, bandwidth_mbps * 1024 * 1024, retry_after_rate, retry_after, error_rate, storage_folder=storage) as api:
+        click.echo(f"Fake Bot API on {api.url}, files on {api.file_url}. Ctrl+C to stop.")
+        try:
+            while True:
+                time.sleep(60)
+                click.echo(json.dumps(api.get_stats()))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
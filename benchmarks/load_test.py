@@ -0,0 +1,155 @@
+"""Throughput of production mode (gunicorn, see `gunicorn.conf.py`) with different numbers of worker processes. App is run against a stand-in Bot API server on localhost (see `benchmarks.fake_bot_api`).
+
+Files are uploaded once, then for each worker count a gunicorn server is started on a copy of that schema folder, and `--clients` concurrent clients (keep-alive connections, logged in) download random files and load the home page for `--seconds`.
+Requests per second, p50 / p99 latency are reported per worker count. Downloads are decrypted by the worker serving them, So they're CPU bound and scale with worker processes, not with threads of a single process.
+Run from repo root: `python -m benchmarks.load_test --workers 1,2,4 --clients 16 --seconds 10`
+"""
+from benchmarks.fake_bot_api import FakeBotApi
+import multiprocessing
+import http.client
+import urllib.parse
+import subprocess
+import threading
+import tempfile
+import random
+import shutil
+import socket
+import click
+import json
+import time
+import sys
+import os
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def populate(schema_folder: str, files: int, size: int) -> None:
+    """Uploads files through `BotActions` in a separate process, So it doesn't hold schema / leader locks while servers run."""
+    from core import BotActions     # After env is set, it's read on import / init.
+    bot = BotActions(schema_filepath=os.path.join(schema_folder, "schema.json"))
+    results = bot.upload_files([(os.urandom(size), f"file_{index}.bin") for index in range(files)], "load")
+    failed = [err for success, err in results if success is False]
+    if failed:
+        raise RuntimeError(f"{len(failed)} uploads failed, Ex: {failed[0]}")
+
+
+def get_free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def wait_until_up(port: int, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("GET", "/login")
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} didn't come up in {timeout} seconds.")
+
+
+def log_in(port: int) -> str:
+    """Returns session cookie of a logged in user."""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    connection.request("POST", "/login", body=urllib.parse.urlencode({"username": os.environ.get("APP_USER_NAME", "user"), "password": os.environ.get("APP_PASSWORD", "password")}),
+                       headers={"Content-Type": "application/x-www-form-urlencoded"})
+    response = connection.getresponse()
+    response.read()
+    return response.getheader("Set-Cookie").split(";", 1)[0]
+
+
+def run_clients(port: int, cookie: str, file_ids: list[str], clients: int, seconds: float, page_ratio: float) -> tuple[list[float], int]:
+    """Each client sends requests one after another on a keep-alive connection till time is up. Returns latencies (seconds) and number of failed requests."""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+    def client():
+        connection, own = None, []
+        while time.monotonic() < deadline:
+            path = "/" if random.random() < page_ratio else f"/download/{random.choice(file_ids)}"
+            start = time.perf_counter()
+            try:
+                if connection is None:
+                    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+                connection.request("GET", path, headers={"Cookie": cookie})
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    raise http.client.HTTPException(f"status {response.status}")
+                own.append(time.perf_counter() - start)
+            except (OSError, http.client.HTTPException):
+                connection = None
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(own)
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+
+@click.command()
+@click.option('--workers', default="1,2,4", help='Comma separated gunicorn worker counts, a run for each.')
+@click.option('--threads', default=8, help='Threads per worker, same as WEB_THREADS.')
+@click.option('--clients', default=16, help='Concurrent clients.')
+@click.option('--seconds', default=10.0, help='Duration of each run.')
+@click.option('--files', default=50, help='Files uploaded before runs.')
+@click.option('--size-kb', default=512, help='Size of each file in KB.')
+@click.option('--page-ratio', default=0.2, help='Share of requests that load home page, rest are downloads.')
+@click.option('--output', default=None, help='Also write results to this json file.')
+def main(workers: str, threads: int, clients: int, seconds: float, files: int, size_kb: int, page_ratio: float, output: str):
+    api = FakeBotApi().start()
+    work_folder = tempfile.mkdtemp(prefix="load_test_")
+    os.environ.update({"API_KEY": "123:benchmark", "CHANNEL_ID": "-100", "DOWNLOAD_CACHE_SIZE_MB": "0", "RANGE_CACHE_SIZE_MB": "0", "LOGGING_LEVEL": "WARNING",
+                       **api.get_env(),
+                       "TELEGRAM_REQUESTS_PER_SECOND": "0", "TELEGRAM_CHAT_MESSAGES_PER_SECOND": "0", "WEB_CERTFILE": "", "WEB_KEYFILE": "", "WEB_THREADS": str(threads),
+                       "PYTHONPATH": os.pathsep.join(filter(None, [REPO_FOLDER, os.environ.get("PYTHONPATH")]))})
+    populate_process = multiprocessing.get_context("spawn").Process(target=populate, args=(os.path.join(work_folder, "seed", "schema"), files, size_kb * 1024))
+    populate_process.start()
+    populate_process.join()
+    file_ids = api.get_file_ids()
+    if populate_process.exitcode != 0 or not file_ids:
+        raise click.ClickException("Unable to upload files for load test.")
+    click.echo(f"{files} files of {size_kb} KB, {clients} clients, {threads} threads per worker, {seconds:.0f}s per run.")
+    click.echo(f"{'workers':>8}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'scaling':>9}")
+    results, baseline = [], None
+    for worker_count in (int(value) for value in workers.split(",")):
+        run_folder = os.path.join(work_folder, f"workers_{worker_count}")
+        shutil.copytree(os.path.join(work_folder, "seed"), run_folder)
+        port = get_free_port()
+        with open(os.path.join(run_folder, "server.log"), 'wb') as log_file:
+            gunicorn = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", os.path.join(REPO_FOLDER, "gunicorn.conf.py"), "wsgi:app"], cwd=run_folder, stdout=log_file, stderr=subprocess.STDOUT,
+                                        env={**os.environ, "WEB_WORKERS": str(worker_count), "WEB_PORT": str(port)})
+        try:
+            wait_until_up(port)
+            cookie = log_in(port)
+            run_clients(port, cookie, file_ids, clients, min(seconds, 2), page_ratio)     # Warm up, every worker loads schema, opens connections.
+            latencies, errors = run_clients(port, cookie, file_ids, clients, seconds, page_ratio)
+        finally:
+            gunicorn.terminate()
+            gunicorn.wait(timeout=30)
+        rate = len(latencies) / seconds
+        baseline = baseline or rate
+        results.append({"workers": worker_count, "requests": len(latencies), "errors": errors, "requests_per_second": rate, "p50_ms": percentile(latencies, 0.5) * 1000, "p99_ms": percentile(latencies, 0.99) * 1000})
+        click.echo(f"{worker_count:>8}{len(latencies):>10}{errors:>8}{rate:>9.1f}{results[-1]['p50_ms']:>9.1f}{results[-1]['p99_ms']:>9.1f}{rate / baseline:>8.2f}x")
+    if output:
+        with open(output, 'w') as output_file:
+            json.dump({"files": files, "size_kb": size_kb, "clients": clients, "threads": threads, "seconds": seconds, "cpus": os.cpu_count(), "runs": results}, output_file, indent=2)
+    api.stop()
+    shutil.rmtree(work_folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
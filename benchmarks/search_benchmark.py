@@ -0,0 +1,73 @@
+"""Query latency of the search index used by `/search/`, on a synthetic catalog. Compared against a full scan of the schema (how search used to work).
+
+Run from repo root: `python -m benchmarks.search_benchmark --files 1000000`
+"""
+from utils.search import SearchIndex
+import resource
+import random
+import click
+import time
+
+WORDS = ["report", "invoice", "holiday", "photo", "scan", "backup", "notes", "draft", "final", "budget", "resume", "movie", "song", "album",
+         "project", "design", "meeting", "contract", "receipt", "statement", "family", "trip", "birthday", "wedding", "archive", "export"]
+EXTENSIONS = ["pdf", "jpg", "png", "mp4", "mkv", "docx", "xlsx", "txt", "zip", "mp3", "csv", "json"]
+
+
+def build_catalog(file_count: int, seed: int = 7):
+    """Yields (record, folder_path) for `file_count` synthetic files spread over a few thousand folders."""
+    rng = random.Random(seed)
+    folders = [f"{rng.choice(WORDS)}/{year}/{rng.choice(WORDS)}_{n}" for n, year in ((n, rng.randint(2010, 2024)) for n in range(max(file_count // 300, 1)))]
+    for message_id in range(file_count):
+        file_name = f"{rng.choice(WORDS)}_{rng.choice(WORDS)}_{rng.randint(0, 99999):05d}.{rng.choice(EXTENSIONS)}"
+        yield {"filename": file_name, "message_id": message_id, "file_id": f"F{message_id}", "size": "1MB"}, rng.choice(folders)
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+@click.command()
+@click.option('--files', default=1000000, help='Number of files in synthetic catalog.')
+@click.option('--repeat', default=20, help='Number of times each query is run.')
+@click.option('--limit', default=50, help='Results per page, same as SEARCH_PAGE_SIZE.')
+def main(files: int, repeat: int, limit: int):
+    index = SearchIndex()
+    catalog = []
+    start = time.perf_counter()
+    for record, folder_path in build_catalog(files):
+        index.add_file(record, folder_path)
+        catalog.append((record, folder_path))
+    build_seconds = time.perf_counter() - start
+    click.echo(f"Indexed {files} files in {build_seconds:.1f}s, peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+    queries = {
+        "substring, common": dict(text="report"),
+        "substring, rare": dict(text="_01234."),
+        "substring, no match": dict(text="qqqzzz"),
+        "prefix": dict(text="holiday_bud", prefix=True),
+        "extension only": dict(extension="mkv"),
+        "substring + extension": dict(text="invoice", extension="pdf"),
+        "substring + path": dict(text="photo", path="backup"),
+        "page 10": dict(text="scan", offset=9 * limit),
+        "2 chars (full scan)": dict(text="zq"),
+    }
+    click.echo(f"{'query':<24}{'p50 ms':>10}{'p99 ms':>10}{'results':>9}")
+    for name, query in queries.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results, _ = index.search(limit=limit, **query)
+            timings.append((time.perf_counter() - start) * 1000)
+        click.echo(f"{name:<24}{percentile(timings, 50):>10.3f}{percentile(timings, 99):>10.3f}{len(results):>9}")
+
+    timings = []
+    for _ in range(min(repeat, 3)):   # Old way: lower case, compare every file name in schema.
+        start = time.perf_counter()
+        results = [record for record, _ in catalog if "_01234." in record["filename"].lower()]
+        timings.append((time.perf_counter() - start) * 1000)
+    click.echo(f"{'full scan (old search)':<24}{percentile(timings, 50):>10.3f}{percentile(timings, 99):>10.3f}{len(results):>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""End to end transfer throughput against a local stand-in Bot API (see `benchmarks.fake_bot_api`), for each file size mix, concurrency level and way of driving the app:
+
+- `core`:  `BotActions.upload_file` / `stream_file`, called from `--concurrency` threads.
+- `async`: `AsyncBotActions.upload` / `download`, `--concurrency` at a time on one event loop.
+- `web`:   Flask routes in `bot.py` (`/upload/` one file per request, `/download/<file_id>`) through test clients, one per thread. No network / TLS in between.
+- `cli`:   `backupper.py upload` / `download` as a subprocess with `--workers` set to concurrency level. Timings include process start up, per file latency isn't known.
+
+Each run is done in a fresh process on an empty schema folder, So peak RSS is of that run alone. Upload and download phases report files/s, MB/s, p50 / p99 latency per file and errors.
+Results are written as json (`--output`), `--compare` prints change in MB/s from an earlier results file. Download cache is disabled, rate limits are off unless `--rate-limits`.
+Run from repo root: `python -m benchmarks.throughput --mixes small,large --concurrency 1,8 --targets core,web,cli --latency-ms 20 --output results.json`
+"""
+from benchmarks.fake_bot_api import FakeBotApi
+from benchmarks.load_test import percentile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime
+import multiprocessing
+import subprocess
+import threading
+import resource
+import tempfile
+import platform
+import asyncio
+import shutil
+import click
+import json
+import time
+import sys
+import os
+import re
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KB, MB = 1024, 1024 * 1024
+MIXES = {   # name -> [(file size, number of files)]
+    "small": [(64 * KB, 200)],
+    "medium": [(2 * MB, 40)],
+    "large": [(40 * MB, 2)],   # Multi-part files.
+    "mixed": [(64 * KB, 100), (2 * MB, 20), (25 * MB, 1)],
+}
+TARGETS = ("core", "async", "web", "cli")
+
+
+def make_files(folder: str, mix: list[tuple[int, int]], scale: float) -> list[tuple[str, int]]:
+    """Writes files of a mix (random content, So nothing compresses or dedups), returns a list of (file path, size)."""
+    os.makedirs(folder, exist_ok=True)
+    files = []
+    for file_size, count in mix:
+        for index in range(max(int(count * scale), 1)):
+            file_path = os.path.join(folder, f"file_{file_size}_{index}.bin")
+            with open(file_path, 'wb') as local_file:
+                for start in range(0, file_size, MB):
+                    local_file.write(os.urandom(min(MB, file_size - start)))
+            files.append((file_path, file_size))
+    return files
+
+
+def get_rss() -> int:
+    """Current resident set size of this process in bytes (Linux)."""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def measure(items: list, concurrency: int, transfer) -> dict:
+    """Calls `transfer(item)` (returns bytes moved, raises / returns False on failure) for every item from `concurrency` threads. Returns phase results."""
+    latencies, errors, moved = [], [], 0
+    lock = threading.Lock()
+    def run(item):
+        nonlocal moved
+        start = time.perf_counter()
+        try:
+            num_bytes = transfer(item)
+            if num_bytes is False:
+                raise RuntimeError("transfer failed")
+        except Exception as err:
+            with lock:
+                errors.append(str(err))
+            return
+        with lock:
+            latencies.append(time.perf_counter() - start)
+            moved += num_bytes
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run, items))
+    return summarize(latencies, errors, moved, time.perf_counter() - start)
+
+
+async def measure_async(items: list, concurrency: int, transfer) -> dict:
+    """`measure()` for a coroutine `transfer`, `concurrency` at a time on current event loop."""
+    latencies, errors, moved, slots = [], [], 0, asyncio.Semaphore(concurrency)
+    async def run(item):
+        nonlocal moved
+        async with slots:
+            start = time.perf_counter()
+            try:
+                num_bytes = await transfer(item)
+                if num_bytes is False:
+                    raise RuntimeError("transfer failed")
+            except Exception as err:
+                errors.append(str(err))
+                return
+            latencies.append(time.perf_counter() - start)
+            moved += num_bytes
+    start = time.perf_counter()
+    await asyncio.gather(*(run(item) for item in items))
+    return summarize(latencies, errors, moved, time.perf_counter() - start)
+
+
+def summarize(latencies: list[float], errors: list[str], moved: int, seconds: float, files: int = None) -> dict:
+    files = len(latencies) if files is None else files
+    return {"files": files, "bytes": moved, "seconds": round(seconds, 3), "files_per_second": round(files / seconds, 2), "mb_per_second": round(moved / MB / seconds, 2),
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 1) if latencies else None, "p99_ms": round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+            "errors": len(errors), **({"error_sample": errors[0]} if errors else {})}
+
+
+def read_all(chunks) -> int:
+    return sum(len(chunk) for chunk in chunks)
+
+
+def run_core(files: list[tuple[str, int]], concurrency: int) -> dict:
+    from core import BotActions     # After env is set, it's read on import / init.
+    bot = BotActions()
+    def upload(item):
+        with open(item[0], 'rb') as local_file:
+            success, file_id = bot.upload_file(local_file, os.path.basename(item[0]), directory="bench")
+        return item[1] if success else False
+    def download(file_id: str):
+        stream, err = bot.stream_file(file_id)
+        if stream is False:
+            raise RuntimeError(err)
+        return read_all(stream)
+    results = {"baseline_rss_mb": get_rss() / MB, "upload": measure(files, concurrency, upload)}
+    results["download"] = measure([record["file_id"] for record, _ in bot.list_files("bench")], concurrency, download)
+    return results
+
+
+def run_async(files: list[tuple[str, int]], concurrency: int) -> dict:
+    from core import AsyncBotActions
+    bot = AsyncBotActions()
+    async def upload(item):
+        with open(item[0], 'rb') as local_file:
+            success, file_id = await bot.upload(local_file, os.path.basename(item[0]), directory="bench")
+        return item[1] if success else False
+    async def download(file_id: str):
+        return sum([len(chunk) async for chunk in bot.download(file_id)])
+    async def run() -> dict:
+        try:
+            results = {"baseline_rss_mb": get_rss() / MB, "upload": await measure_async(files, concurrency, upload)}
+            results["download"] = await measure_async([record["file_id"] for record, _ in bot.list_files("bench")], concurrency, download)
+            return results
+        finally:
+            await bot.close()
+    return asyncio.run(run())
+
+
+def run_web(files: list[tuple[str, int]], concurrency: int) -> dict:
+    import bot as web     # Creates it's `BotActions` on import.
+    web.app.config["TESTING"] = True
+    clients = threading.local()
+    def get_client():
+        if not hasattr(clients, "client"):
+            clients.client = web.app.test_client()
+            clients.client.post("/login", data={"username": os.environ.get("APP_USER_NAME", "user"), "password": os.environ.get("APP_PASSWORD", "password")})
+        return clients.client
+    def upload(item):
+        with open(item[0], 'rb') as local_file:
+            response = get_client().post("/upload/", data={"upload_file": (local_file, os.path.basename(item[0])), "target_directory": "bench"}, content_type="multipart/form-data")
+        if response.status_code != 302:
+            raise RuntimeError(f"status {response.status_code}")
+        return item[1]
+    def download(file_id: str):
+        response = get_client().get(f"/download/{file_id}", buffered=False)
+        try:
+            if response.status_code != 200 or response.mimetype != "application/octet-stream":
+                raise RuntimeError(f"status {response.status_code}")
+            return read_all(response.iter_encoded())
+        finally:
+            response.close()
+    results = {"baseline_rss_mb": get_rss() / MB, "upload": measure(files, concurrency, upload)}
+    records = web.bot.list_files("bench")
+    results["upload"]["errors"] += len(files) - len(records)     # Route redirects even if an upload failed, failures are the files missing in schema.
+    results["download"] = measure([record["file_id"] for record, _ in records], concurrency, download)
+    return results
+
+
+def run_cli(files: list[tuple[str, int]], concurrency: int) -> dict:
+    backupper = [sys.executable, os.path.join(REPO_FOLDER, "backupper.py")]
+    start = time.perf_counter()
+    process = subprocess.run([*backupper, "upload", "--path", os.path.dirname(files[0][0]), "--path_in_server", "bench", "--workers", str(concurrency)],
+                             input="y\n", capture_output=True, text=True)
+    upload_seconds = time.perf_counter() - start
+    uploaded = re.search(r"Successfully uploaded (\d+) files", process.stdout)
+    uploaded = int(uploaded.group(1)) if uploaded else 0
+    errors = [] if uploaded == len(files) else [process.stderr.strip().splitlines()[-1] if process.stderr.strip() else f"{len(files) - uploaded} files not uploaded"] * (len(files) - uploaded)
+    results = {"upload": summarize([], errors, sum(file_size for _, file_size in files[:uploaded]), upload_seconds, files=uploaded)}
+    download_folder = os.path.abspath("downloads")
+    start = time.perf_counter()
+    process = subprocess.run([*backupper, "download", "--path", download_folder, "--path_in_server", "bench", "--workers", str(concurrency)], input="y\n", capture_output=True, text=True)
+    download_seconds = time.perf_counter() - start
+    downloaded = [os.path.join(root, name) for root, _, names in os.walk(download_folder) for name in names]
+    errors = [] if len(downloaded) == uploaded else [process.stderr.strip().splitlines()[-1] if process.stderr.strip() else f"{uploaded - len(downloaded)} files not downloaded"] * (uploaded - len(downloaded))
+    results["download"] = summarize([], errors, sum(os.path.getsize(file_path) for file_path in downloaded), download_seconds, files=len(downloaded))
+    return results
+
+
+def run(target: str, files: list[tuple[str, int]], concurrency: int, run_folder: str) -> dict:
+    """A single run, in a fresh (spawned) process. Peak RSS is of this process, or of the CLI processes it ran."""
+    os.makedirs(run_folder, exist_ok=True)
+    os.chdir(run_folder)    # App keeps schema / cache in `./schema`, `./cache`.
+    sys.path.insert(0, REPO_FOLDER)
+    results = {"core": run_core, "async": run_async, "web": run_web, "cli": run_cli}[target](files, concurrency)
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if target == "cli" else resource.RUSAGE_SELF)
+    results["peak_rss_mb"] = round(usage.ru_maxrss / 1024, 1)    # ru_maxrss is in KB on Linux.
+    results["baseline_rss_mb"] = round(results.get("baseline_rss_mb", 0), 1) or None
+    return results
+
+
+def get_git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_FOLDER, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_previous(file_path: str) -> dict:
+    """MB/s of an earlier results file, by (target, mix, concurrency, phase)."""
+    with open(file_path) as previous_file:
+        previous = json.load(previous_file)
+    return {(result["target"], result["mix"], result["concurrency"], phase): result[phase]["mb_per_second"] for result in previous["runs"] for phase in ("upload", "download") if phase in result}
+
+
+@click.command()
+@click.option('--mixes', default="small,medium,large", help=f'Comma separated file size mixes: {", ".join(MIXES)}.')
+@click.option('--concurrency', default="1,4,16", help='Comma separated concurrency levels, a run for each.')
+@click.option('--targets', default=",".join(TARGETS), help=f'Comma separated ways of driving the app: {", ".join(TARGETS)}.')
+@click.option('--scale', default=1.0, help='Multiplies number of files in each mix.')
+@click.option('--latency-ms', default=0.0, help='Fake Bot API: added to every request.')
+@click.option('--bandwidth-mbps', default=0.0, help='Fake Bot API: cap on MB per second, shared by all transfers. 0 for no cap.')
+@click.option('--retry-after-rate', default=0.0, help='Fake Bot API: share of Bot API calls answered with flood control.')
+@click.option('--retry-after', default=1, help='Fake Bot API: seconds a flood control answer asks to wait.')
+@click.option('--error-rate', default=0.0, help='Fake Bot API: share of requests answered with a server error.')
+@click.option('--seed', default=7, help='Seed of injected failures.')
+@click.option('--encrypted/--plain', default=True, help='Encrypt uploads (FILE_ENCRYPTION).')
+@click.option('--rate-limits', is_flag=True, default=False, help="Keep app's telegram rate limits (env / defaults), they're off by default.")
+@click.option('--output', default=None, help='Results json file, Default is throughput_<date>.json in current folder.')
+@click.option('--compare', default=None, help='Earlier results json file, change in MB/s is shown for matching runs.')
+def main(mixes: str, concurrency: str, targets: str, scale: float, latency_ms: float, bandwidth_mbps: float, retry_after_rate: float, retry_after: int, error_rate: float,
+         seed: int, encrypted: bool, rate_limits: bool, output: str, compare: str):
+    mixes, levels, targets = mixes.split(","), [int(value) for value in concurrency.split(",")], targets.split(",")
+    unknown = [name for name in mixes if name not in MIXES] + [name for name in targets if name not in TARGETS]
+    if unknown:
+        raise click.BadParameter(f"Unknown mix / target: {', '.join(unknown)}")
+    previous = load_previous(compare) if compare else {}
+    work_folder = tempfile.mkdtemp(prefix="throughput_")
+    api_options = {"latency": latency_ms / 1000, "bandwidth": bandwidth_mbps * MB, "retry_after_rate": retry_after_rate, "retry_after": retry_after, "error_rate": error_rate}
+    api = FakeBotApi(**api_options, storage_folder=os.path.join(work_folder, "telegram"), seed=seed).start()
+    os.environ.update({"API_KEY": "123:benchmark", "CHANNEL_ID": "-100", "DOWNLOAD_CACHE_SIZE_MB": "0", "RANGE_CACHE_SIZE_MB": "0", "FILE_ENCRYPTION": str(encrypted),
+                       "PYTHONPATH": os.pathsep.join(filter(None, [REPO_FOLDER, os.environ.get("PYTHONPATH")])), **api.get_env()})
+    if not rate_limits:
+        os.environ.update({"TELEGRAM_REQUESTS_PER_SECOND": "0", "TELEGRAM_CHAT_MESSAGES_PER_SECOND": "0"})
+    report = {"started": datetime.now().isoformat(timespec="seconds"), "commit": get_git_commit(), "python": platform.python_version(), "cpus": os.cpu_count(),
+              "scale": scale, "encrypted": encrypted, "rate_limits": rate_limits, "api": api_options, "runs": []}
+    click.echo(f"{'target':>7}{'mix':>8}{'conc':>6}{'phase':>10}{'files':>7}{'files/s':>9}{'MB/s':>8}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}{'peak RSS MB':>13}{'vs prev':>9}")
+    try:
+        for mix in mixes:
+            files = make_files(os.path.join(work_folder, "data", mix), MIXES[mix], scale)
+            for level in levels:
+                for target in targets:
+                    calls_before = api.get_stats()
+                    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                        result = executor.submit(run, target, files, level, os.path.join(work_folder, "runs", f"{target}_{mix}_{level}")).result()
+                    result = {"target": target, "mix": mix, "concurrency": level, **result,
+                              "api_calls": {stat: count - calls_before.get(stat, 0) for stat, count in api.get_stats().items() if count != calls_before.get(stat, 0)}}
+                    report["runs"].append(result)
+                    for phase in ("upload", "download"):
+                        stats, before = result[phase], previous.get((target, mix, level, phase))
+                        change = f"{stats['mb_per_second'] / before:>8.2f}x" if before else f"{'-':>9}"
+                        click.echo(f"{target:>7}{mix:>8}{level:>6}{phase:>10}{stats['files']:>7}{stats['files_per_second']:>9.1f}{stats['mb_per_second']:>8.1f}"
+                                   f"{stats['p50_ms'] if stats['p50_ms'] is not None else '-':>9}{stats['p99_ms'] if stats['p99_ms'] is not None else '-':>9}{stats['errors']:>8}{result['peak_rss_mb']:>13.1f}{change}")
+                    shutil.rmtree(os.path.join(work_folder, "runs", f"{target}_{mix}_{level}"), ignore_errors=True)
+                    api.reset()
+            shutil.rmtree(os.path.join(work_folder, "data", mix), ignore_errors=True)
+    finally:
+        api.stop()
+        shutil.rmtree(work_folder, ignore_errors=True)
+    output = output or f"throughput_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    click.echo(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
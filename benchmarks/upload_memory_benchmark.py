@@ -0,0 +1,120 @@
+"""Memory used by a burst of concurrent uploads (Ex: several users uploading from UI at once). Uploads go through `BotActions.upload_file` to a stand-in Bot API server on localhost, which reads and drops what it's sent.
+
+Peak RSS above baseline is reported per burst. With streaming uploads it should stay about the same as files get bigger, it depends on number of uploads and `UPLOAD_WORKERS`, not on file size.
+Run from repo root: `python -m benchmarks.upload_memory_benchmark --uploads 8 --sizes 16,64`
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import itertools
+import threading
+import tempfile
+import click
+import json
+import time
+import os
+
+MESSAGE_IDS = itertools.count(1)
+
+
+class StubBotApi(BaseHTTPRequestHandler):
+    """Answers `sendDocument` with a message for the document it read (content is dropped as it's read), anything else with `2` (Ex: member count)."""
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        remaining, received = int(self.headers.get("Content-Length", 0)), 0
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 256 * 1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            received += len(chunk)
+        result = 2
+        if self.path.endswith("/sendDocument"):
+            message_id = next(MESSAGE_IDS)
+            result = {"message_id": message_id, "date": int(time.time()), "chat": {"id": -100, "type": "channel"},
+                      "document": {"file_id": f"F{message_id}", "file_unique_id": f"U{message_id}", "file_size": received}}
+        body = json.dumps({"ok": True, "result": result}).encode('utf8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST
+
+
+def get_rss() -> int:
+    """Current resident set size of this process in bytes (Linux)."""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class RssSampler:
+    """Samples RSS every few milliseconds in background, keeps the peak."""
+    def __init__(self, interval: float = 0.005) -> None:
+        self._interval, self.peak = interval, 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, get_rss())
+            time.sleep(self._interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+
+def make_file(folder: str, size: int) -> str:
+    file_path = os.path.join(folder, f"upload_{size}.bin")
+    with open(file_path, 'wb') as local_file:
+        for start in range(0, size, 1024 * 1024):
+            local_file.write(os.urandom(min(1024 * 1024, size - start)))
+    return file_path
+
+
+@click.command()
+@click.option('--uploads', default=8, help='Concurrent uploads in a burst.')
+@click.option('--sizes', default="16,64", help='Comma separated file sizes in MB, a burst is run for each.')
+@click.option('--workers', default=4, help='Parts uploaded in parallel per file, same as UPLOAD_WORKERS.')
+def main(uploads: int, sizes: str, workers: int):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubBotApi)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    work_folder = tempfile.mkdtemp(prefix="upload_benchmark_")
+    os.environ.update({"API_KEY": "123:benchmark", "CHANNEL_ID": "-100", "UPLOAD_WORKERS": str(workers), "DOWNLOAD_CACHE_SIZE_MB": "0",
+                       "TELEGRAM_API_URL": f"http://127.0.0.1:{server.server_address[1]}/bot", "TELEGRAM_REQUESTS_PER_SECOND": "0", "TELEGRAM_CHAT_MESSAGES_PER_SECOND": "0"})
+    from core import BotActions     # After env is set, it's read on import / init.
+    bot = BotActions(schema_filepath=os.path.join(work_folder, "schema", "schema.json"))
+    click.echo(f"{'file MB':>8}{'uploads':>9}{'seconds':>9}{'MB/s':>8}{'peak RSS MB':>13}{'over baseline MB':>18}{'MB per upload':>15}")
+    for size_mb in (int(value) for value in sizes.split(",")):
+        file_path = make_file(work_folder, size_mb * 1024 * 1024)
+        errors = []
+        def upload(index: int):
+            with open(file_path, 'rb') as local_file:
+                success, err = bot.upload_file(local_file, f"burst_{size_mb}_{index}.bin")
+            if success is False:
+                errors.append(err)
+        baseline = get_rss()
+        threads = [threading.Thread(target=upload, args=(index,)) for index in range(uploads)]
+        start = time.perf_counter()
+        with RssSampler() as sampler:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        seconds = time.perf_counter() - start
+        os.remove(file_path)
+        if errors:
+            click.echo(f"{len(errors)} uploads failed, Ex: {errors[0]}")
+        growth = max(sampler.peak - baseline, 0) / 1024 / 1024
+        click.echo(f"{size_mb:>8}{uploads:>9}{seconds:>9.2f}{size_mb * uploads / seconds:>8.1f}{sampler.peak / 1024 / 1024:>13.1f}{growth:>18.1f}{growth / uploads:>15.2f}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,10 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file, jsonify, flash
+from flask import Flask, render_template, request, redirect, url_for, jsonify, flash, Response
 from flask_login import LoginManager, login_user, UserMixin, login_required, logout_user
-from threading import Thread
 from dotenv import load_dotenv
 from core import BotActions
 from datetime import datetime
-from utils.functions import manage_file_shares
-import io
+from utils.functions import get_content_disposition
+from utils.shares import ShareStore
 import os
 import ssl
 import logging
@@ -15,16 +14,15 @@ logger = logging.getLogger()
 # Fetch temporary user credentials for app login, chosen by user, set to default if unspecified.
 temp_app_username = os.getenv("APP_USER_NAME", "user")
 temp_app_password = os.getenv("APP_PASSWORD", "password")
-shared_files_dict = {}    # The file_id of files that were enabled to be shared by user. [Everyone can access these files using a unique link, unique to each file.] key is file id, value is a dictionary with details like expiry date etc..,.
-context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
-context.load_cert_chain('certs/cert.pem', 'certs/key.pem')
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'  # Optional for now, For Sake of flash messages.
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'  # Specify the login route, otherwise auto-redirect to login page won't work.
-Thread(target=manage_file_shares, args=(shared_files_dict, ), daemon=True).start()  #  start thread for monitoring, enforcing time limit for each file shared.
 file_encryption_choice: bool = True if os.getenv("FILE_ENCRYPTION", "True").upper() == "TRUE" else False    # User can set this option from env, default is true if nothing is selected.
 bot = BotActions(encrypted=file_encryption_choice)  # Core telegram interaction functions.
+# Files enabled to be shared by user. [Everyone can access these files using a unique link, unique to each file.] Kept next to schema, So shares survive restarts and are same for every worker process.
+shares = ShareStore(os.path.join(os.path.dirname(bot._schema_filepath) or ".", "shares.db"), expiry_seconds=int(os.getenv("SHARE_EXPIRY_MINUTES", 100)) * 60, attempts=int(os.getenv("SHARE_MAX_ATTEMPTS", 2)))
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 50))   # Number of files listed per page in search results.
 
 class User(UserMixin):
     def __init__(self, user_id):
@@ -60,36 +58,26 @@ def logout():
     flash('Logout successful!', 'success')
     return redirect(url_for('login'))
 
-@app.before_request
-def block_on_validation_in_progress():
-    """call this function in first line of each route, to block traffic during schema validation process. To maintain schema.json integrity."""
-    if bot.is_validation_active() is True:
-        return jsonify({"message": "No action allowed this time, A validation Job is in progress. Kindly come back later!"}), 404
-
 # Flask routes
 @app.route('/', methods=['GET'])
 @login_required
 def index():
-    block_on_validation_in_progress()
     _, security_warning = bot.get_active_users_in_channel()  # Security warning is displayed in index page if not none.
     directory = request.args.get('target_directory', None)  # Directory to navigate to.
     if directory is None:   # If dir not specified, use home.
-        folders = list(bot._schema.keys())
-        folders.remove("root")  # reserved for storing files.
-        folders.remove("meta")  # reserved for metadata in root.
-        return render_template('index.html', files=bot._schema["root"], folders=folders, working_directory="", total_size=bot._schema["meta"]["total_size"], last_validated=str(datetime.fromtimestamp(bot._schema["meta"]["last_validated"])) if isinstance(bot._schema["meta"]["last_validated"], float) else bot._schema["meta"]["last_validated"], security_warning=security_warning)
+        files, folders, _ = bot.get_directory_listing("")  # "root" (files), "meta" (metadata) keys are left out of folders.
+        meta = bot.get_schema_meta()
+        return render_template('index.html', files=files, folders=folders, working_directory="", total_size=meta["total_size"], last_validated=str(datetime.fromtimestamp(meta["last_validated"])) if isinstance(meta["last_validated"], float) else meta["last_validated"], security_warning=security_warning)
     else:   # BUG: Write re-usable function to sanitize file paths.
-        _, ret_structure, err = bot._ops.get_contents_in_directory(directory, bot._schema.copy(), files_only=False)  # get dict item from schema in a given directory path. COntains both files and folders.
-        if ret_structure is not False:
-            folders = list(ret_structure.keys())
-            folders.remove("root")
+        files, folders, err = bot.get_directory_listing(directory)  # files, folders in a given directory path.
+        if files is not False:
             directory_parts = []
             path_str = ""
             for path_item in directory.split('/'):  # Building breadcrumb target_directory paths for easy navigation.
                 if path_item != "":  # If path_item is "", an extra / is displayed in breadcrumb. We don;t even allow empty folder names to be created anyway.
                     path_str = path_str + '/' + path_item
                     directory_parts.append((path_item, path_str))   # read same way in template. path_item is folder name displayed in bread crumb (ex: sample), path_str is full path to reach that folder (ex: /bkp/folder/sample).
-            return render_template('index.html', files=ret_structure["root"], folders=folders, working_directory=directory, directory_parts=directory_parts, security_warning=security_warning)   # working_directory is passed so that delete requests, further folder navigation is based on this current working directory.
+            return render_template('index.html', files=files, folders=folders, working_directory=directory, directory_parts=directory_parts, security_warning=security_warning)   # working_directory is passed so that delete requests, further folder navigation is based on this current working directory.
         return jsonify({"error": err})
 
 @app.route('/bulk-upload/', methods=['GET'])    # For full folder uploads.
@@ -101,24 +89,27 @@ def bulk():
 @app.route('/upload/', methods=['POST'])
 @login_required
 def upload():
-    block_on_validation_in_progress()
     files = request.files.getlist('upload_file')
     target_directory = request.form.get('target_directory', "")  # It will be uploaded to root folder if nothing is specified.
     logger.debug(f"Request received for uploading {len(files)} file[s] to directory: {target_directory}")
     success_count = 0
     error_messages = []
     if len(files) > 0:
-        for file in files:
-            if file.filename and file.content_type:  # Upload button click without attaching any files should fail this check.
-                success, error_message = bot.upload_file(file, file.filename, directory=target_directory)   # On success we get, True, file_id
-                if success:
-                    success_count += 1
-                else:   # on failure we get false, error_message
-                    error_messages.append(error_message)
-                    logger.error(f"Failed to upload file {file.filename}, Error: {str(error_message)}")
+        valid_files = [file for file in files if file.filename and file.content_type]  # Upload button click without attaching any files should fail this check.
+        if len(valid_files) < len(files):
+            flash("Please select at-least one file to upload!", "danger")
+            logger.warning(f"Rejected a bad file-upload request! Potential empty file / wrong file type content.")
+        if len(valid_files) > 1:    # Several files are uploaded by a background job, page doesn't wait for them.
+            job_id = bot.upload_files_in_background([(file, file.filename) for file in valid_files], directory=target_directory)
+            flash(f"Uploading {len(valid_files)} files in background, see /jobs/{job_id}/ for progress.", "success")
+            return redirect(f"{url_for('index')}?target_directory={target_directory}")
+        # On success we get, True, file_id, on failure false, error_message.
+        for file, (success, error_message) in zip(valid_files, bot.upload_files([(file, file.filename) for file in valid_files], directory=target_directory)):
+            if success:
+                success_count += 1
             else:
-                flash("Please select at-least one file to upload!", "danger")
-                logger.warning(f"Rejected a bad file-upload request! Potential empty file / wrong file type content.")
+                error_messages.append(error_message)
+                logger.error(f"Failed to upload file {file.filename}, Error: {str(error_message)}")
         if success_count == len(files):
             flash("Recent Upload of File[s] Successful!", "success")
         else:
@@ -127,25 +118,46 @@ def upload():
     flash("Please select at-least one file to upload!!", "warning")
     return redirect(f"{url_for('index')}?target_directory={target_directory}")
 
+def stream_download(file_id: str):
+    """Builds a streaming download response for a file. Honours `Range` / `If-Range` request headers, only the requested span is fetched, decrypted and sent (206 Partial Content).\n
+       Returns a tuple of (response, None) or (None, error).
+    """
+    file_info, err = bot.get_download_info(file_id)
+    if file_info is False:
+        return None, err
+    total_size = file_info["total_size"]
+    headers = {"Content-Disposition": get_content_disposition(file_info["file_name"]), "ETag": f'"{file_info["etag"]}"', "Accept-Ranges": "bytes" if total_size is not None else "none"}
+    if_range = request.if_range
+    range_applies = (if_range.etag is None and if_range.date is None) or if_range.etag == file_info["etag"]    # If file changed since client's last partial download, send whole file.
+    if request.range is not None and total_size is not None and range_applies:
+        byte_range = request.range.range_for_length(total_size)     # (start, end) or None if not satisfiable. Multiple ranges in a single request are not supported, whole file is sent for those.
+        if byte_range is None and len(request.range.ranges) == 1:
+            return Response(status=416, headers={"Content-Range": f"bytes */{total_size}"}), None
+        if byte_range is not None:
+            file_stream, err = bot.stream_file(file_id, byte_range=byte_range)
+            if file_stream is False:
+                return None, err
+            headers.update({"Content-Range": f"bytes {byte_range[0]}-{byte_range[1] - 1}/{total_size}", "Content-Length": str(byte_range[1] - byte_range[0])})
+            return Response(file_stream, status=206, mimetype="application/octet-stream", headers=headers), None
+    file_stream, err = bot.stream_file(file_id)
+    if file_stream is False:
+        return None, err
+    if total_size is not None:
+        headers["Content-Length"] = str(total_size)
+    return Response(file_stream, mimetype="application/octet-stream", headers=headers), None   # streamed to user as it comes from telegram, with out saving locally.
+
 @app.route('/download/<file_id>')
 @login_required
 def file_download(file_id):
-    block_on_validation_in_progress()
-    file_content, file_name_or_error = bot.download_file(file_id)
-    if file_content:
-        file_info: list = bot._ops.find_record_by_attribute(bot._schema.copy(), "file_id", file_id)   # Iteratively get file info from schema, use file_id as attribute for matching.
-        if len(file_info) > 1:
-            logger.warning(f"Multiple file records are found on a single `file_id`, Schema may have been tampered manually, resulting in duplicated file records!!")
-        file_info = file_info[0]  # recent change to `find_record_by_attribute``= returns not just single file record, but as a list of identical structured file records. For now let's select first record, warn if multiple records are found for a single file id.
-        file_name = file_info["filename"] if file_info else file_name_or_error  # If search returned a record, use file name from record. else some default name taken from telegram(Most usually it will be wrong).
-        return send_file(io.BytesIO(file_content), as_attachment=True, download_name=file_name)  # same is reverted to user, with out saving locally.
+    response, err = stream_download(file_id)   # File name is read from schema record, if one is found for this file id.
+    if response is not None:
+        return response
     else:
-        return jsonify({"message": f"Error Downloading the file: {file_name_or_error}"})
+        return jsonify({"message": f"Error Downloading the file: {err}"})
 
 @app.route('/delete/<message_id>', methods=['POST'])
 @login_required
 def delete(message_id):
-    block_on_validation_in_progress()
     logger.debug(f"Attempting to delete files in message with ID: {message_id}!")
     target_directory = request.form.get('target_directory', "")
     success, err = bot.delete_file(target_directory, message_id)     # supply directory where file is located, message id to delete. [Feature: Add support for deleting message id with out mentioning directory. (needs iterative search)]
@@ -162,13 +174,13 @@ def delete(message_id):
 def delete_folder():
     folder_path = request.form.get('delete_folder', None)   # Which folder must be deleted?
     if folder_path is not None:
-        success, err = bot.delete_folder(folder_path)
+        success, job_id = bot.delete_folder(folder_path)    # Returns once folder is gone from schema, it's messages are deleted in background.
         if success is not False:
-            flash("Folder deletion successful!!", "success")
+            flash(f"Folder deletion successful!! {f'Files are being deleted from telegram in background, see /jobs/{job_id}/ for progress.' if job_id else ''}", "success")
             return redirect(url_for('index'))   # On success
         else:
             flash("Something went, Folder deletion un-successful! Please check logs.", "danger")
-            return render_template('error.html', error_message=err)  # return error message
+            return render_template('error.html', error_message=job_id)  # return error message
     return render_template('error.html', error_message="POST request to delete a folder is missing required form fields: 'delete_folder'.")
 
 @app.route('/move_folder/', methods=['POST'])
@@ -189,37 +201,94 @@ def move_folder():
 @app.route('/validate/')
 @login_required
 def validate_schema():
-    block_on_validation_in_progress()
-    Thread(target=bot.validate_job, daemon=True).start()
-    return "This will iterate through all the files in schema, and checks if they still exist in cloud. \
-        Finally updates schema with only files that are still available in cloud. This will take a long time, happens in background. \
-            Advised to not make any changes to cloud state meanwhile."
+    """Optional args: `path` - validate only this folder (with sub folders), `since` - ISO date / time, only files not validated after it are checked, `restart` - ignore checkpoint of an interrupted run."""
+    since = request.args.get("since", None)
+    try:
+        since = datetime.fromisoformat(since).timestamp() if since else None
+    except ValueError:
+        return jsonify({"error": f"Invalid `since` value: {since}, use ISO format. Ex: 2024-01-31 or 2024-01-31T10:00:00"})
+    restart = request.args.get("restart", "false").lower() in ("1", "true", "yes")
+    job_id, is_new = bot.jobs.submit("validate", {"directory": request.args.get("path", ""), "since": since, "restart": restart}, key="validate")   # Only one validation at a time.
+    if not is_new:
+        return jsonify({"message": "A validation job is already in progress, Kindly come back later!", "job_id": job_id})
+    return jsonify({"message": "This will iterate through all the files in schema, and checks if they still exist in cloud. "
+                               "Finally updates schema with only files that are still available in cloud. This will take a long time, happens in background. "
+                               "App stays usable meanwhile, files added / moved / deleted during validation are taken care of.", "job_id": job_id})
+
+@app.route('/validate/status/')
+@login_required
+def validation_status():
+    return jsonify(bot.get_validation_progress())
+
+@app.route('/chunks/')
+@login_required
+def chunk_stats():
+    """Chunk store stats, bytes stored vs referenced by files (dedup ratio)."""
+    return jsonify(bot.get_chunk_stats())
+
+@app.route('/chunks/gc/', methods=['POST'])
+@login_required
+def chunk_garbage_collection():
+    """Deletes chunks no file refers to anymore, in background. Optional form field `grace_seconds` - only chunks older than this are deleted (Default: CHUNK_GC_GRACE_SECONDS)."""
+    grace_seconds = request.form.get("grace_seconds", None)
+    if grace_seconds is not None and not grace_seconds.isdigit():
+        return jsonify({"error": f"Invalid `grace_seconds` value: {grace_seconds}"})
+    job_id, _ = bot.jobs.submit("chunk_gc", {"grace_seconds": int(grace_seconds) if grace_seconds else None}, key="chunk_gc")
+    return jsonify({"message": "Garbage collection of unreferenced chunks started in background, check `/chunks/` for stats.", "job_id": job_id})
+
+@app.route('/cache/')
+@login_required
+def cache_stats():
+    """Download cache (hits, misses, coalesced fetches, evictions, invalidations, usage) and metadata cache counters."""
+    return jsonify(bot.get_cache_stats())
 
 @app.route('/persist/upload/', methods=['GET'])
 @login_required
 def persist_schema():
-    block_on_validation_in_progress()
-    try:
-        success, file_id = bot.upload_file(file=open(bot._schema_filepath, 'rb'), file_name=bot._schema_filepath.split('/')[-1], update_schema=False)
-        if success is True:
-            return jsonify({"message": f"Schema Upload successful, Use {file_id} to recover!"})
-    except Exception as err:
-        logger.error(f"Something went wrong during uploading schema: {err}")
-    return render_template('error.html', error_message=file_id)  # This is not file_id but error if success is False.
+    """Uploads schema to channel in background, file_id to recover it with is in job's result once it's done."""
+    job_id, _ = bot.jobs.submit("persist_schema", key="persist_schema")
+    return jsonify({"message": f"Schema upload started, see /jobs/{job_id}/ for file_id to recover with once it's done.", "job_id": job_id})
+
+@app.route('/jobs/')
+@login_required
+def list_jobs():
+    """Background jobs (newest first) with status, progress (items, bytes), rate and ETA. Optional arg `kind` - Ex: validate, delete_messages, upload_files, persist_schema, chunk_gc."""
+    return jsonify(bot.jobs.list(request.args.get("kind", None)))
+
+@app.route('/jobs/<job_id>/')
+@login_required
+def job_status(job_id):
+    job = bot.jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"No job with id: {job_id}"}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/<action>/', methods=['POST'])
+@login_required
+def control_job(job_id, action):
+    """`action` is one of cancel, pause, resume."""
+    if action not in ("cancel", "pause", "resume"):
+        return jsonify({"error": f"Unknown action: {action}, use cancel, pause or resume."}), 400
+    success, err = getattr(bot.jobs, action)(job_id)
+    if success is False:
+        return jsonify({"error": err}), 409
+    return jsonify(bot.jobs.get(job_id))
 
 @app.route('/persist/download/', methods=['GET', 'POST'])
 @login_required
 def recover_schema():
-    block_on_validation_in_progress()
     if request.method == 'GET':
         return render_template('recovery.html')
     try:
-        file_content, _ = bot.download_file(file_id=request.form.get("file_id"))
+        file_content, err = bot.download_schema_backup(file_id=request.form.get("file_id"))
         if file_content:
-            bot.save_schema(file_content)
-            logger.info(f"Schema recovery successful!")
-            flash("Schema recovery successful!", "success")
-            return redirect(url_for('index'))
+            success, err = bot.save_schema(file_content)
+            if success is not False:
+                logger.info(f"Schema recovery successful!")
+                flash("Schema recovery successful!", "success")
+                return redirect(url_for('index'))
+        logger.error(f"Unable to recover schema from cloud: {err}")
+        flash("Unable to recover schema from cloud, is it a schema file_id?", "danger")
     except Exception as err:
         logger.error(f"Something went wrong recovering schema from cloud: {err}")
         flash("Something went wrong recovering schema from cloud", "danger")
@@ -228,43 +297,72 @@ def recover_schema():
 @app.route('/share', methods=['POST'])
 @login_required  # Only logged in user should be able to share something.
 def share_file():
-    """Add a file id to be shared. File shares are stored in memory, lost with a server crash / restart event."""
+    """Add a file id to be shared. Optional form fields `expiry_in_mins`, `attempts` - limits of this share (Defaults: SHARE_EXPIRY_MINUTES, SHARE_MAX_ATTEMPTS)."""
     file_id = request.form.get("file_id", None)  # get the file_id of file to be shared.
+    expiry_in_mins, attempts = request.form.get("expiry_in_mins", ""), request.form.get("attempts", "")
+    if any(value != "" and (not value.isdigit() or int(value) == 0) for value in (expiry_in_mins, attempts)):
+        return jsonify({"status_code": 400, "message": "`expiry_in_mins`, `attempts` must be positive whole numbers."})
     if file_id is not None:
-        if file_id not in list(shared_files_dict.keys()):
-            shared_files_dict[file_id] = {"added": datetime.utcnow(), "expiry_in_mins": 100, "attempts": 2}    # expire in 100 mins.
-            msg = f"File with ID {file_id} is enabled for sharing, Expires in 100 mins / 2 download attempts (Whichever is hit first). Please use `share_link` to download."
-            logger.info(msg + f"Active file shares in this moment: {len(list(shared_files_dict.keys()))}")
+        share = shares.add(file_id, expiry_seconds=int(expiry_in_mins) * 60 if expiry_in_mins else None, attempts=int(attempts) if attempts else None)
+        if share is not None:
+            msg = f"File with ID {file_id} is enabled for sharing, Expires in {round((share['expires_at'] - share['created']) / 60)} mins / {share['max_attempts']} download attempts (Whichever is hit first). Please use `share_link` to download."
+            logger.info(msg + f"Active file shares in this moment: {shares.count()}")
             return jsonify({"status_code": 200, "message": msg, "share_link": f"https://{request.headers.get('Host')}/shared/{file_id}"})   # return a link in response with which any user can download file without logging in.
         else:
             return jsonify({"status_code": 400, "message": "The file is already being shared."})
     return jsonify({"status_code": 400, "message": "file_id must be specified as a form field in the request."})
 
+def is_continued_download(file_id: str) -> bool:
+    """True if request only continues a download already served (resume, seeking in media): a single range that doesn't start at byte 0, with `If-Range` matching ETag of the file.
+
+       Anything else may fetch the whole file (Ex: `Range: bytes=0-`, or a range without `If-Range`), So it's counted as a download.
+    """
+    if request.range is None or len(request.range.ranges) != 1 or request.range.ranges[0][0] == 0 or request.if_range.etag is None:
+        return False
+    file_info, _ = bot.get_download_info(file_id)
+    return file_info is not False and request.if_range.etag == file_info["etag"]
+
 @app.route('/shared/<file_id>', methods=['GET'])    # login not needed for this route, as normal users will use this route to get shared files.
 def get_shared_file(file_id):
-    if file_id in list(shared_files_dict.keys()):
-        file_content, file_name_or_error = bot.download_file(file_id)
-        if file_content is not False:
-            shared_files_dict[file_id]["attempts"] -= 1  # Each time file is downloaded, 1 attempt over. Link will be disabled after attempts exceeded.
-            return send_file(io.BytesIO(file_content), as_attachment=True, download_name=file_name_or_error)    # send download to user if download from telegram is successful. Nothing is saved in this server.
+    # Each time file is downloaded, 1 attempt over. Link will be disabled after attempts exceeded. Only continuation ranges of a download already served are not counted.
+    counted = not is_continued_download(file_id)
+    is_shared = shares.use_attempt(file_id) if counted else shares.get(file_id) is not None
+    if is_shared:
+        response, err = stream_download(file_id)
+        if response is not None:
+            return response    # stream download to user as it comes from telegram. Nothing is saved in this server.
         else:
+            if counted:
+                shares.refund_attempt(file_id)
             return jsonify({"status_code": 500, "message": "Sorry! Not sure what went wrong, but you are not getting this file at the moment!"})
     else:
         return jsonify({"status_code": 404, "message": "File sharing link is either invalid or expired."})
 
 @app.route('/search/', methods=['GET', 'POST'])
 @login_required
-def search():   # Improve search functionality.
-    result = []
-    file_name = request.form.get("file_name", None)
-    if file_name is not None and file_name != "":
-        res = bot._ops.find_record_by_attribute(bot._schema.copy(), "filename", file_name, partial_match=True)
-        if len(res) > 0:
-            result.extend(res)
-            return render_template("index.html", results=result)    # No upload functionality, no breadcrumbs, no schema info footer.
+def search():
+    """Searches file names (and folder paths) using the search index kept in schema ops. Form fields / query args: `file_name` (text to search),
+       `mode` ("substring" (default) or "prefix"), `ext` (file extension), `path` (search only in this folder, it's sub folders), `page` (pagination)."""
+    file_name = request.values.get("file_name", "").strip()
+    extension = request.values.get("ext", "").strip() or None
+    path = request.values.get("path", "").strip() or None
+    mode = "prefix" if request.values.get("mode") == "prefix" else "substring"
+    page = int(request.values.get("page", "1")) if request.values.get("page", "1").isdigit() else 1
+    page = max(page, 1)
+    if file_name != "" or extension is not None:
+        bot.refresh_schema()    # Changes made by other worker processes are in search index.
+        results, has_more = bot._ops.search_index.search(file_name, mode == "prefix", extension, path, "file", SEARCH_PAGE_SIZE, (page - 1) * SEARCH_PAGE_SIZE)
+        folder_results = []
+        if page == 1 and extension is None:   # Matching folders are shown on first page only.
+            folder_results, _ = bot._ops.search_index.search(file_name, mode == "prefix", None, path, "folder", SEARCH_PAGE_SIZE)
+        if len(results) > 0 or len(folder_results) > 0:
+            search_args = {"file_name": file_name, "mode": mode, "ext": extension or "", "path": path or ""}
+            return render_template("index.html", results=results, folder_results=folder_results, search_args=search_args, page=page, has_more=has_more)    # No upload functionality, no breadcrumbs, no schema info footer.
     flash("No Records were found matching the search criteria!!", "warning")
     return redirect(url_for("index"))
 
-if __name__ == '__main__':
+if __name__ == '__main__':     # Development server, `wsgi.py` is the entry point for production (gunicorn).
     logging.basicConfig(filename="logs.txt", filemode='a', level=os.getenv("LOGGING_LEVEL", 'DEBUG').upper())
+    context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
+    context.load_cert_chain('certs/cert.pem', 'certs/key.pem')
     app.run(port=443, host='0.0.0.0', debug=True, ssl_context=context)
@@ -1,4 +1,6 @@
-from telegram import Bot, InputFile, error as telegram_error # InputMediaDocument - Used for editing media in a message id.
+from telegram import Bot, File, error as telegram_error # InputMediaDocument - Used for editing media in a message id.
+from telegram.utils.request import Request
+from concurrent.futures import ThreadPoolExecutor
 from os import environ as env, path
 from werkzeug import datastructures
 from datetime import datetime
@@ -6,37 +8,177 @@ from pathvalidate import sanitize_filename, sanitize_filepath
 from dotenv import load_dotenv
 import time
 from hurry.filesize import size
+from utils.cache import MemoryCache, DiskCache, TTLCache
+from utils.search import SearchIndex
+from utils.journal import SchemaJournal, write_file_atomically
+from utils.locks import InterProcessLock, SharedReadWriteLock
+from utils.ratelimit import TokenBucket, ApiScheduler, INTERACTIVE, BACKGROUND
+from utils.aiobotapi import AsyncBotApi, FileLinkExpired
+from utils.chunkstore import ChunkStore, iter_chunks
+from utils.compression import CODECS, FEED_SIZE, Compressor, is_codec_available, is_worth_compressing, compress, iter_decompressed
+from utils.multipart import send_document_stream
+from utils.deletes import DeleteQueue, DELETE_BATCH_SIZE, delete_messages
+from utils.jobs import JobManager, Job, JobCancelled, ACTIVE_STATUSES
+import threading
+import itertools
+import asyncio
 import logging
 import json
+import io
+import urllib.parse
+import urllib.request
+import urllib.error
 ## file enc / dec
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.fernet import Fernet
+import struct
 import base64
+import tempfile
+import hashlib
+import shutil
+import os
 ####
 load_dotenv()
 logger = logging.getLogger()
 
+MAX_UPLOAD_SIZE = 19999999  # Telegram bots can upload upto 50 MB, but can only download upto 20 MB. So every single message we upload is kept below this.
+PART_SIZE = 19 * 1024 * 1024  # Bytes of a big file that go into one message. Encryption adds only ~0.03%, 19 MiB becomes ~19.93 MB.
+READ_BLOCK_SIZE = 1024 * 1024   # Bytes of an upload read at a time, an upload never holds more than this of plain content in memory.
+SPOOL_MEMORY_SIZE = 1024 * 1024     # Prepared (compressed / encrypted) content of a part is kept in memory up to this size, rolled over to a temp file beyond it.
+## Encrypted envelope format.
+ENVELOPE_MAGIC = b"TGCE"
+ENVELOPE_VERSION = 2    # Version new envelopes are written in, older ones are still decrypted.
+NONCE_PREFIX_SIZE = 7    # Random per envelope, + 4 byte segment index + 1 byte last segment flag = 12 byte AES-GCM nonce.
+KEY_SALT_SIZE = 16  # Random per envelope (v2), each envelope is sealed under it's own key derived with it. So nonces never repeat under a key, however many envelopes there are.
+ENVELOPE_HEADERS = {
+    1: struct.Struct(f">4sBI{NONCE_PREFIX_SIZE}s"),    # magic, version, segment size, nonce prefix. 16 bytes. Every v1 envelope is under same key.
+    2: struct.Struct(f">4sBI{NONCE_PREFIX_SIZE}s{KEY_SALT_SIZE}s"),  # + key salt. 32 bytes.
+}
+ENVELOPE_HEADER = ENVELOPE_HEADERS[ENVELOPE_VERSION]
+SEGMENT_SIZE = 64 * 1024    # Plain bytes sealed in each segment of the envelope.
+SEGMENT_TAG_SIZE = 16   # AES-GCM authentication tag added to each segment.
+ENC_FORMAT_FERNET = "fernet"    # `enc_format` marker in schema record. Records without a marker were encrypted using Fernet.
+ENC_FORMAT_ENVELOPE = "aead-v1"
+PARTS_MANIFEST_KEY = "telegram_cloud_parts"   # First key of a parts manifest, uploaded in place of a file that isn't in schema (schema backup) but didn't fit in one message.
+VALIDATION_CHECKPOINT_EVERY = 200   # Files checked between two validation checkpoints.
+
 class BotActions:
     def __init__(self, schema_filepath=None, encrypted: bool=True) -> None:
         self.__bot_token = str(env["API_KEY"])         # Raises key error if not found.
-        self.__channel_id = str(env["CHANNEL_ID"])     # Channel Id where files are uploaded.
-        self.__bot = Bot(token=self.__bot_token)  # Bot for all file operations.
+        self._channel_id = str(env["CHANNEL_ID"])     # Channel Id where files are uploaded.
+        self._upload_workers = int(env.get("UPLOAD_WORKERS", 4))   # Number of parts of a big file that are uploaded to telegram in parallel.
+        self._batch_upload_workers = int(env.get("BATCH_UPLOAD_WORKERS", 4))   # Number of files of a multi-file upload (Ex: drag and drop in UI) that are uploaded in parallel.
+        # Bot for all file operations. Connection pool must be big enough for all parallel part uploads. API urls can point to a local Bot API server (or a stand-in for it, Ex: in benchmarks).
+        self.__bot = Bot(token=self.__bot_token, base_url=env.get("TELEGRAM_API_URL", "https://api.telegram.org/bot"), base_file_url=env.get("TELEGRAM_FILE_URL", "https://api.telegram.org/file/bot"),
+                         request=Request(con_pool_size=self._upload_workers * self._batch_upload_workers + 4))
+        # Every Bot API call goes through this, So that UI, validation, bulk jobs share telegram's rate limits instead of racing for them.
+        # With `WEB_WORKERS` server processes (gunicorn), each one gets an equal share of the limits, together they stay within them.
+        self._web_workers = max(int(env.get("WEB_WORKERS", 1)), 1)
+        self._api = ApiScheduler(global_rate=float(env.get("TELEGRAM_REQUESTS_PER_SECOND", 30)) / self._web_workers, chat_rate=float(env.get("TELEGRAM_CHAT_MESSAGES_PER_SECOND", 1)) / self._web_workers,
+                                 chat_burst=max(int(env.get("TELEGRAM_CHAT_BURST", 5)) // self._web_workers, 1), max_retries=int(env.get("TELEGRAM_MAX_RETRIES", 5)))
         self._is_encryption_enabled = encrypted
-        if self._is_encryption_enabled:  # Below helper id needed only when encryption is enabled by user.
+        self._part_size = PART_SIZE   # Files bigger than this are split into multiple parts (messages).
+        # Optional compression before encryption (COMPRESSION=zlib / zstd). Files that won't compress well (by type, or a sample of their content) are sent as they are.
+        self._compression = env.get("COMPRESSION", "none").lower()
+        if self._compression not in CODECS:
+            self._compression = None
+        elif not is_codec_available(self._compression):
+            logger.warning(f"Compression codec '{self._compression}' is not installed (pip install zstandard), using zlib instead.")
+            self._compression = "zlib"
+        self._compression_level = int(env["COMPRESSION_LEVEL"]) if env.get("COMPRESSION_LEVEL") else None    # Codec's default level if not set.
+        if self._is_encryption_enabled:
             logger.info("File Encryption is enabled for this session! All uploads done in this session will be encrypted uploads.")
-            self.__file_ops = EncDecHelper(self.__bot_token + self.__channel_id)    # bot token + channel id combined as a string is used as base encryption key.
-        if schema_filepath is None:  # If none, use default, else use user-defined path. This will be used for doing multiple backups using cli. Or for testing purposes.
-            self._schema_filepath = './schema/schema.json'   # This folder must be pointed to a named volume for schema persistence.
-        self._cache_folder = "./cache/"  # This folder holds recently downloaded files from telegram.
-        self._schema: dict[str, list[dict[str, str|int]] | dict[str, str|int]] = self.load_or_reload_schema()
-        self.save_schema()  # SAVE SCHEMA ONCE At start
-        self._ops = SchemaManipulations()
+        self.__file_ops = EncDecHelper(self.__bot_token + self._channel_id)    # bot token + channel id combined as a string is used as base encryption key. Needed even if encryption is disabled, to download files that were encrypted earlier.
+        self._schema_filepath = schema_filepath or './schema/schema.json'  # If none, use default, else use user-defined path. This will be used for doing multiple backups using cli. Or for testing purposes. This folder must be pointed to a named volume for schema persistence.
+        self._download_buffer_size = int(env.get("DOWNLOAD_BUFFER_SIZE", 256 * 1024))   # Bytes read from telegram at a time while streaming a download to user.
+        self._part_cache = MemoryCache(int(env.get("RANGE_CACHE_SIZE_MB", 64)) * 1024 * 1024)  # Encrypted content of parts fetched for range requests, So that seeking in a file doesn't fetch it again from telegram.
+        self._cache_folder = env.get("DOWNLOAD_CACHE_FOLDER", "./cache/")  # This folder holds recently downloaded files from telegram.
+        self._disk_cache = self._open_disk_cache(int(env.get("DOWNLOAD_CACHE_SIZE_MB", 512)) * 1024 * 1024)  # Parts as stored in telegram (encrypted), So repeat downloads don't go to telegram. 0 disables it.
+        # Metadata from telegram, (ttl, max_age) in seconds per call type. Past ttl a cached value is still served (refreshed in background) till max_age, So pages don't wait on a slow telegram.
+        # getFile's `file_path` is a download link valid for at least an hour, it's never served older than that.
+        self._metadata = TTLCache({
+            "file_pointer": (int(env.get("FILE_PATH_TTL_SECONDS", 2700)), 3300),
+            "member_count": (int(env.get("MEMBER_COUNT_TTL_SECONDS", 300)), int(env.get("MEMBER_COUNT_MAX_STALE_SECONDS", 3600))),
+        })
+        os.makedirs(path.dirname(self._schema_filepath) or ".", exist_ok=True)
+        # Chunk store mode: big files are split into content defined chunks, only chunks not already in channel are uploaded. (Ex: VM images, mailboxes, databases that change a little between backups)
+        self._chunk_store_enabled = env.get("CHUNK_STORE", "False").upper() == "TRUE"
+        self._chunk_avg_size = int(float(env.get("CHUNK_AVG_SIZE_MB", 4)) * 1024 * 1024)
+        self._chunk_gc_grace = int(env.get("CHUNK_GC_GRACE_SECONDS", 3600))    # Unreferenced chunks younger than this are left alone by garbage collection.
+        self._chunks = ChunkStore(path.join(path.dirname(self._schema_filepath) or ".", "chunks.json"), compact_after=int(env.get("SCHEMA_COMPACT_ENTRIES", 1000)))
+        self._chunk_pins: dict[int, list[str]] = {}     # Message id of a chunked record not yet in schema -> chunks it pinned, released once it's added.
+        # Write lock is held while schema is changed, read lock while it is read (browsing, downloads, snapshots). Nobody sees a half applied operation.
+        # Several processes can share schema folder (Ex: gunicorn workers, cli), write lock is held across them. Changes other processes journaled are applied before schema is read / changed.
+        self._schema_lock = SharedReadWriteLock(InterProcessLock(self._schema_filepath + ".lock"), lambda: self._journal.has_changes(), self._apply_peer_changes)
+        self._snapshot_lock = threading.Lock()
+        with self._schema_lock.process_lock.hold():     # Nobody snapshots / compacts journal while this process loads it.
+            self._schema: dict[str, list[dict[str, str|int]] | dict[str, str|int]] = self.load_or_reload_schema()
+            self._ops = SchemaManipulations()
+            self._ops.build_indexes(self._schema)   # O(1) lookups of files, folders. Kept updated with every schema change.
+            # Every schema change is appended to journal, schema.json is only a periodic snapshot. Changes made after last snapshot are replayed on top of it.
+            snapshot_seq = self._schema["meta"].get("journal_seq", 0)
+            self._journal = SchemaJournal(self._schema_filepath + ".journal", start_seq=snapshot_seq, compact_after=int(env.get("SCHEMA_COMPACT_ENTRIES", 1000)))
+            self._replay_journal(snapshot_seq)
+            self.save_schema()  # SAVE SCHEMA ONCE At start
+        self._compact_interval = int(env.get("SCHEMA_COMPACT_INTERVAL", 60))    # Seconds between background snapshots (only if schema changed).
         self.VALIDATION_ACTIVE = False
+        self._validation_workers = int(env.get("VALIDATION_WORKERS", 4))   # Files checked in parallel during schema validation.
+        self._validation_budget = TokenBucket(float(env.get("VALIDATION_REQUESTS_PER_SECOND", 10)), burst=self._validation_workers)   # Telegram requests per second validation may use, leaves room for users.
+        self._validation_checkpoint_filepath = path.join(path.dirname(self._schema_filepath) or ".", "validation.checkpoint.json")
+        self._validation_progress = {}
+        # Messages of deleted folders are deleted in background, in batches. Queue is persisted, So deletes interrupted by a restart are resumed.
+        self._deletes = DeleteQueue(path.join(path.dirname(self._schema_filepath) or ".", "pending_deletes.json"))
+        self._delete_workers = int(env.get("DELETE_WORKERS", 4))   # Messages deleted in parallel, if telegram's batch delete can't be used.
+        self._batch_delete_supported = True
         self._default_upload_directory = ""
+        # Long operations (validation, folder deletes, bulk uploads, schema upload, chunk gc) run as jobs on `JOB_WORKERS` threads, with progress, cancel / pause / resume. Job state is persisted.
+        self._job_files_folder = path.join(path.dirname(self._schema_filepath) or ".", "job_files")    # Files of background uploads wait here till they're uploaded.
+        self.jobs = JobManager(path.join(path.dirname(self._schema_filepath) or ".", "jobs.json"), workers=int(env.get("JOB_WORKERS", 4)))
+        self.jobs.register("validate", self._run_validation_job, resumable=True)
+        self.jobs.register("delete_messages", self._run_delete_job, resumable=True)
+        self.jobs.register("upload_files", self._run_upload_job, resumable=True)
+        self.jobs.register("persist_schema", self._run_persist_schema_job)
+        self.jobs.register("chunk_gc", lambda job, grace_seconds=None: self.collect_garbage(grace_seconds))
+        # One of the processes sharing schema folder is leader, it runs jobs and background snapshots. Once it exits, a process waiting for it's lock takes over.
+        self._leader_lock = InterProcessLock(path.join(path.dirname(self._schema_filepath) or ".", "leader.lock"))
+        self.is_leader = False
+        if self._leader_lock.try_acquire():
+            self._lead()
+        else:
+            threading.Thread(target=self._wait_for_leadership, daemon=True).start()
+        self._metadata.refresh_in_background("member_count", self._channel_id, self._get_member_count)  # Ready before first page is rendered.
         logger.info("Required config variables are read from env!")
 
+    def _open_disk_cache(self, max_size: int) -> DiskCache:
+        """With several server processes, each gets it's own cache folder (a slot, claimed by a lock held for process's life) and an equal share of cache size. Cache is disabled if all slots are taken."""
+        if self._web_workers == 1 or max_size == 0:
+            return DiskCache(self._cache_folder, max_size)
+        slots_folder = path.join(self._cache_folder, "workers")
+        os.makedirs(slots_folder, exist_ok=True)
+        for slot in range(self._web_workers * 2):   # Room for processes replacing ones that are exiting.
+            self._cache_slot_lock = InterProcessLock(path.join(slots_folder, f"{slot}.lock"))
+            if self._cache_slot_lock.try_acquire():
+                return DiskCache(path.join(slots_folder, str(slot)), max_size // self._web_workers)
+        logger.warning("No free download cache slot for this process, download cache is disabled in it.")
+        return DiskCache(path.join(slots_folder, "unused"), 0)
+
+    def _lead(self):
+        """Takes up duties of leader process: background snapshots, running jobs."""
+        self.is_leader = True
+        logger.info(f"Process {os.getpid()} is leader, it runs background jobs and schema snapshots.")
+        threading.Thread(target=self._compaction_loop, daemon=True).start()
+        self.jobs.start()
+        for queue_id in self._deletes.get_pending_jobs():   # Deletes queued by a run that didn't get to start their job, already running ones are not started twice.
+            self.jobs.submit("delete_messages", {"queue_id": queue_id}, key=queue_id)
+
+    def _wait_for_leadership(self):
+        self._leader_lock.try_acquire(blocking=True)
+        self._lead()
+
     def load_or_reload_schema(self):
         try:
             with open(self._schema_filepath, 'r') as schema_file:
@@ -48,141 +190,1037 @@ class BotActions:
             logger.info("Schema.json not found in local directory, creating new empty schema.")
             return {'root': [], "meta": {"total_size": 0, "last_validated": "Unavailable! Please Revalidate schema."}}
 
-    def save_schema(self, file_content_bytes: bytes = None):
+    def save_schema(self, file_content_bytes: bytes = None, replaced: bool = False):
+        """Writes a full snapshot of schema to schema.json (atomically, via temp file + rename) and drops journal entries it covers. \n
+           If `file_content_bytes` is given, schema is replaced with it first (schema recovery). `replaced=True` tells other processes to reload snapshot, for changes that aren't journaled (Ex: validation).
+        """
         try:
-            with open(self._schema_filepath, 'w') as schema_file:
-                if file_content_bytes is not None:  # If file is specified explicitly as byte array.
-                    self._schema = json.loads(file_content_bytes.decode('utf8'))    # load bytes as str and then to dictionary.
-                json.dump(self._schema, schema_file, indent=4)    # save in-memory schema dictionary as file.
-            logger.debug(f"Latest Schema dumped!!")
+            with self._snapshot_lock, self._schema_lock.process_lock.hold():    # Other processes don't change schema till journal is compacted.
+                with self._schema_lock.write():     # Brings schema up to date with other processes first.
+                    if file_content_bytes is not None:  # If file is specified explicitly as byte array.
+                        schema = json.loads(file_content_bytes.decode('utf8'))    # load bytes as str and then to dictionary.
+                        schema.setdefault("meta", {"total_size": "Unknown", "last_validated": "Please re-validate schema ASAP!"})
+                        self._schema = schema
+                        self._ops.build_indexes(self._schema)   # Whole schema is replaced.
+                    snapshot_seq = self._mark_snapshot(replaced=replaced or file_content_bytes is not None)    # Every operation up to this seq is applied to in-memory schema.
+                    content = json.dumps({**self._schema, "meta": {**self._schema["meta"], "journal_seq": snapshot_seq}}).encode('utf8')  # Only serialized under lock, written outside of it.
+                write_file_atomically(self._schema_filepath, content)    # save in-memory schema dictionary as file.
+                self._journal.compact(snapshot_seq)
+            logger.debug(f"Latest Schema dumped!! Snapshot includes journal upto seq {snapshot_seq}.")
             return True, None
         except Exception as err:
+            logger.error(f"Unable to save schema snapshot, Error: {err}")
             return False, err
 
-    def validate_job(self):   # Needs refactoring as schema changed.
-        """Works on schema, start this function as a background thread. Finally put the last validation date in schema for future reference (Display last validation date in homepage also.)"""
-        self.VALIDATION_ACTIVE = True    # disable all routes during update via a control flag variable.
+    def _mark_snapshot(self, replaced: bool = False) -> int:
+        """Journals a snapshot marker, returns it's seq. If schema was `replaced` (which isn't journaled), other processes reload snapshot once they read it. Called under schema write lock."""
         try:
-            meta = {"total_size": 0, "last_validated": ""}
-            def process_schema(schema, meta):
-                if isinstance(schema, dict):
-                    for key, val in schema.items():
-                        if key == "root" and isinstance(val, list):
-                            file_validate(val, meta)  # Update the 'root' list in-place
-                        else:
-                            process_schema(val, meta)
-                return schema, meta
-
-            def file_validate(file_list: list[dict], meta: dict):
-                for pos, file_info in enumerate(file_list.copy()):
-                    try:
-                        file_id = file_info["file_id"]
-                        message_id = file_info["message_id"]
-                    except KeyError:
-                        file_list.remove(file_info)
-                        logger.error(f"Ill-Formatted record found. File_ID missing. Dropping it.")
-                        continue    # no need to proceed further on this file.
-                    try:
-                        cloud_file = self.__bot.get_file(file_id=file_id)
-                        logger.debug(f"File is present in cloud, Ref Files ID: {file_id}")
-                    except (telegram_error.BadRequest, telegram_error.TelegramError):
-                        logger.info(f"The file no longer exists on cloud! Removing it from schema. Ref Id: {file_id}")
-                        file_list.remove(file_info)
-                        continue
-                    try:
-                        underlying_message = self.__bot.copy_message(from_chat_id=self.__channel_id, chat_id="", message_id=message_id)    # not specifying to chat_id. As we are using this method to just check if message exists or not.
-                    except telegram_error.TelegramError as err:
-                        if "Message to copy not found" in str(err):
-                            logger.info(f"Underlying message for a file with message id '{message_id}' is deleted. SO deleting file record from schema!!")
-                            file_list.remove(file_info)
+            return self._journal.append({"op": "snapshot", "replaced": replaced})
+        except OSError:
+            return self._journal.last_seq
+
+    def _commit(self, seq: int):
+        """Waits for a journaled schema change to be durable. If journal can't be written, falls back to a full snapshot. Returns a tuple of (success, error), False only if neither could be written."""
+        try:
+            self._journal.wait(seq)
+        except OSError as err:
+            logger.error(f"{err}. Saving a full schema snapshot instead.")
+            return self.save_schema()
+        return True, None
+
+    def _journal_change(self, entry: dict):
+        """Appends a schema change to journal. Called under schema lock, right after the change is applied. Returns seq to be passed to `_commit` (None if journal is unusable)."""
+        try:
+            return self._journal.append(entry)
+        except OSError as err:
+            logger.error(f"{err}. Change will be saved in next snapshot.")
+            return None
+
+    def _replay_journal(self, snapshot_seq: int):
+        """Applies journal entries newer than snapshot to schema, in order. Entries that no longer apply are skipped."""
+        entries = self._journal.replay(snapshot_seq)
+        self._apply_journal_entries(entries)
+        if entries:
+            logger.info(f"Replayed {len(entries)} schema changes from journal on top of snapshot.")
+
+    def _apply_peer_changes(self):
+        """Applies schema changes other processes (Ex: other gunicorn workers, cli) journaled since this process last looked. Called under schema write lock, see `SharedReadWriteLock`."""
+        entries = self._journal.read_new()
+        if entries is None:     # Journal was compacted past what this process has seen, it's all in snapshot.
+            self._reload_snapshot()
+            entries = self._journal.read_new() or []
+        self._apply_journal_entries(entries, from_peers=True)
+
+    def _reload_snapshot(self):
+        """Replaces in-memory schema with snapshot on disk. Called under schema write lock. Cached parts no record in new snapshot points to (Ex: dropped by validation in leader) are dropped from download caches."""
+        self._schema = self.load_or_reload_schema()
+        self._ops.build_indexes(self._schema)
+        referenced = {part["file_id"] for entries in self._ops._by_message_id.values() for file_info, _ in entries for part in file_info.get("parts", [file_info]) if "file_id" in part}
+        self._invalidate_cached_parts({*self._disk_cache.keys(), *self._part_cache.keys()} - referenced)
+        self._journal.skip_to(self._schema["meta"].get("journal_seq", 0))
+        logger.info(f"Reloaded schema snapshot written by another process, upto journal seq {self._schema['meta'].get('journal_seq', 0)}.")
+
+    def refresh_schema(self):
+        """Brings schema up to date with changes made by other processes. Reads do it on their own, only needed before using schema outside of schema lock (Ex: search index)."""
+        with self._schema_lock.read():
+            pass
+
+    def _apply_journal_entries(self, entries: list[dict], from_peers: bool = False):
+        """Applies journal entries to schema, in order. Entries that no longer apply are skipped. Called under schema write lock (or during startup)."""
+        for entry in entries:
+            op = entry.get("op")
+            if op == "snapshot":    # A snapshot was written. (At startup, snapshot on disk is already as new.)
+                res, err = True, None
+                if from_peers and entry.get("replaced"):
+                    with open(self._schema_filepath, 'r') as schema_file:
+                        snapshot_seq = json.load(schema_file).get("meta", {}).get("journal_seq", 0)
+                    if snapshot_seq >= entry["seq"]:    # It wasn't cut short by a crash.
+                        self._reload_snapshot()
+            elif op == "add_file":
+                res, err = self._apply_add_file(entry["record"], entry["path"])
+            elif op == "add_files":
+                res, err = self._apply_add_files(entry["records"], entry["path"])
+            elif op == "delete_file":
+                removed = [record for record, record_path in self._ops.lookup_message_id(entry["message_id"]) if record_path == self._ops.get_path_key(entry["path"])] if from_peers else []
+                res, err = self._apply_delete_file(entry["path"], entry["message_id"])
+            elif op == "move_folder":
+                res, err = self._apply_move_folder(entry["path"], entry["target"], entry["name"])
+            elif op == "delete_folder":
+                removed = [record for record, _ in self._get_records_snapshot(entry["path"]) or []] if from_peers else []
+                res, err = self._apply_delete_folder(entry["path"])
+            else:
+                res, err = False, f"Unknown operation '{op}'"
+            if res is False:
+                logger.warning(f"Skipped journal entry {entry.get('seq')} ({op}) during replay, Error: {err}")
+            elif op in ("delete_file", "delete_folder") and from_peers:
+                self._invalidate_removed_records(removed)
+
+    def _invalidate_removed_records(self, records: list[dict]):
+        """Drops cached parts of records another process removed from schema. Each process caches downloads on it's own (a cache slot per worker), So it has to hear of deletes through journal.\n
+           Records whose messages are still used by a linked duplicate are left cached. Called under schema write lock.
+        """
+        for file_info in records:
+            if "message_id" in file_info and not self._ops.lookup_message_id(file_info["message_id"]):
+                self._invalidate_cached_parts(part["file_id"] for part in file_info.get("parts", [file_info]) if "file_id" in part)
+
+    def _compaction_loop(self):
+        """Background snapshots. Schema is snapshotted every `SCHEMA_COMPACT_INTERVAL` seconds if it changed, or sooner if `SCHEMA_COMPACT_ENTRIES` changes piled up in journal. Chunk store is snapshotted along with it."""
+        while True:
+            self._journal.compaction_due.wait(timeout=self._compact_interval)
+            if self._journal.entries_since_snapshot > 0 or self._journal.has_changes():  # Changes of other processes count too.
+                self.save_schema()
+            self._chunks.save_if_changed()
+
+    def validate_job(self, directory: str = "", since: float = None, restart: bool = False, job: Job = None):
+        """Checks every file in schema still exists in cloud, runs as a background job (see `_run_validation_job`). Finally put the last validation date in schema for future reference (Display last validation date in homepage also.)\n
+           Works on a snapshot of schema records taken at start, So browsing, uploads, downloads etc. keep working meanwhile. Removals, sizes are merged into live schema at the end.
+           `directory` limits validation to that folder (and it's sub folders), `since` (epoch seconds) skips files validated after that time.
+           Files are checked in parallel within a request budget, progress is checkpointed to disk. An interrupted run with same arguments resumes from checkpoint, unless `restart` is set.
+           Progress is reported to `job` (if given), it's paused / cancelled between files. A cancelled run keeps it's checkpoint. Returns a tuple of (success, error).
+        """
+        if self.VALIDATION_ACTIVE:
+            logger.info("A validation job is already in progress, not starting another one.")
+            return False, "A validation job is already in progress."
+        self.VALIDATION_ACTIVE = True    # Only one validation at a time.
+        def check(file_info: dict):
+            if job is not None:
+                try:
+                    job.checkpoint()    # Blocks while job is paused.
+                except JobCancelled:
+                    return None, None   # Rest of the batch is skipped, cancellation is raised once it's checkpointed.
+            return self._validate_record(file_info)
+        try:
+            snapshot = self._get_records_snapshot(directory)
+            if snapshot is False:
+                logger.error(f"Unable to validate, invalid path: '{directory}'")
+                return False, f"Invalid path: '{directory}'"
+            checkpoint = self._load_validation_checkpoint(directory, since, restart)
+            results = checkpoint["results"]     # validation key -> [exists, size in cloud, checked at]. Only conclusive results are kept.
+            pending = []
+            for file_info, _ in snapshot:
+                key = self._get_validation_key(file_info)   # Ill-formatted records (no key) are dropped while merging.
+                if key is not None and key not in results and (since is None or file_info.get("last_validated", 0) < since):
+                    pending.append(file_info)
+            self._validation_progress = {"directory": directory, "since": since, "total": len(pending) + len(results), "checked": len(results), "missing": sum(1 for result in results.values() if not result[0]), "inconclusive": 0}
+            if job is not None:
+                job.data["progress"] = self._validation_progress    # Persisted with job, So other processes can report it.
+                job.set_total(items=len(pending) + len(results))
+                job.set_done(items=len(results))
+            logger.info(f"Validating {len(pending)} of {len(snapshot)} files in schema snapshot with {self._validation_workers} workers, {len(results)} already checked (resumed from checkpoint).")
+            with ThreadPoolExecutor(max_workers=self._validation_workers, thread_name_prefix="validate") as executor:
+                for batch_start in range(0, len(pending), VALIDATION_CHECKPOINT_EVERY):
+                    batch = pending[batch_start:batch_start + VALIDATION_CHECKPOINT_EVERY]
+                    for file_info, (exists, cloud_file_size) in zip(batch, executor.map(check, batch)):
+                        if cloud_file_size is None:     # Skipped, job was cancelled.
                             continue
-                    meta["total_size"] += cloud_file.file_size
-                    file_list[pos]["size"] = size(cloud_file.file_size)     # save in KB / MB string.
-                    time.sleep(1)   # small delay to avoid DDOS scenario.
-
-            process_schema(self._schema, meta)
-            self._schema["meta"]["last_validated"] = str(datetime.utcnow())
-            self._schema["meta"]["total_size"] = size(meta["total_size"])
-            self.save_schema()
-            logger.info("Schema Validation completed successfully!!")
-            self.VALIDATION_ACTIVE = False
+                        if job is not None:
+                            job.advance()
+                        if exists is None:
+                            self._validation_progress["inconclusive"] += 1
+                            continue    # Not known, checked again in next run.
+                        results[self._get_validation_key(file_info)] = [exists, cloud_file_size, time.time()]
+                        self._validation_progress["checked"] += 1
+                        self._validation_progress["missing"] += 0 if exists else 1
+                    write_file_atomically(self._validation_checkpoint_filepath, json.dumps(checkpoint).encode('utf8'))
+                    if job is not None:
+                        job.checkpoint()
+            self._merge_validation(snapshot, results, full_run=(self._ops.get_path_key(directory) == "" and since is None))
+            self.save_schema(replaced=True)  # Changes made by validation are not journaled, a full snapshot is written instead (other processes reload it).
+            if path.exists(self._validation_checkpoint_filepath):
+                os.remove(self._validation_checkpoint_filepath)
+            logger.info(f"Schema Validation completed successfully!! {self._validation_progress}")
+            return True, None
+        except JobCancelled:
+            logger.info(f"Schema validation cancelled, {self._validation_progress.get('checked')} files checked so far are kept in checkpoint.")
+            raise
         except Exception as err:
-            self.VALIDATION_ACTIVE = False
             logger.error(f"Something went wrong during schema validation. Operation failed. Error: {err}")
+            return False, str(err)
+        finally:
+            self.VALIDATION_ACTIVE = False
+
+    def _run_validation_job(self, job: Job, directory: str = "", since: float = None, restart: bool = False) -> dict:
+        """`validate` job. A job resumed after a restart carries on from validation checkpoint, even if it was started with `restart`."""
+        restart = restart and not job.data.get("started")
+        job.data["started"] = True
+        job.save()
+        success, err = self.validate_job(directory, since, restart, job=job)
+        if success is False:
+            raise RuntimeError(err)
+        return self._validation_progress
+
+    @staticmethod
+    def _get_validation_key(file_info: dict) -> str | None:
+        """Identifies a record in validation checkpoint, stays same across restarts. None for ill-formatted records."""
+        if "message_id" not in file_info or "file_id" not in file_info:
+            return None
+        return f"{file_info['message_id']}:{file_info['file_id']}"
+
+    def _load_validation_checkpoint(self, directory: str, since: float, restart: bool) -> dict:
+        """Checkpoint of an interrupted validation run with same arguments, or a fresh one."""
+        fresh = {"directory": self._ops.get_path_key(directory), "since": since, "started": time.time(), "results": {}}
+        if restart:
+            return fresh
+        try:
+            with open(self._validation_checkpoint_filepath, 'r') as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return fresh
+        if checkpoint.get("directory") != fresh["directory"] or checkpoint.get("since") != since:
+            logger.info(f"Validation checkpoint is for a different run (path: '{checkpoint.get('directory')}'), starting afresh.")
+            return fresh
+        logger.info(f"Resuming validation started at {datetime.fromtimestamp(checkpoint['started'])} from checkpoint.")
+        return checkpoint
+
+    def _call_with_budget(self, method, **kwargs):
+        """Calls a bot method within validation request budget, in background lane of scheduler (users' requests go first)."""
+        self._validation_budget.acquire()
+        return self._api.call(method, priority=BACKGROUND, **kwargs)
+
+    def _validate_record(self, file_info: dict):
+        """Checks a single record against cloud. Returns a tuple of (exists, size in cloud). exists is None if it couldn't be found out (Ex: network errors)."""
+        file_id, message_id = file_info["file_id"], file_info["message_id"]
+        try:
+            cloud_file_size = 0
+            for part in file_info.get("parts", [file_info]):   # Every part of a multi-part file must be present.
+                cloud_file = self._call_with_budget(self.__bot.get_file, file_id=part["file_id"])
+                cloud_file_size += cloud_file.file_size
+            logger.debug(f"File is present in cloud, Ref Files ID: {file_id}")
+        except telegram_error.BadRequest:
+            logger.info(f"The file no longer exists on cloud! Removing it from schema. Ref Id: {file_id}")
+            return False, 0
+        except telegram_error.TelegramError as err:
+            logger.warning(f"Unable to check file with Ref Id: {file_id}, will be checked again in next run. Error: {err}")
+            return None, 0
+        try:
+            self._call_with_budget(self.__bot.copy_message, from_chat_id=self._channel_id, chat_id="", message_id=message_id)    # not specifying to chat_id. As we are using this method to just check if message exists or not.
+        except telegram_error.TelegramError as err:
+            if "Message to copy not found" in str(err):
+                logger.info(f"Underlying message for a file with message id '{message_id}' is deleted. SO deleting file record from schema!!")
+                return False, 0
+        return True, cloud_file_size
+
+    def get_validation_progress(self) -> dict:
+        """Progress of current / last validation run. Runs done by validate jobs are reported from job state, they may be running in another process (leader)."""
+        if not self.VALIDATION_ACTIVE:
+            for job in self.jobs.list("validate"):
+                if "progress" in job["data"]:
+                    return {**job["data"]["progress"], "active": job["status"] in ACTIVE_STATUSES}
+        return {**self._validation_progress, "active": self.VALIDATION_ACTIVE}
+
+    def _get_records_snapshot(self, directory: str = "") -> list[tuple[dict, str]] | bool:
+        """Every file record in schema (or in `directory` and it's sub folders) as a list of (record, folder path), taken under read lock. Records are the same dict objects as in live schema. False if directory doesn't exist."""
+        records = []
+        def walk(node: dict, path_key: str):
+            for record in node.get("root", []):
+                records.append((record, path_key))
+            for key, value in node.items():
+                if key not in ("root", "meta") and isinstance(value, dict):
+                    walk(value, f"{path_key}/{key}" if path_key else key)
+        with self._schema_lock.read():
+            path_key = self._ops.get_path_key(directory)
+            node = self._ops.lookup_folder(self._schema, directory)
+            if node is None:
+                return False
+            walk(node, path_key)
+        return records
+
+    def list_files(self, directory: str = "") -> list[tuple[dict, str]] | bool:
+        """Every file in `directory` and it's sub folders, as a list of (record, folder path). False if directory doesn't exist. Records must not be modified."""
+        return self._get_records_snapshot(directory)
+
+    def _merge_validation(self, snapshot: list[tuple[dict, str]], results: dict[str, list], full_run: bool):
+        """Applies results of a validation run to live schema. Records removed / moved by user meanwhile are looked up again, files added meanwhile are left untouched.\n
+           Each validated record gets `last_validated` (epoch seconds) and `size_bytes` (size in cloud), total size in meta is summed up from `size_bytes` of all records.
+        """
+        with self._schema_lock.write():
+            dropped = []
+            for file_info, path_key in snapshot:
+                key = self._get_validation_key(file_info)
+                if key is None:
+                    logger.error(f"Ill-Formatted record found. File_ID missing. Dropping it.")
+                result = [False, 0, None] if key is None else results.get(key)
+                if result is None:
+                    continue    # Not checked in this run.
+                exists, cloud_file_size, checked_at = result
+                if exists:
+                    file_info["size"] = size(cloud_file_size)     # save in KB / MB string.
+                    file_info["size_bytes"] = cloud_file_size
+                    file_info["last_validated"] = checked_at
+                    continue
+                try:    # Folder may have been moved since snapshot, find where record is now.
+                    path_key = next((current_path for record, current_path in self._ops.lookup_message_id(file_info["message_id"]) if record is file_info), None)
+                except (KeyError, ValueError, TypeError):
+                    pass    # Ill-formatted record, isn't indexed. Still where it was.
+                node = self._ops.lookup_folder(self._schema, path_key) if path_key is not None else None
+                if node is None or not any(record is file_info for record in node.get("root", [])):
+                    continue    # Already deleted.
+                node["root"][:] = [record for record in node["root"] if record is not file_info]
+                self._ops.unindex_file(file_info, path_key)
+                dropped.append(file_info)
+                self._invalidate_cached_parts(part["file_id"] for part in file_info.get("parts", [file_info]) if "file_id" in part)
+            total_size = sum(entries[0][0].get("size_bytes", entries[0][0].get("total_size", 0)) for entries in self._ops._by_message_id.values() if entries)    # Linked duplicates share messages, counted once.
+            if full_run:
+                self._schema["meta"]["last_validated"] = str(datetime.utcnow())
+            self._schema["meta"]["total_size"] = size(total_size)
+            released = self._release_chunks(dropped)
+        self._delete_chunk_messages(released)
+        logger.info(f"Validation dropped {len(dropped)} records from schema.")
+
+    def get_directory_listing(self, directory: str = ""):
+        """Files and sub folder names in a directory, read under schema read lock. Returns a tuple of (files, folders, err), files is False if directory is invalid. Lists are copies, safe to use after lock is released."""
+        with self._schema_lock.read():
+            if self._ops.get_path_key(directory) == "":
+                node = self._schema
+            else:
+                _, node, err = self._ops.get_contents_in_directory(directory, self._schema.copy(), files_only=False)
+                if node is False:
+                    return False, False, err
+            return list(node["root"]), [key for key in node.keys() if key not in ("root", "meta")], ""
+
+    def get_schema_meta(self) -> dict:
+        """Copy of schema `meta` (total size, last validated time)."""
+        with self._schema_lock.read():
+            return dict(self._schema["meta"])
+
+    def background_lane(self):
+        """Context manager, Bot API calls made by current thread inside it wait for interactive (UI) calls. Ex: `with bot.background_lane(): bot.upload_file(...)` in bulk jobs."""
+        return self._api.lane(BACKGROUND)
 
     def is_validation_active(self) -> bool:
-        return self.VALIDATION_ACTIVE
+        return self.VALIDATION_ACTIVE or any(job["status"] in ACTIVE_STATUSES for job in self.jobs.list("validate"))
+
+    def _get_member_count(self) -> int:
+        return self._api.call(self.__bot.get_chat_members_count, chat_id=self._channel_id)     # Get number of users added to the channel.
 
     def get_active_users_in_channel(self):
         """Get Number of users are currently added to channel. For best security only you and bot (total 2) must be the members present in the private channel."""
         error = None
-        chat_member_count = self.__bot.get_chat_members_count(self.__channel_id)     # Get number of users added to the channel.
+        chat_member_count = self._metadata.get("member_count", self._channel_id, self._get_member_count)   # Cached, refreshed in background. Index page doesn't wait on telegram for it.
         if chat_member_count > 2:
             error = f"[Security Breach] -> Number of users in channel is more than two: '{chat_member_count}' !! Please go to telegram app, manually remove everyone except the bot. Otherwise they may have access to any un-encrypted files in the channel!!"
             logger.warning(error)
         return chat_member_count, error
 
+    def _read_blocks(self, file, digest=None):
+        """Reads the given file object in blocks of `READ_BLOCK_SIZE`, So memory used doesn't depend on file size. `digest` (a hashlib object) is updated with everything read."""
+        while block := file.read(READ_BLOCK_SIZE):
+            if digest is not None:
+                digest.update(block)
+            yield block
+
+    def _spool_blocks_until(self, blocks, limit: int):
+        """Reads `blocks` into a spooled temp file till more than `limit` bytes are seen (or they run out), to find out if content is bigger than `limit` without holding it in memory.\n
+           Returns a tuple of (blocks to read instead of `blocks`, True if content is bigger than `limit`).
+        """
+        head = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE)
+        for block in blocks:
+            head.write(block)
+            if head.tell() > limit:
+                break
+        is_bigger = head.tell() > limit
+        def replay():
+            with head:
+                head.seek(0)
+                while block := head.read(READ_BLOCK_SIZE):
+                    yield block
+            yield from blocks
+        return replay(), is_bigger
+
+    def _iter_spooled_parts(self, blocks, codec: str = None):
+        """Cuts a stream of plain blocks into parts, each part is compressed with `codec` (if any, as a stream of it's own) and encrypted (if enabled) into a spooled temp file as it's read.\n
+           A part holds `self._part_size` plain bytes, or as many as compress into `self._part_size` bytes. So a compressible file takes fewer messages.
+           Yields a tuple of (payload file, is_last, plain size) per part, payload is ready to be sent as it is. Caller closes payload files.
+        """
+        blocks, pending, plain_size = iter(blocks), memoryview(b""), 0
+        def fill() -> memoryview:
+            nonlocal pending
+            if not pending:
+                pending = memoryview(next(blocks, b""))
+            return pending
+        def iter_part_content():
+            nonlocal pending, plain_size
+            compressor, output_size = Compressor(codec, self._compression_level) if codec else None, 0
+            while fill():
+                if compressor is None:
+                    if plain_size >= self._part_size:
+                        break
+                    data = pending[:self._part_size - plain_size]
+                else:
+                    data = pending[:FEED_SIZE]
+                    if plain_size > 0 and output_size + len(data) + 1024 > self._part_size:  # Next feed may not compress at all, start a new part before it can overflow.
+                        break
+                pending, plain_size = pending[len(data):], plain_size + len(data)
+                if compressor is not None:
+                    data = compressor.compress(data)
+                    output_size += len(data)
+                yield data
+            if compressor is not None:
+                yield compressor.finish()
+        while True:
+            plain_size = 0
+            content = iter_part_content()
+            if self._is_encryption_enabled:
+                content = self.__file_ops.get_encrypted_stream(content)
+            payload = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE)
+            try:
+                for piece in content:
+                    payload.write(piece)
+                if payload.tell() > MAX_UPLOAD_SIZE:
+                    raise ValueError(f"File is too big to upload. Expected: <=20MB, Actual: {payload.tell()} bytes!!")
+            except Exception:
+                payload.close()
+                raise
+            is_last = not fill()
+            yield payload, is_last, plain_size
+            if is_last:
+                return
+
+    def prepare_part(self, content: bytes) -> bytes:
+        """Encrypts (if enabled) content of a single message, and checks it fits in one. Returns bytes to be sent as is."""
+        if self._is_encryption_enabled:
+            content = self.__file_ops.get_encrypted_data_binary(content)
+        # Although telegram can upload files upto 50 mb, it can only download upto 20MB (weird right?), So let's limit upload also to 20 mb, why to upload something we can't recover?
+        if len(content) > MAX_UPLOAD_SIZE:
+            raise ValueError(f"File is too big to upload. Expected: <=20MB, Actual: {len(content)} bytes!!")
+        return content
+
+    def _choose_compression(self, file_name: str, sample: bytes) -> str | None:
+        """Codec to compress a file with, None if compression is disabled or file isn't worth compressing (already compressed type, or it's first bytes in `sample` don't shrink)."""
+        if self._compression is None or not is_worth_compressing(file_name, sample, self._compression, self._compression_level):
+            return None
+        return self._compression
+
+    def prepare_file(self, content: bytes, file_name: str):
+        """Compresses (if worth it) and encrypts (if enabled) content of a small file that fits in one message. Returns a tuple of (bytes to be sent as is, compression codec or None)."""
+        codec = self._choose_compression(file_name, content)
+        if codec is not None:
+            compressed = compress(content, codec, self._compression_level)
+            if len(compressed) < len(content):
+                content = compressed
+            else:
+                codec = None
+        return self.prepare_part(content), codec
+
+    def _send_part(self, content, file_name: str, prepared: bool = False):
+        """Encrypts (if enabled, unless content is already `prepared`) and uploads a single message to channel. Returns the telegram response message.\n
+           `content` is bytes, or a seekable file object with prepared content (Ex: a spooled part), which is streamed into the request as it's sent.
+        """
+        if not prepared:
+            content = self.prepare_part(content)
+        if isinstance(content, (bytes, bytearray)):
+            content = io.BytesIO(content)
+        # A send that timed out may still have been delivered, it is not retried (that would leave a duplicate message behind).
+        return self._api.call(send_document_stream, self.__bot, retry_timeouts=False, chat_id=self._channel_id, document=content, filename=file_name, caption=file_name, timeout=60)
+
+    def _send_part_in_lane(self, lane: int, payload, file_name: str):
+        """Sends a prepared payload file with given priority, payload is closed once it's sent."""
+        with payload, self._api.lane(lane):
+            return self._send_part(payload, file_name, prepared=True)
+
+    def _upload_parts(self, parts, file_name: str, compression: str = None) -> list[dict]:
+        """Uploads each (payload file, is_last, plain_size) from `parts` (see `_iter_spooled_parts`) as a separate message using a bounded pool of workers. Returns ordered part manifest.\n
+           At most `self._upload_workers` parts are prepared ahead at a time. If any part fails, already uploaded parts are deleted and error is raised.
+           `compression` is codec parts are compressed with (each part on it's own), recorded in manifest.
+        """
+        slots = threading.BoundedSemaphore(self._upload_workers)   # Stop reading further parts from file, until a worker is free.
+        failed = threading.Event()  # No point in reading, uploading further parts once a part has failed.
+        def on_part_done(future):
+            if future.exception() is not None:
+                failed.set()
+            slots.release()
+        futures = []
+        lane = self._api.current_lane()     # Parts are uploaded with same priority as caller.
+        with ThreadPoolExecutor(max_workers=self._upload_workers, thread_name_prefix="part-upload") as pool:
+            for index, (payload, _, plain_size) in enumerate(parts):
+                slots.acquire()
+                if failed.is_set():
+                    payload.close()
+                    slots.release()
+                    break
+                future = pool.submit(self._send_part_in_lane, lane, payload, f"{file_name}.part{index:04d}")
+                future.add_done_callback(on_part_done)
+                futures.append((future, plain_size))
+        manifest, errors = [], []
+        for future, part_size in futures:
+            try:
+                response = future.result()
+                manifest.append(self._make_part_entry(response.message_id, response.document.file_id, part_size, compression))
+            except Exception as err:
+                errors.append(err)
+        if errors:
+            logger.error(f"{len(errors)} out of {len(futures)} parts of '{file_name}' failed to upload, cleaning up the {len(manifest)} parts that were uploaded.")
+            self._delete_record_messages({"parts": manifest})
+            raise errors[0]
+        return manifest
+
+    def _get_chunk_key(self, chunk: bytes) -> str:
+        """Chunk store key of a chunk, it's SHA-256. Encrypted and plain copies of same content are different chunks."""
+        return f"{hashlib.sha256(chunk).hexdigest()}.{'enc' if self._is_encryption_enabled else 'plain'}"
+
+    def _send_chunk_in_lane(self, lane: int, chunk_key: str, chunk: bytes, file_name: str, compression: str = None) -> dict:
+        """Uploads a chunk (compressed with `compression` codec, if it shrinks), registers it in chunk store (pinned). Returns it's chunk store info."""
+        payload = compress(chunk, compression, self._compression_level) if compression else chunk
+        if len(payload) >= len(chunk):
+            payload, compression = chunk, None
+        with self._api.lane(lane):
+            response = self._send_part(payload, file_name)
+        self._chunks.add(chunk_key, response.message_id, response.document.file_id, len(chunk), compression=compression)
+        return {"message_id": response.message_id, "file_id": response.document.file_id, "size": len(chunk), **({"compression": compression} if compression else {})}
+
+    def _upload_chunked(self, blocks, file_name: str, digest, compression: str = None) -> dict:
+        """Uploads a big file through chunk store, returns it's schema record. Content is split into content defined chunks (`CHUNK_AVG_SIZE_MB` on average), each chunk is a message of it's own.\n
+           Only chunks not already in channel are uploaded (in parallel, like parts), a small manifest message listing the chunks gives the record a message / file id of it's own.
+           Chunks used by the record stay pinned till it is added to schema. If anything fails, chunks uploaded for this file are deleted again and error is raised.
+           New chunks are compressed with `compression` codec on their own, a chunk already in channel is used as it was stored.
+        """
+        min_size, max_size = self._chunk_avg_size // 4, min(self._chunk_avg_size * 4, self._part_size)
+        slots = threading.BoundedSemaphore(self._upload_workers)
+        failed = threading.Event()
+        def on_chunk_done(future):
+            if future.exception() is not None:
+                failed.set()
+            slots.release()
+        lane = self._api.current_lane()
+        chunks: dict[str, object] = {}    # Chunk key -> chunk store info, or future of it's upload. A chunk repeated within the file is uploaded once.
+        order, new_keys, reused_bytes = [], [], 0
+        with ThreadPoolExecutor(max_workers=self._upload_workers, thread_name_prefix="chunk-upload") as pool:
+            for index, chunk in enumerate(iter_chunks(blocks, min_size, self._chunk_avg_size, max_size)):
+                if failed.is_set():
+                    break
+                key = self._get_chunk_key(chunk)
+                order.append((key, len(chunk)))
+                if key in chunks:
+                    reused_bytes += len(chunk)
+                    continue
+                info = self._chunks.acquire(key)   # Already in channel, pinned so that it isn't collected meanwhile.
+                if info is not None:
+                    chunks[key] = info
+                    reused_bytes += len(chunk)
+                    continue
+                slots.acquire()
+                future = pool.submit(self._send_chunk_in_lane, lane, key, chunk, f"{file_name}.chunk{index:05d}", compression)
+                future.add_done_callback(on_chunk_done)
+                chunks[key] = future
+                new_keys.append(key)
+        errors = []
+        for key, value in list(chunks.items()):
+            if not isinstance(value, dict):
+                try:
+                    chunks[key] = value.result()
+                except Exception as err:
+                    errors.append(err)
+                    chunks.pop(key)     # Not in store, nothing to release.
+        try:
+            if errors:
+                raise errors[0]
+            manifest = [{**{field: chunks[key][field] for field in ("message_id", "file_id", "compression") if field in chunks[key]}, "size": chunk_size, "chunk": key} for key, chunk_size in order]
+            total_size = sum(chunk_size for _, chunk_size in order)
+            response = self._send_part(json.dumps({"filename": file_name, "total_size": total_size, "sha256": digest.hexdigest(), "parts": manifest}).encode('utf8'), f"{file_name}.manifest")
+        except Exception:
+            logger.error(f"Chunked upload of '{file_name}' failed, cleaning up the {len(new_keys) - len(errors)} chunks that were uploaded.")
+            self._chunks.release(chunks.keys())
+            with self._schema_lock.read():
+                released = self._chunks.pop_unreferenced([key for key in new_keys if key in chunks], self._ops.get_chunk_refcount)
+            self._delete_chunk_messages(released)
+            raise
+        self._chunk_pins[response.message_id] = list(chunks.keys())
+        logger.info(f"Uploaded '{file_name}' as {len(order)} chunks, {len(new_keys)} new, {reused_bytes} of {total_size} bytes were already in channel.")
+        return {'filename': file_name, 'message_id': response.message_id, 'file_id': response.document.file_id, "size": size(total_size), "total_size": total_size,
+                "is_encrypted": self._is_encryption_enabled, "parts": manifest, "chunked": True}
+
+    def _release_chunks(self, records: list[dict]) -> list[tuple[str, dict]]:
+        """Chunks of given chunked records (just removed from schema) that are no longer referenced, dropped from chunk store. Call under schema lock, delete their messages with `_delete_chunk_messages` once it's released."""
+        keys = [part["chunk"] for record in records if record.get("chunked") for part in record.get("parts", [])]
+        return self._chunks.pop_unreferenced(keys, self._ops.get_chunk_refcount) if keys else []
+
+    def _delete_chunk_messages(self, chunks: list[tuple[str, dict]]):
+        """Deletes messages of chunks dropped from chunk store. A chunk that couldn't be deleted is put back in store (unreferenced), for garbage collection to try again."""
+        for key, info in chunks:
+            self._invalidate_cached_parts([info["file_id"]])
+            try:
+                self._api.call(self.__bot.delete_message, chat_id=self._channel_id, message_id=info["message_id"])
+            except telegram_error.TelegramError as err:
+                if "Message to delete not found" not in str(err):
+                    logger.warning(f"Unable to delete chunk with Message ID {info['message_id']}, will be retried by garbage collection. Error: {err}")
+                    self._chunks.add(key, info["message_id"], info["file_id"], info["size"], compression=info.get("compression"), pin=False)
+
+    def collect_garbage(self, grace_seconds: int = None) -> dict:
+        """Garbage collection pass over chunk store. Deletes chunks no record references, that are older than `grace_seconds` (`CHUNK_GC_GRACE_SECONDS` by default). \n
+           Such chunks are left behind by uploads interrupted before their record was added, or deletes that failed. Returns counts of chunks, bytes freed.
+        """
+        grace_seconds = self._chunk_gc_grace if grace_seconds is None else grace_seconds
+        with self._schema_lock.read():  # Refcounts don't change meanwhile.
+            released = self._chunks.pop_unreferenced(self._chunks.keys(), self._ops.get_chunk_refcount, added_before=time.time() - grace_seconds)
+        self._delete_chunk_messages(released)
+        freed_bytes = sum(info["size"] for _, info in released)
+        logger.info(f"Chunk store garbage collection deleted {len(released)} unreferenced chunks, {freed_bytes} bytes.")
+        return {"collected_chunks": len(released), "freed_bytes": freed_bytes}
+
+    def get_chunk_stats(self) -> dict:
+        """Chunk store stats: chunks, bytes stored in channel, bytes referenced by files and dedup ratio (referenced / stored)."""
+        with self._schema_lock.read():
+            return self._chunks.get_stats(self._ops.get_chunk_refcount)
+
     def upload_file(self, file: datastructures.FileStorage, file_name: str, update_schema: bool = True, directory: str = ""):
+        """Uploads the given file (file like object / bytes) to channel. Files bigger than one message can hold are split into parts, uploaded in parallel. \n
+           Such files are saved as a single schema record with an ordered `parts` manifest, `message_id` & `file_id` of the record point to first part.
+           With `update_schema=False` (schema backup), that manifest is uploaded as a message of it's own and it's file_id is returned, read it back with `download_schema_backup`.
+        """
+        res, err = self._ops.get_sanitized_file_path(directory)  # sanity check
+        if res is False:
+            return False, err   # return the error to caller.
+        file_info, err = self.upload_record(file, file_name, chunked=None if update_schema else False, compress=update_schema)  # A file not added to schema (schema backup) must be downloadable by it's file_id alone, So no codec to remember either.
+        if file_info is False:
+            return False, err
+        if update_schema:   # True for most cases, except for uploading schema file itself to cloud for persistence.
+            res, err = self.add_file_record(file_info, directory)
+            if res is False:
+                return False, err
+        elif "parts" in file_info:  # First part alone is not the file, a manifest of all parts is uploaded instead. See `download_schema_backup`.
+            manifest = {PARTS_MANIFEST_KEY: file_info["parts"], "is_encrypted": file_info["is_encrypted"], "enc_format": file_info.get("enc_format")}
+            file_info, err = self.upload_record(json.dumps(manifest).encode('utf8'), f"{file_name}.parts.json", chunked=False, compress=False)
+            if file_info is False:
+                return False, err
+        return True, file_info["file_id"]
+
+    def upload_record(self, file, file_name: str, prepared_part: bytes = None, plain_size: int = None, sha256: str = None, chunked: bool = None, compression: str = None, compress: bool = True):
+        """Uploads a file to channel without adding it to schema, returns a tuple of (schema record, error). Record is False if upload failed. Add it to schema with `add_file_record`.\n
+           `prepared_part` is content of a small file already passed through `prepare_file` (`plain_size`, `sha256` are size and hash of it's content before encryption, `compression` the codec it returned), `file` is ignored then.
+           Otherwise content is compressed (if enabled and worth it) before encryption, in parts that are decompressed on their own.
+           SHA-256 of content is saved in record, used to find duplicates / unchanged files later.
+           `chunked` uploads a big file through chunk store (see `_upload_chunked`), Default is `CHUNK_STORE` setting from env. `compress=False` uploads content uncompressed, whatever `COMPRESSION` is.
+           This lets bulk uploads read / encrypt files and upload them in separate stages.
+        """
         try:
             file_name = sanitize_filename(file_name)
-            res, err = self._ops.get_sanitized_file_path(directory)  # sanity check
-            if res is False:
-                return False, err   # return the error to caller.
-            if self._is_encryption_enabled:
-                logger.info(f"Attempting to encrypt the file '{file_name}' before upload!")
-                file: bytes = self.__file_ops.get_encrypted_data_binary(file if isinstance(file, bytes) else file.read())   # Upload encrypted file if encryption is enabled.
-            # If length of file to be uploaded is too big, reject upload request with error. Although telegram can upload files upto 50 mb, it can only download upto 20MB (weird right?), So let's limit upload also to 20 mb, why to upload something we can't recover?
-            upload_size = len(file)
-            if upload_size > 19999999:    # Limiting to 19.99 MB ;)
-                return False, f"File is too big to upload. Expected: <=20MB, Actual: {upload_size} bytes!!"
-            response = self.__bot.send_document(filename=file_name, caption=file_name, chat_id=self.__channel_id, document=InputFile(file, filename=file_name), timeout=60)   # Encrypted upload.
-            # message_id is used to delete the file later, document.file_id is used for downloading, Size is saved in raw bytes (useful for calculating total size used in telegram cloud).
-            file_info = {'filename': file_name, 'message_id': response.message_id, 'file_id': response.document.file_id, "size": size(response.document.file_size), "is_encrypted": self._is_encryption_enabled}
-            if update_schema:   # True for most cases, except for uploading schema file itself to cloud for persistence.
-                if directory == "":     # Append to default root directory if unspecified.
-                    self._schema["root"].append(file_info)
+            if prepared_part is not None:
+                response = self._send_part(prepared_part, file_name, prepared=True)
+                file_info = self._make_record(file_name, response.message_id, response.document.file_id, response.document.file_size, plain_size, compression)
+            else:
+                if isinstance(file, (bytes, bytearray)):
+                    file = io.BytesIO(file)
+                if self._is_encryption_enabled:
+                    logger.info(f"Attempting to encrypt the file '{file_name}' before upload!")
+                digest = hashlib.sha256()
+                blocks = self._read_blocks(file, digest)   # Content streams from file through compression, encryption into request body, whole file is never in memory.
+                first_block = next(blocks, b"")
+                codec = self._choose_compression(file_name, first_block) if compress else None
+                blocks, is_big = itertools.chain([first_block], blocks), False
+                if self._chunk_store_enabled if chunked is None else chunked:   # Only files that don't fit in one message go through chunk store.
+                    blocks, is_big = self._spool_blocks_until(blocks, self._part_size)
+                if is_big:
+                    file_info = self._upload_chunked(blocks, file_name, digest, codec)
                 else:
-                    modified_schema, err = self._ops.manipulate_schema(directory, file_info, self._schema.copy(), False)
-                    if modified_schema is False:
-                        logger.error(f"File uploaded, but unable to add it to schema, Error: {err}")
-                        return False, err
-                    self._schema = modified_schema.copy()
-                logger.debug(f"File uploaded to path '{directory}' successfully. Message ID: {response.message_id}")
-                self.save_schema()
-            return True, response.document.file_id
+                    parts = self._iter_spooled_parts(blocks, codec)
+                    first_payload, is_last, first_plain_size = next(parts)
+                    if is_last:   # Fits in a single message, record is saved as it always was.
+                        with first_payload:
+                            response = self._send_part(first_payload, file_name, prepared=True)
+                        file_info = self._make_record(file_name, response.message_id, response.document.file_id, response.document.file_size, first_plain_size, codec)
+                    else:
+                        logger.info(f"File '{file_name}' is bigger than {self._part_size} bytes{' (compressed)' if codec else ''}, uploading it in parts!")
+                        manifest = self._upload_parts(itertools.chain([(first_payload, False, first_plain_size)], parts), file_name, codec)
+                        file_info = self._make_parts_record(file_name, manifest)
+                sha256 = digest.hexdigest()     # Whole file is read by now.
+            return self._finish_record(file_info, sha256), None
         except Exception as e:
             logger.error(f"Error uploading file: {e}")
             return False, str(e)
 
-    def delete_file(self, full_path: str, message_id: int, with_out_schema_change: bool = False):
-        """Delete a file based in `message_id` and pop it's corresponding record from schema.\n
-           If `with_out_schema_change=True`, `full_path` is ignored, just delete is performed.
+    def _make_record(self, file_name: str, message_id: int, file_id: str, stored_size: int, plain_size: int, compression: str = None) -> dict:
+        """Schema record of a file uploaded as a single message."""
+        # message_id is used to delete the file later, file_id is used for downloading, Size is saved in raw bytes (useful for calculating total size used in telegram cloud).
+        file_info = {'filename': file_name, 'message_id': message_id, 'file_id': file_id, "size": size(stored_size), "total_size": plain_size, "is_encrypted": self._is_encryption_enabled}
+        if compression is not None:
+            file_info["compression"] = compression
+        return file_info
+
+    @staticmethod
+    def _make_part_entry(message_id: int, file_id: str, plain_size: int, compression: str = None) -> dict:
+        """Entry of a part in `parts` manifest of a multi-part record."""
+        return {"message_id": message_id, "file_id": file_id, "size": plain_size, **({"compression": compression} if compression else {})}
+
+    def _make_parts_record(self, file_name: str, manifest: list[dict]) -> dict:
+        """Schema record of a file uploaded in parts, `message_id` & `file_id` point to first part."""
+        total_size = sum(part["size"] for part in manifest)
+        logger.debug(f"Uploaded '{file_name}' as {len(manifest)} parts, total size: {total_size} bytes.")
+        return {'filename': file_name, 'message_id': manifest[0]["message_id"], 'file_id': manifest[0]["file_id"], "size": size(total_size), "total_size": total_size, "is_encrypted": self._is_encryption_enabled, "parts": manifest}
+
+    def _finish_record(self, file_info: dict, sha256: str = None) -> dict:
+        if sha256 is not None:
+            file_info["sha256"] = sha256
+        if self._is_encryption_enabled:
+            file_info["enc_format"] = ENC_FORMAT_ENVELOPE   # Format marker, so that files encrypted in older format can still be decrypted.
+        return file_info
+
+    def find_duplicate(self, sha256: str, total_size: int, directory: str = None) -> dict | None:
+        """A record already in schema with same content (sha256 and size), whose messages can be shared by another record instead of uploading content again. None if there is no such record.\n
+           If encryption is enabled, only encrypted copies are considered, So that a file meant to be encrypted never points to plain content.
+           Records in `directory` are not considered, as files in a folder are told apart by message_id (Ex: for deletion).
+        """
+        path_key = self._ops.get_path_key(directory) if directory is not None else None
+        with self._schema_lock.read():
+            for record, record_path in self._ops.lookup_sha256(sha256):
+                if record_path != path_key and record.get("total_size") == total_size and "message_id" in record and (record.get("is_encrypted") or not self._is_encryption_enabled):
+                    return record
+        return None
+
+    def is_file_in_schema(self, directory: str, file_name: str, sha256: str) -> bool:
+        """True if `directory` already has a file named `file_name` with same content. Used to skip unchanged files in backups."""
+        path_key, file_name = self._ops.get_path_key(directory), sanitize_filename(file_name)
+        with self._schema_lock.read():
+            return any(record_path == path_key and record.get("filename") == file_name for record, record_path in self._ops.lookup_sha256(sha256))
+
+    def get_file_records(self, directory: str, file_name: str) -> list[dict]:
+        """Records named `file_name` in `directory` (copies of them), Empty list if there are none."""
+        file_name = sanitize_filename(file_name)
+        with self._schema_lock.read():
+            folder = self._ops.lookup_folder(self._schema, directory)
+            return [dict(record) for record in (folder or {}).get("root", []) if record.get("filename") == file_name]
+
+    def link_file(self, existing_record: dict, file_name: str, directory: str = "", wait: bool = True):
+        """Adds a record named `file_name` at `directory` that points to same messages as `existing_record` (duplicate content is not uploaded again). Returns a tuple of (success, file_id or error).\n
+           Messages are only deleted from telegram when the last record pointing to them is deleted.
+        """
+        res, err = self._ops.get_sanitized_file_path(directory)  # sanity check
+        if res is False:
+            return False, err
+        file_info = {key: value for key, value in existing_record.items() if key not in ("filename", "last_validated")}
+        file_info["filename"] = sanitize_filename(file_name)
+        if "parts" in file_info:
+            file_info["parts"] = [dict(part) for part in file_info["parts"]]
+        res, err = self.add_file_record(file_info, directory, wait=wait)
+        if res is False:
+            return False, err
+        return True, file_info["file_id"]
+
+    def _is_shared(self, file_info: dict) -> bool:
+        """True if a record other than `file_info` points to the same messages (linked duplicate). Call under schema lock."""
+        if "message_id" not in file_info:
+            return False
+        return any(record is not file_info for record, _ in self._ops.lookup_message_id(file_info["message_id"]))
+
+    def add_file_record(self, file_info: dict, directory: str = "", wait: bool = True):
+        """Adds record of an uploaded file to schema at `directory` (journaled). Returns a tuple of (success, error).\n
+           `wait=False` returns without waiting for journal write to reach disk, bulk callers call `sync_schema()` once in a while instead.
         """
         try:
+            with self._schema_lock.write():
+                res, err = self._apply_add_file(file_info, directory)
+                if res is False:
+                    logger.error(f"File uploaded, but unable to add it to schema, Error: {err}")
+                    return False, err
+                seq = self._journal_change({"op": "add_file", "path": directory, "record": file_info})
+        finally:
+            self._chunks.release(self._chunk_pins.pop(file_info.get("message_id"), []))    # Chunks are referenced by record now (or left for garbage collection, if it couldn't be added).
+        if wait:
+            self._commit(seq)
+        logger.debug(f"File uploaded to path '{directory}' successfully. Message ID: {file_info['message_id']}")
+        return True, None
+
+    def add_file_records(self, records: list[dict], directory: str = ""):
+        """Adds records of several uploaded files to schema at `directory` in one transaction: Schema is locked once, changes are journaled as one entry, which is waited on once. Returns a tuple of (success, error)."""
+        if not records:
+            return True, None
+        try:
+            with self._schema_lock.write():
+                res, err = self._apply_add_files(records, directory)
+                if res is False:
+                    logger.error(f"Files uploaded, but unable to add them to schema, Error: {err}")
+                    return False, err
+                seq = self._journal_change({"op": "add_files", "path": directory, "records": records})
+        finally:
+            for record in records:
+                self._chunks.release(self._chunk_pins.pop(record.get("message_id"), []))
+        res, err = self._commit(seq)
+        if res is False:    # Records aren't on disk, taken back out of schema So caller can delete their messages without leaving records pointing to nothing.
+            logger.error(f"Files uploaded, but unable to save them to schema, Error: {err}")
+            with self._schema_lock.write():
+                for record in records:
+                    self._apply_delete_file(directory, record["message_id"])
+                    self._journal_change({"op": "delete_file", "path": directory, "message_id": record["message_id"]})
+            return False, err
+        logger.debug(f"{len(records)} files uploaded to path '{directory}' successfully.")
+        return True, None
+
+    def upload_files(self, files: list[tuple], directory: str = "") -> list[tuple]:
+        """Uploads several files, a list of (file like object / bytes, file_name), to `directory`. Files are uploaded `BATCH_UPLOAD_WORKERS` at a time (sends are still within rate limits), \n
+           records of all uploaded files are added to schema in one transaction (see `add_file_records`). Returns a list with a tuple of (success, file_id or error) per file, in same order.
+        """
+        res, err = self._ops.get_sanitized_file_path(directory)  # sanity check
+        if res is False:
+            return [(False, err)] * len(files)
+        lane = self._api.current_lane()     # Files are uploaded with same priority as caller.
+        def upload(file, file_name: str):
+            with self._api.lane(lane):
+                return self.upload_record(file, file_name)
+        with ThreadPoolExecutor(max_workers=max(self._batch_upload_workers, 1), thread_name_prefix="batch-upload") as pool:
+            futures = [pool.submit(upload, file, file_name) for file, file_name in files]
+        results, uploaded = [], []
+        for index, future in enumerate(futures):
+            file_info, err = future.result()
+            results.append((False, err) if file_info is False else None)
+            if file_info is not False:
+                uploaded.append((index, file_info))
+        try:
+            res, err = self.add_file_records([file_info for _, file_info in uploaded], directory)
+        except Exception as exc:
+            logger.exception(f"Unable to add {len(uploaded)} uploaded files to schema.")
+            res, err = False, str(exc)
+        for index, file_info in uploaded:
+            if res:
+                results[index] = (True, file_info["file_id"])
+                continue
+            deleted, delete_err = self._delete_record_messages(file_info)   # Not in schema, So nothing would ever reach or delete them. Chunks of a chunked record are left to garbage collection.
+            results[index] = (False, err if deleted else f"{err}; Uploaded messages were left in channel, {delete_err}")
+        logger.info(f"Uploaded {len(uploaded)} out of {len(files)} files to '{directory}'{'' if res else ', but could not add them to schema'}.")
+        return results
+
+    def upload_files_in_background(self, files: list[tuple], directory: str = "") -> str:
+        """Saves several files, a list of (file like object, file_name), to disk and uploads them to `directory` with an `upload_files` job. Returns id of the job.\n
+           Files are kept on disk till they're uploaded, So an upload interrupted by a restart resumes on next start.
+        """
+        os.makedirs(self._job_files_folder, exist_ok=True)
+        folder = tempfile.mkdtemp(prefix="upload_", dir=self._job_files_folder)
+        saved = []
+        for index, (file, file_name) in enumerate(files):
+            file_path = path.join(folder, str(index))
+            with open(file_path, 'wb') as local_file:
+                shutil.copyfileobj(file, local_file, READ_BLOCK_SIZE)
+            saved.append([file_path, file_name])
+        job_id, _ = self.jobs.submit("upload_files", {"directory": directory, "folder": folder, "files": saved})
+        logger.info(f"Uploading {len(files)} files to '{directory}' in background, job: {job_id}.")
+        return job_id
+
+    def _run_upload_job(self, job: Job, directory: str, folder: str, files: list[list[str]]) -> dict:
+        """`upload_files` job. Files saved by `upload_files_in_background` are uploaded in batches with `upload_files` (each batch is one schema transaction), and removed from disk.\n
+           Number of files done is kept in job's data, a resumed job starts from the batch that was in progress (it's files may be uploaded again if it was already committed).
+        """
+        sizes = [path.getsize(file_path) if path.exists(file_path) else 0 for file_path, _ in files]
+        done, errors = job.data.setdefault("done", 0), job.data.setdefault("errors", [])    # Files (in order) uploaded by an earlier run.
+        job.set_total(items=len(files), bytes=sum(sizes))
+        job.set_done(items=done, bytes=sum(sizes[:done]))
+        batch_size = max(self._batch_upload_workers, 1) * 2
+        try:
+            for batch_start in range(done, len(files), batch_size):
+                job.checkpoint()
+                batch = files[batch_start:batch_start + batch_size]
+                remaining = [(file_path, file_name) for file_path, file_name in batch if path.exists(file_path)]    # Uploaded ones are removed, if an earlier run stopped mid batch.
+                handles = [open(file_path, 'rb') for file_path, _ in remaining]
+                try:
+                    results = self.upload_files([(handle, file_name) for handle, (_, file_name) in zip(handles, remaining)], directory)
+                finally:
+                    for handle in handles:
+                        handle.close()
+                for (file_path, file_name), (success, err) in zip(remaining, results):
+                    if success is False:
+                        errors.append(f"{file_name}: {err}")
+                    os.remove(file_path)
+                job.data["done"] = batch_start + len(batch)
+                job.advance(len(batch), sum(sizes[batch_start:batch_start + len(batch)]))
+                job.save()
+        finally:    # Finished, failed or cancelled. Not reached if server stops meanwhile, files are left for resumed job.
+            shutil.rmtree(folder, ignore_errors=True)
+        return {"uploaded": len(files) - len(errors), "errors": errors}
+
+    def _run_persist_schema_job(self, job: Job) -> dict:
+        """`persist_schema` job, uploads an up to date snapshot of schema to channel. It's file_id is the job's result, use it to recover schema."""
+        res, err = self.save_schema()  # schema.json is only a snapshot, bring it up to date with journal first.
+        if res is False:
+            raise RuntimeError(f"Unable to save schema before upload: {err}")
+        with open(self._schema_filepath, 'rb') as schema_file:
+            success, file_id = self.upload_file(file=schema_file, file_name=path.basename(self._schema_filepath), update_schema=False)
+        if success is False:
+            raise RuntimeError(file_id)     # This is not file_id but error if success is False.
+        logger.info(f"Schema uploaded to channel, Use {file_id} to recover!")
+        return {"file_id": file_id}
+
+    def sync_schema(self):
+        """Waits till every schema change made so far is on disk."""
+        self._commit(self._journal.last_seq)
+
+    def _apply_add_file(self, file_info: dict, directory: str):
+        """Adds a file record to schema at `directory`, Used both for new uploads and journal replay."""
+        if directory == "":     # Append to default root directory if unspecified.
+            self._schema["root"].append(file_info)
+        else:
+            modified_schema, err = self._ops.manipulate_schema(directory, file_info, self._schema.copy(), False)
+            if modified_schema is False:
+                return False, err
+            self._schema = modified_schema.copy()
+        self._ops.index_file(self._schema, file_info, directory)
+        return True, None
+
+    def _apply_add_files(self, records: list[dict], directory: str):
+        """Adds several file records to schema at `directory`, path is walked (folders created) only once. Used both for batch uploads and journal replay."""
+        res, err = self._apply_add_file(records[0], directory)
+        if res is False:
+            return False, err
+        folder = self._ops.lookup_folder(self._schema, directory)
+        for file_info in records[1:]:
+            folder["root"].append(file_info)
+            self._ops.index_file(self._schema, file_info, directory)
+        return True, None
+
+    def _take_record_messages(self, file_info: dict) -> list[int]:
+        """Message ids that belong to a file record (all parts of a multi-part file, or the single message), about to be deleted. Their content is dropped from download caches."""
+        message_ids = [part["message_id"] for part in file_info["parts"]] if "parts" in file_info else [file_info["message_id"]]
+        owned_parts = file_info.get("parts", [file_info])
+        if file_info.get("chunked"):    # Only manifest belongs to record, chunks are deleted once nothing references them.
+            message_ids, owned_parts = [file_info["message_id"]], [file_info]
+        self._invalidate_cached_parts(part["file_id"] for part in owned_parts if "file_id" in part)
+        return message_ids
+
+    def _delete_record_messages(self, file_info: dict):
+        """Deletes every message that belongs to a file record (all parts of a multi-part file, or the single message). Messages already missing in telegram are treated as deleted."""
+        message_ids = self._take_record_messages(file_info)
+        errors = []
+        for message_id in message_ids:
             try:
-                res = self.__bot.delete_message(chat_id=self.__channel_id, message_id=message_id)   # deletion is not based on file id, but message_id.
+                self._api.call(self.__bot.delete_message, chat_id=self._channel_id, message_id=message_id)   # deletion is not based on file id, but message_id.
             except telegram_error.TelegramError as err:
-                if "Message to delete not found" in str(err):
-                    res = True  # Message is already deleted from telegram, so we can proceed to delete it from schema as well.. Any other error, we don't remove from schema.
-            if res is True:
-                if with_out_schema_change is True:
-                    return True, ""  # return without schema change if arg is specified.
-                modified_schema, err = self._ops.manipulate_schema(full_path, {"message_id": int(message_id)}, self._schema.copy(), delete=True)
-                if modified_schema is False:
+                if "Message to delete not found" not in str(err):   # Message is already deleted from telegram, Any other error, we don't remove from schema.
+                    errors.append(f"Message ID {message_id}: {err}")
+        if errors:
+            return False, "; ".join(errors)
+        return True, ""
+
+    def delete_file(self, full_path: str, message_id: int, with_out_schema_change: bool = False):
+        """Delete a file based in `message_id` and pop it's corresponding record from schema. All parts are deleted if the record is a multi-part file.\n
+           If `with_out_schema_change=True`, `full_path` is ignored, just delete is performed.
+        """
+        try:
+            if with_out_schema_change is True:
+                res, err = self._delete_record_messages({"message_id": int(message_id)})
+                if res is False:
+                    logger.error(f"Error deleting file with Message_ID: {message_id}, Error: {err}")
                     return False, err
-                self._schema = modified_schema.copy()
-                self.save_schema()
-                logger.debug(f"File with Message_ID: {message_id} deleted successfully!")
-                return True, None
+                return True, ""  # return without schema change if arg is specified.
+            file_info, shared, err = self._take_file_record(full_path, message_id)
+            if err is not None:
+                return False, err
+            if not shared:  # Messages of a linked duplicate are left alone, other records still point to them.
+                res, err = self._delete_record_messages(file_info or {"message_id": int(message_id)})
+                if res is False:
+                    logger.error(f"Error deleting file with Message_ID: {message_id}, Error: {err}")
+                    self._restore_file_record(full_path, file_info)
+                    return False, err
+            self._release_file_chunks(file_info)
+            logger.debug(f"File with Message_ID: {message_id} deleted successfully!")
+            return True, None
         except Exception as e:
             logger.error(f"Error deleting file: {e}")
             return False, e
 
+    def _take_file_record(self, full_path: str, message_id: int) -> tuple[dict | None, bool, str | None]:
+        """Pops record with `message_id` at `full_path` from schema (journaled) before it's messages are deleted, So a concurrent upload can't link to messages about to be gone.\n
+           Returns a tuple of (record or None if it's not in schema, True if other records still share it's messages, error). Shared check is done under the same write lock.
+        """
+        with self._schema_lock.write():
+            file_info = None
+            path_key = self._ops.get_path_key(full_path)
+            for record, record_path in self._ops.lookup_message_id(message_id):
+                if record_path == path_key:
+                    file_info = record
+                    break
+            shared = self._is_shared(file_info or {"message_id": int(message_id)})
+            res, err = self._apply_delete_file(full_path, message_id)
+            if res is False:
+                return None, False, err
+            seq = self._journal_change({"op": "delete_file", "path": full_path, "message_id": int(message_id)})
+        self._commit(seq)
+        return file_info, shared, None
+
+    def _restore_file_record(self, full_path: str, file_info: dict | None):
+        """Puts back a record popped by `_take_file_record` whose messages couldn't be deleted, So they're still reachable (and deletable) from schema."""
+        if file_info is None:
+            return  # Wasn't in schema to begin with.
+        res, err = self.add_file_record(file_info, full_path)
+        if res is False:
+            logger.error(f"Unable to restore record of '{file_info.get('filename')}' after a failed delete, it's messages are left in channel. Error: {err}")
+
+    def _release_file_chunks(self, file_info: dict | None):
+        """Deletes chunks only a deleted record used. Done once it's messages are gone, a failed delete puts the record back with it's chunk references intact."""
+        if not file_info or not file_info.get("chunked"):
+            return
+        with self._schema_lock.write():
+            released = self._release_chunks([file_info])
+        self._delete_chunk_messages(released)
+
+    def _apply_delete_file(self, full_path: str, message_id: int):
+        """Pops record with `message_id` at `full_path` from schema, Used both for deletes and journal replay."""
+        file_info = {"message_id": int(message_id)}
+        path_key = self._ops.get_path_key(full_path)
+        for record, record_path in self._ops.lookup_message_id(message_id):
+            if record_path == path_key:
+                file_info = record
+                break
+        modified_schema, err = self._ops.manipulate_schema(full_path, {"message_id": int(message_id)}, self._schema.copy(), delete=True)
+        if modified_schema is False:
+            return False, err
+        self._schema = modified_schema.copy()
+        self._ops.unindex_file(file_info, full_path)
+        return True, None
+
     def move_folder(self, folder_to_move: str, target_folder: str, new_name_for_moved_folder: str=None):
+        with self._schema_lock.write():
+            folder_name = new_name_for_moved_folder     # Use name specified by user, if any.
+            if folder_name is None:
+                folder_name, _, err = self._ops.get_contents_in_directory(folder_to_move, self._schema.copy(), False)  # folder_name is final word of folder_to_move.
+                if folder_name in [False, None]:
+                    return False, err
+            res, err = self._apply_move_folder(folder_to_move, target_folder, folder_name)
+            if res is False:
+                return False, err
+            seq = self._journal_change({"op": "move_folder", "path": folder_to_move, "target": target_folder, "name": folder_name})
+        self._commit(seq)
+        return True, ""
+
+    def _apply_move_folder(self, folder_to_move: str, target_folder: str, folder_name: str):
+        """Moves folder at `folder_to_move` into `target_folder` as `folder_name`. Used both for moves and journal replay."""
         # we want to get sub schema starting from folder path. So we can paste it in new path.
-        folder_name, sub_schema, err = self._ops.get_contents_in_directory(folder_to_move, self._schema.copy(), False)  # folder_name - The name of the folder that is being moved, where as folder_to_move is full path to folder. folder_name is final word of folder_to_move.
-        if new_name_for_moved_folder is not None:
-            folder_name = new_name_for_moved_folder     # Use name specified by user.
+        _, sub_schema, err = self._ops.get_contents_in_directory(folder_to_move, self._schema.copy(), False)  # folder_to_move is full path to folder, folder_name is the name it gets in target folder.
         logger.info(f"The folder '{folder_name}' in path {folder_to_move} is requested to be moved to new path '{target_folder}'")
         if sub_schema in [False, None]:  # Schema manipulation functions doesn't return False when crash exited, it will be None.
             return False, err
@@ -197,66 +1235,663 @@ class BotActions:
             return False, err
         logger.info("delete of original path success!")
         self._schema = modified_schema_after_substitution.copy()   # This modified schema is after deleting the specified folder in original schema, moving it to new path.
-        self.save_schema()
+        self._ops.unindex_folder(folder_to_move)
+        target_key, moved_name = self._ops.get_path_key(target_folder), self._ops.get_sanitized_file_path(folder_name)[0][0]   # Same sanitized name that folder was added with.
+        self._ops.index_folder(self._schema, f"{target_key}/{moved_name}" if target_key else moved_name)
         return True, ""
 
     def delete_folder(self, folder_path: str):
-        try:    # Pop folder path from schema, delete files one by one, ignore deletion errors.
-            _, sub_schema, err = self._ops.get_contents_in_directory(folder_path, self._schema.copy(), False)  # we want to get sub schema starting from folder path.
-            if sub_schema is False:
-                return False, err
-            file_list, err = self._ops.get_file_list_in_a_directory(sub_schema)     # get list of files in this sub schema.
-            if file_list is False:
-                return False, err
-            logger.info(f"Received {len(file_list)} files for deletion under path: {str(folder_path)}!!")
-            modified_schema, err = self._ops.manipulate_schema(folder_path, None, self._schema.copy(), delete=True)
-            if modified_schema is False:
-                return False, err
-            for file_info in file_list:
-                logger.info(f"Attempting to delete file: {file_info['filename']}")
-                res = True
-                res, err = self.delete_file(full_path=None, message_id=file_info["message_id"], with_out_schema_change=True)   # As with_out_schema_change is True, full path is ignored and just delete is attempted.
+        """Pops folder (with everything inside it) from schema, returns once that's on disk. Messages of it's files are deleted by a background job (see `_run_delete_job`), deletion errors are ignored.\n
+           Returns a tuple of (success, error). On success, second item is id of deletion job (None if there was nothing to delete), it's progress is in `self.jobs`.
+        """
+        try:
+            with self._schema_lock.write():
+                _, sub_schema, err = self._ops.get_contents_in_directory(folder_path, self._schema.copy(), False)  # we want to get sub schema starting from folder path.
+                if sub_schema is False:
+                    return False, err
+                file_list, err = self._ops.get_file_list_in_a_directory(sub_schema)     # get list of files in this sub schema.
+                if file_list is False:
+                    return False, err
+                res, err = self._apply_delete_folder(folder_path)
                 if res is False:
-                    logger.error(f"Failed to delete file {file_info['filename']} during folder deletion. Ignoring that, proceed to next file anyway.")  # If failed, file may still be in telegram, but won't show up in our schema / UI at-least.  # Bulk delete may cause flood control error.
-            if len(file_list) == 0:
+                    return False, err
+                seq = self._journal_change({"op": "delete_folder", "path": folder_path})
+                shared = [file_info for file_info in file_list if self._is_shared(file_info)]  # Linked from records outside this folder, checked after folder is gone from indexes.
+                released = self._release_chunks(file_list)
+            self._commit(seq)   # Messages are queued only once schema change is durable, a crash never leaves records pointing to deleted messages.
+            logger.info(f"Received {len(file_list)} files for deletion under path: {str(folder_path)}!!")
+            if shared:
+                logger.info(f"{len(shared)} of them share content with files outside this folder, only their records are removed.")
+                file_list = [file_info for file_info in file_list if not any(file_info is other for other in shared)]
+            message_ids = []
+            for file_info in file_list:     # Linked duplicates within this folder share messages, queue drops repeated ids.
+                message_ids.extend(self._take_record_messages(file_info))   # All parts of the file, if it was a multi-part upload.
+            self._invalidate_cached_parts(info["file_id"] for _, info in released)
+            message_ids.extend(info["message_id"] for _, info in released)
+            queue_id = self._deletes.add(f"Folder '{folder_path}'", message_ids)
+            if queue_id is None:
                 logger.debug(f"Received folder deletion request, but there are no files inside specified folder path {folder_path}!!")
-            self._schema = modified_schema.copy()   # This modified schema is after deleting the specified folder in original schema.
-            self.save_schema()
-            return True, ""
+                return True, None
+            job_id, _ = self.jobs.submit("delete_messages", {"queue_id": queue_id}, key=queue_id)
+            logger.info(f"Queued {len(message_ids)} messages of folder '{folder_path}' for deletion, job: {job_id}.")
+            return True, job_id
         except Exception as err:
             return False, err
 
+    def _run_delete_job(self, job: Job, queue_id: str) -> dict:
+        """`delete_messages` job, deletes messages queued in `self._deletes` under `queue_id` in background lane, in batches of up to 100 with telegram's `deleteMessages`. \n
+           Falls back to deleting them one by one (`DELETE_WORKERS` at a time) if batch delete isn't available. Messages that couldn't be deleted for now (Ex: network errors) stay queued, tried again later.
+           Cancelling the job drops messages still pending, they're left in channel.
+        """
+        counts = self._deletes.get_counts(queue_id)
+        if counts is None:
+            return None
+        job.set_total(items=counts["total"])
+        job.set_done(items=counts["deleted"] + counts["failed"])
+        try:
+            while True:
+                job.checkpoint()
+                message_ids = self._deletes.next_batch(queue_id, DELETE_BATCH_SIZE)
+                if not message_ids:
+                    break
+                with self._api.lane(BACKGROUND):
+                    deleted, failed = self._delete_message_batch(message_ids)
+                if deleted or failed:
+                    self._deletes.mark(queue_id, deleted, failed)
+                    job.advance(len(deleted) + len(failed))
+                else:
+                    job.sleep(30)   # Telegram is unreachable, no point in trying again right away.
+        except JobCancelled:
+            logger.warning(f"Deletion job {job.id} cancelled, {self._deletes.discard(queue_id)} messages are left in channel.")
+            raise
+        return self._deletes.get_counts(queue_id)
+
+    def _delete_message_batch(self, message_ids: list[int]) -> tuple[list[int], list[int]]:
+        """Deletes given messages, returns a tuple of (deleted, failed) message ids. Messages already missing in telegram are counted as deleted, ones in neither list can be tried again."""
+        if self._batch_delete_supported:
+            try:
+                self._api.call(delete_messages, self.__bot, chat_id=self._channel_id, message_ids=message_ids, timeout=60)
+                return message_ids, []
+            except telegram_error.InvalidToken:     # 404, Bot API server (Ex: an older local one) doesn't have `deleteMessages`.
+                logger.warning("Batch delete is not available, deleting messages one by one.")
+                self._batch_delete_supported = False
+            except telegram_error.BadRequest as err:
+                if "not found" in str(err).lower():   # None of them were there to delete.
+                    return message_ids, []
+                logger.warning(f"Batch delete of {len(message_ids)} messages failed, deleting them one by one. Error: {err}")
+            except telegram_error.TelegramError as err:
+                logger.warning(f"Unable to delete {len(message_ids)} messages, will be tried again. Error: {err}")
+                return [], []
+        lane = self._api.current_lane()
+        def delete_one(message_id: int) -> bool | None:
+            with self._api.lane(lane):
+                try:
+                    self._api.call(self.__bot.delete_message, chat_id=self._channel_id, message_id=message_id)
+                    return True
+                except telegram_error.BadRequest as err:
+                    if "Message to delete not found" in str(err):
+                        return True
+                    logger.error(f"Unable to delete message with ID {message_id}, Error: {err}")
+                    return False
+                except telegram_error.TelegramError as err:
+                    logger.warning(f"Unable to delete message with ID {message_id} for now, will be tried again. Error: {err}")
+                    return None
+        with ThreadPoolExecutor(max_workers=max(self._delete_workers, 1), thread_name_prefix="delete") as pool:
+            outcomes = list(pool.map(delete_one, message_ids))
+        return [message_id for message_id, outcome in zip(message_ids, outcomes) if outcome is True], [message_id for message_id, outcome in zip(message_ids, outcomes) if outcome is False]
+
+    def _apply_delete_folder(self, folder_path: str):
+        """Pops folder at `folder_path` (with everything inside it) from schema. Used both for folder deletes and journal replay."""
+        modified_schema, err = self._ops.manipulate_schema(folder_path, None, self._schema.copy(), delete=True)
+        if modified_schema in [False, None]:
+            return False, err
+        self._schema = modified_schema.copy()   # This modified schema is after deleting the specified folder in original schema.
+        self._ops.unindex_folder(folder_path)
+        return True, ""
+
+    def _resolve_file(self, file_id: str, is_encrypted: bool=None):
+        """Reads schema record of `file_id` (if any), returns a tuple of (parts, is_encrypted, file_name, enc_format). A normal file is a multi-part file with single part. Plain `size` of each part is included if known.\n
+           file_name is None if record is not found. is_encrypted is None if it is not known (not specified, record not found), enc_format is None if it is not known.
+        """
+        file_name = None
+        enc_format = None
+        parts = [{"file_id": file_id}]
+        file_record = [record for record, _ in self._ops.lookup_file_id(file_id)]  # find the file record from schema for this file_id. From that we can know if file was initially encrypted or not.
+        if len(file_record) > 0:
+            if len({record.get("message_id") for record in file_record}) > 1:   # Linked duplicates share messages (same file_id), that is expected.
+                logger.warning(f"Multiple file records are found on a single `file_id`, Schema may have been tampered manually, resulting in duplicated file records!!")
+            file_record = file_record[0]    # If search by file_id returned multiple records, pick first one. Happens only if schema is manually tampered.
+            file_name = file_record.get("filename")  # use filename from schema if available.
+            parts = file_record.get("parts", [{"file_id": file_id, "size": file_record["total_size"]}] if "total_size" in file_record else parts)
+            if "compression" in file_record and "parts" not in file_record:     # Single message, codec is in record itself.
+                parts = [{**parts[0], "compression": file_record["compression"]}]
+            enc_format = file_record.get("enc_format", ENC_FORMAT_FERNET)
+            if is_encrypted is None:    # Arg not specified, read from schema.
+                is_encrypted = file_record.get("is_encrypted", False)   # is_encrypted is set during file upload based on if user decided to use encryption or not. If flag is not set in record, assume that a file is not encrypted by default.(Backward compatibility)
+        elif is_encrypted is None:   # if file record itself is not found. Decrypted only if data turns out to be an encrypted envelope.
+            logger.debug(f"No records was found in schema for file_id: '{file_id}'. Sending file without decryption, unless it is an encrypted envelope!")
+        return parts, is_encrypted, file_name, enc_format
+
+    def _resolve_file_locked(self, file_id: str, is_encrypted: bool=None):
+        """`_resolve_file` under schema read lock. Taking it applies what other processes journaled first, So a file uploaded by another worker is known here too."""
+        with self._schema_lock.read():
+            return self._resolve_file(file_id, is_encrypted)
+
+    def _iter_remote_file(self, file_pointer, buffer_size: int):
+        """Yields content of a file in telegram, `buffer_size` bytes at a time, as it arrives. Nothing is saved locally."""
+        if path.isfile(file_pointer.file_path):    # Bot API server running in local mode gives a local file path.
+            with open(file_pointer.file_path, 'rb') as local_file:
+                while chunk := local_file.read(buffer_size):
+                    yield chunk
+            return
+        url = urllib.parse.urlsplit(file_pointer.file_path)
+        url = url._replace(path=urllib.parse.quote(url.path)).geturl()   # Convert any UTF-8 char in file path into a url encoded ASCII string.
+        with urllib.request.urlopen(url, timeout=60) as response:
+            while chunk := response.read(buffer_size):
+                yield chunk
+
+    def _get_file_pointer(self, file_id: str, refresh: bool = False):
+        """getFile result for `file_id` (it's `file_path` is the download link), cached for a while. So a hot file is served without a getFile call every time. `refresh=True` gets a new one (Ex: link has expired)."""
+        if refresh:
+            self._metadata.invalidate("file_pointer", file_id)
+        return self._metadata.get("file_pointer", file_id, lambda: self._api.call(self.__bot.get_file, file_id, timeout=60))
+
+    def _iter_part_content(self, file_id: str, buffer_size: int, file_pointer=None):
+        """Yields content of a single part as stored in telegram, from download cache if it's there. Else it's fetched (sharing the fetch with concurrent requests for same part) and cached."""
+        def fetch():
+            try:
+                chunks = self._iter_remote_file(file_pointer or self._get_file_pointer(file_id), buffer_size)
+                first_chunk = next(chunks, b"")
+            except urllib.error.HTTPError as err:
+                if err.code != 404:
+                    raise
+                logger.info(f"Download link of part '{file_id}' has expired, getting a new one.")   # Cached link outlived telegram's, Only happens before any content is sent.
+                chunks = self._iter_remote_file(self._get_file_pointer(file_id, refresh=True), buffer_size)
+                first_chunk = next(chunks, b"")
+            yield first_chunk
+            yield from chunks
+        return self._disk_cache.iter_cached(file_id, fetch, buffer_size)
+
+    def _invalidate_cached_parts(self, file_ids):
+        """Drops parts from download / range caches (Ex: their messages are deleted)."""
+        for file_id in file_ids:
+            self._part_cache.invalidate(file_id)
+            self._disk_cache.invalidate(file_id)
+            self._metadata.invalidate("file_pointer", file_id)
+
+    def get_cache_stats(self) -> dict:
+        """Counters of download cache (hits, misses, coalesced fetches, evictions, invalidations, usage) and metadata cache (hits, stale hits, misses, background refreshes, load errors)."""
+        return {"downloads": self._disk_cache.get_stats(), "metadata": self._metadata.get_stats()}
+
+    def _iter_parts(self, parts: list[dict], is_encrypted: bool, enc_format: str, buffer_size: int, first_file_pointer=None):
+        """Yields content of all parts in order, decrypted if `is_encrypted`. Only one part is fetched at a time. If `is_encrypted` is None, decrypts only if part is an encrypted envelope."""
+        file_pointer = first_file_pointer
+        try:
+            for part in parts:
+                chunks, is_encrypted, enc_format = self._decode_part(self._iter_part_content(part["file_id"], buffer_size, file_pointer), part, is_encrypted, enc_format, buffer_size)
+                yield from chunks
+                file_pointer = None
+        except Exception as e:
+            logger.error(f"Error streaming the file: {e}")
+            raise   # Download is cut short, instead of looking like a complete download to the user.
+
+    def _decode_part(self, chunks, part: dict, is_encrypted: bool, enc_format: str, buffer_size: int):
+        """Wraps content `chunks` of a part (as stored in telegram) into a stream of it's plain content, decrypted / decompressed as it's read. If `is_encrypted` is None, decrypts only if part is an encrypted envelope.
+
+           Returns a tuple of (plain chunks, is_encrypted, enc_format), latter two as found out for this part.
+        """
+        chunks = iter(chunks)
+        if is_encrypted is None:
+            first_chunk = next(chunks, b"")
+            is_encrypted, enc_format = EncDecHelper.is_envelope(first_chunk), ENC_FORMAT_ENVELOPE
+            chunks = itertools.chain([first_chunk], chunks)
+        if is_encrypted:
+            logger.debug(f"Attempting to decrypt the file with ID '{part['file_id']}'!")
+            chunks = self.__file_ops.get_decrypted_stream(chunks, enc_format)
+        if part.get("compression"):     # Compressed before encryption, decompressed as it's decrypted.
+            chunks = iter_decompressed(chunks, part["compression"], buffer_size)
+        return chunks, is_encrypted, enc_format
+
+    def _get_part_content(self, file_id: str) -> bytes:
+        """Whole (encrypted) content of a single part, as stored in telegram. Served from cache if it was fetched recently."""
+        content = self._part_cache.get(file_id)
+        if content is None:
+            logger.debug(f"Reading part '{file_id}' from download cache / telegram for a range request.")
+            content = b"".join(self._iter_part_content(file_id, self._download_buffer_size))
+            self._part_cache.put(file_id, content)
+        return content
+
+    def _iter_part_range(self, part: dict, start: int, end: int, is_encrypted: bool, enc_format: str):
+        """Yields plain bytes [start, end) of a single part. For an encrypted envelope, only segments covering the range are decrypted."""
+        content = self._get_part_content(part["file_id"])
+        if part.get("compression"):     # Compressed stream can't be entered midway, decompressed from start (as a stream) till `end`.
+            position = 0
+            plain_chunks = self.__file_ops.get_decrypted_stream([content], enc_format) if is_encrypted else [content]
+            for plain in iter_decompressed(plain_chunks, part["compression"], self._download_buffer_size):
+                if position + len(plain) > start:
+                    yield plain[max(start - position, 0):end - position]
+                position += len(plain)
+                if position >= end:
+                    break
+        elif not is_encrypted:
+            yield content[start:end]
+        elif enc_format == ENC_FORMAT_ENVELOPE:
+            first_segment, last_segment = start // SEGMENT_SIZE, (end - 1) // SEGMENT_SIZE
+            segment_count = EncDecHelper.get_segment_count(part["size"])
+            header_size = EncDecHelper.get_header_size(content)   # Parts uploaded before v2 envelopes have a shorter header.
+            segments = memoryview(content)[EncDecHelper.get_segment_offset(first_segment, header_size=header_size):EncDecHelper.get_segment_offset(last_segment + 1, header_size=header_size)]
+            skip, remaining = start - first_segment * SEGMENT_SIZE, end - start
+            for plain in self.__file_ops.get_decrypted_segments(content[:header_size], [segments], first_segment, segment_count):
+                plain = plain[skip:skip + remaining]
+                skip, remaining = 0, remaining - len(plain)
+                yield plain
+        else:   # Fernet token can only be decrypted as a whole.
+            yield self.__file_ops.get_decrypted_data_binary(content)[start:end]
+
+    def _iter_range(self, parts: list[dict], is_encrypted: bool, enc_format: str, start: int, end: int):
+        """Yields plain bytes [start, end) of a file, touching only the parts that overlap with the range."""
+        try:
+            part_start = 0
+            for part in parts:
+                part_end = part_start + part["size"]
+                if part_start < end and start < part_end:
+                    yield from self._iter_part_range(part, max(start, part_start) - part_start, min(end, part_end) - part_start, is_encrypted, enc_format)
+                part_start = part_end
+        except Exception as e:
+            logger.error(f"Error streaming the file range: {e}")
+            raise
+
+    def get_download_info(self, file_id: str):
+        """Returns a tuple of (info, error). info is a dict with `file_name`, `total_size` (size of the file after decryption) and an `etag` for the file.\n
+           `total_size` is None if it can't be known without downloading the file (files encrypted in old Fernet format), range requests are not possible for such files.
+        """
+        try:
+            parts, is_encrypted, file_name, enc_format = self._resolve_file_locked(file_id)
+            total_size = sum(part["size"] for part in parts) if all("size" in part for part in parts) else None
+            if total_size is None and is_encrypted is False:   # Older un-encrypted records, size in telegram is the file size.
+                total_size = self._get_file_pointer(file_id).file_size
+            return {"file_name": file_name or file_id, "total_size": total_size, "etag": file_id}, None     # file_id always points to the same content, serves as a strong ETag.
+        except Exception as e:
+            logger.error(f"Error getting download info of the file: {e}")
+            return False, e
+
+    def download_schema_backup(self, file_id: str):
+        """Content of a schema backup uploaded with `upload_file(update_schema=False)`, returns a tuple of (content, error). A schema too big for one message has a manifest of it's parts behind `file_id`, they're joined here."""
+        content, err = self.download_file(file_id, is_encrypted=None)
+        if content is False or not content.startswith(b'{"' + PARTS_MANIFEST_KEY.encode('utf8') + b'"'):
+            return content, err
+        try:
+            manifest = json.loads(content)
+            return b"".join(self._iter_parts(manifest[PARTS_MANIFEST_KEY], manifest["is_encrypted"], manifest["enc_format"], self._download_buffer_size)), None
+        except Exception as e:
+            return False, f"Unable to download parts of schema backup: {e}"
+
+    def stream_file(self, file_id: str, is_encrypted: bool=None, buffer_size: int=None, byte_range: tuple[int, int]=None):
+        """Same as `download_file`, but returns a generator that yields file content as it comes from telegram, instead of the whole file in memory. \n
+           Returns a tuple of (generator, file_name), or (False, error). Memory used is bounded by `buffer_size` (`DOWNLOAD_BUFFER_SIZE` from env by default), except for files encrypted in old Fernet format, which are buffered one part at a time.\n
+           If `byte_range` (start, end) is given, only plain bytes [start, end) of the file are sent (Needs `total_size` in record, see `get_download_info`). Parts fetched for a range are cached, so successive ranges don't fetch them from telegram again.
+        """
+        try:
+            parts, is_encrypted, file_name, enc_format = self._resolve_file_locked(file_id, is_encrypted)
+            if byte_range is not None:
+                if not all("size" in part for part in parts):
+                    file_info, err = self.get_download_info(file_id)
+                    if file_info is False or file_info["total_size"] is None:
+                        return False, f"Range requests are not supported for this file! {err or ''}"
+                    parts = [{"file_id": file_id, "size": file_info["total_size"]}]   # Single part, part size is the file size.
+                return self._iter_range(parts, is_encrypted, enc_format, *byte_range), file_name or file_id
+            file_pointer = None
+            if not self._disk_cache.contains(parts[0]["file_id"]):
+                file_pointer = self._get_file_pointer(parts[0]["file_id"])    # Fetched right away, so that a missing file is reported before any content is sent.
+            if file_name is None:
+                file_name = file_pointer.file_path.split('/')[-1] if file_pointer else file_id  # fetch file name from response. Mostly this is wrong name.
+            logger.debug(f"Attempting to stream file with ID '{file_id}' to user!!")
+            return self._iter_parts(parts, is_encrypted, enc_format, buffer_size or self._download_buffer_size, file_pointer), file_name
+        except Exception as e:
+            logger.error(f"Error downloading the file: {e}")
+            return False, e
+
     def download_file(self, file_id: str, is_encrypted: bool=None):   # Specify if file has to be decrypted before returning. Taken for granted if supplied, else will read schema to determine if a file was encrypted during upload. [Option for users using CLI.]
-        """Fetch file from telegram using `file_id`, return the file as binary (with / without decrypting). \n
+        """Fetch file from telegram using `file_id`, return the file as binary (with / without decrypting). Parts of a multi-part file are fetched, joined in order. \n
            `is_encrypted` is optional, if supplied, decrypts the file before returning (Doesn't matter if the file was encrypted during upload or not ;)\n
-           if `is_encrypted` argument is not specified, checks the file record from schema to see if `is_encrypted` flag is set, act accordingly. If that was also not set, send without decryption.
+           if `is_encrypted` argument is not specified, checks the file record from schema to see if `is_encrypted` flag is set, act accordingly. If that was also not set, send without decryption.\n
+           Whole file is held in memory, use `stream_file` for big files.
         """
+        stream, file_name = self.stream_file(file_id, is_encrypted)
+        if stream is False:
+            return False, file_name     # file_name is the error here.
         try:
-            file_pointer = self.__bot.get_file(file_id, timeout=60)
-            file_content: bytes = file_pointer.download_as_bytearray()    # All the file data is in ram, not on local file storage.
-            file_name = file_pointer.file_path.split('/')[-1]   # fetch file name from response. Mostly this is wrong name. Fetch from schema if that's an option.
-            if is_encrypted is None:    # Arg not specified, try to read from schema.
-                logger.debug(f"`is_encrypted` was not specified for a file download operation! Determining from schema.")
-                file_record = self._ops.find_record_by_attribute(self._schema.copy(), "file_id", file_id)  # find the file record from schema for this file_id. From that we can know if file was initially encrypted or not.
-                if file_record is not None and len(file_record) > 0:
-                    file_record = file_record[0]    # If search by file_id returned multiple records, pick first one. Happens only if schema is manually tampered.
-                    is_encrypted = file_record.get("is_encrypted", False)   # is_encrypted is set during file upload based on if user decided to use encryption or not. If flag is not set in record, assume that a file is not encrypted by default.(Backward compatibility)
-                    file_name = file_record.get("filename", file_name)  # use filename from schema if available.
-                else:   # if file record itself is not found. Assume no encryption.
-                    logger.debug(f"No records was found in schema for file_id: '{file_id}'. Sending file without decryption!")
-                    is_encrypted = False
-            if is_encrypted:
-                logger.debug(f"Attempting to decrypt the file with ID '{file_id}'!")
-                file_content = self.__file_ops.get_decrypted_data_binary(file_content)  # decrypt before sending binary.
-            logger.debug(f"Attempting to send file with ID '{file_id}' to user!!")
-            return file_content, file_name
+            return b"".join(stream), file_name
         except Exception as e:
-            logger.error(f"Error downloading the file: {e}")
             return False, e
 
 
+class AsyncBotActions(BotActions):
+    """Experimental async API, not used by web app / backupper yet. `BotActions` for asyncio callers: uploads, downloads, deletes and getFile are coroutines on one pooled HTTP client (keep-alive, HTTP/2 where available, see `AsyncBotApi`).\n
+       A transfer waiting on telegram holds no thread, So many files move at once with a handful of connections. At most `ASYNC_TRANSFERS` parts are sent / fetched at a time.
+       Schema, journal, encryption, compression and rate limits are the same as `BotActions` (it's sync methods still work), Only telegram calls are made differently.
+       Blocking work (reading files, encryption, schema writes) is run in threads, So event loop is never held up by it. Call `close()` once done, in same event loop.
+       Uploads don't go through chunk store, big files are always uploaded in parts. `validate` awaits the same background job as sync callers.
+    """
+    def __init__(self, schema_filepath=None, encrypted: bool=True) -> None:
+        super().__init__(schema_filepath, encrypted)
+        self._aio = AsyncBotApi(str(env["API_KEY"]), base_url=env.get("TELEGRAM_API_URL", "https://api.telegram.org/bot"), base_file_url=env.get("TELEGRAM_FILE_URL", "https://api.telegram.org/file/bot"),
+                                max_connections=int(env.get("ASYNC_MAX_CONNECTIONS", 32)))
+        self._transfers = asyncio.Semaphore(int(env.get("ASYNC_TRANSFERS", 16)))  # Parts being sent / fetched at once, across all calls. Also bounds prepared parts held in spooled files.
+
+    async def close(self):
+        await self._aio.close()
+
+    async def _call(self, method, *args, priority: int = INTERACTIVE, retry_timeouts: bool = True, **kwargs):
+        """Calls an `AsyncBotApi` method through rate limiter / retries shared with sync calls."""
+        return await self._api.call_async(method, *args, priority=priority, retry_timeouts=retry_timeouts, **kwargs)
+
+    async def get_file(self, file_id: str, refresh: bool = False) -> File:
+        """getFile result for `file_id` (it's `file_path` is the download link), from same metadata cache as sync `_get_file_pointer`. `refresh=True` gets a new one (Ex: link has expired)."""
+        if refresh:
+            self._metadata.invalidate("file_pointer", file_id)
+        return await self._metadata.get_async("file_pointer", file_id, lambda: self._load_file_pointer(file_id))
+
+    async def _load_file_pointer(self, file_id: str) -> File:
+        file_info = await self._call(self._aio.get_file, file_id, timeout=60)
+        return File(file_id=file_info["file_id"], file_unique_id=file_info["file_unique_id"], file_size=file_info.get("file_size"),
+                    file_path=self._aio.get_file_url(file_info["file_path"]))     # Same as sync Bot's, So either can use what the other cached.
+
+    async def upload(self, file, file_name: str, directory: str = ""):
+        """Uploads the given file (file like object / bytes) to channel and adds it to schema at `directory`, same as `upload_file`. Returns a tuple of (success, file_id or error)."""
+        res, err = self._ops.get_sanitized_file_path(directory)  # sanity check
+        if res is False:
+            return False, err
+        file_info, err = await self.upload_record_async(file, file_name)
+        if file_info is False:
+            return False, err
+        res, err = await asyncio.to_thread(self.add_file_record, file_info, directory)
+        if res is False:
+            return False, err
+        return True, file_info["file_id"]
+
+    async def upload_record_async(self, file, file_name: str):
+        """`upload_record` for asyncio, returns a tuple of (schema record, error). Parts are prepared in a thread one after another, and sent as they're ready, up to `ASYNC_TRANSFERS` at a time.\n
+           If any part fails, already uploaded parts are deleted.
+        """
+        try:
+            file_name = sanitize_filename(file_name)
+            if isinstance(file, (bytes, bytearray)):
+                file = io.BytesIO(file)
+            digest = hashlib.sha256()
+            blocks = self._read_blocks(file, digest)
+            first_block = await asyncio.to_thread(next, blocks, b"")
+            codec = await asyncio.to_thread(self._choose_compression, file_name, first_block)
+            parts = self._iter_spooled_parts(itertools.chain([first_block], blocks), codec)
+            sends, error, is_single = [], None, False
+            try:
+                while True:
+                    await self._transfers.acquire()     # Released once part is sent.
+                    if any(send.done() and send.exception() is not None for send, _ in sends):
+                        self._transfers.release()
+                        break   # No point in preparing further parts, upload has failed.
+                    try:
+                        item = await asyncio.to_thread(next, parts, None)
+                    except BaseException:
+                        self._transfers.release()
+                        raise
+                    if item is None:
+                        self._transfers.release()
+                        break
+                    payload, is_last, plain_size = item
+                    is_single = is_last and not sends   # Fits in a single message, record is saved as it always was.
+                    sends.append((asyncio.ensure_future(self._send_payload(payload, file_name if is_single else f"{file_name}.part{len(sends):04d}")), plain_size))
+                    if is_last:
+                        break
+            except Exception as err:
+                error = err
+            results = await asyncio.gather(*(send for send, _ in sends), return_exceptions=True)
+            sent = [(message, plain_size) for message, (_, plain_size) in zip(results, sends) if not isinstance(message, BaseException)]
+            error = error or next((result for result in results if isinstance(result, BaseException)), None)
+            if error is not None:
+                logger.error(f"Upload of '{file_name}' failed, cleaning up the {len(sent)} parts that were uploaded.")
+                await self._delete_messages([message["message_id"] for message, _ in sent])
+                raise error
+            if is_single:
+                message, plain_size = sent[0]
+                file_info = self._make_record(file_name, message["message_id"], message["document"]["file_id"], message["document"]["file_size"], plain_size, codec)
+            else:
+                logger.info(f"File '{file_name}' is bigger than {self._part_size} bytes{' (compressed)' if codec else ''}, uploaded it in parts!")
+                file_info = self._make_parts_record(file_name, [self._make_part_entry(message["message_id"], message["document"]["file_id"], plain_size, codec) for message, plain_size in sent])
+            return self._finish_record(file_info, digest.hexdigest()), None
+        except Exception as e:
+            logger.error(f"Error uploading file: {e}")
+            return False, str(e)
+
+    async def _send_payload(self, payload, file_name: str) -> dict:
+        """Sends a prepared payload file (see `_iter_spooled_parts`), it's closed and a transfer slot is released once it's sent. Returns the message."""
+        try:
+            with payload:
+                payload.seek(0)
+                # A send that timed out may still have been delivered, it is not retried (that would leave a duplicate message behind).
+                return await self._call(self._aio.send_document, chat_id=self._channel_id, document=payload, filename=file_name, caption=file_name, timeout=60, retry_timeouts=False)
+        finally:
+            self._transfers.release()
+
+    async def download(self, file_id: str, is_encrypted: bool=None, buffer_size: int=None):
+        """Async generator, yields content of a file (all parts in order, decrypted / decompressed), same as `stream_file` does. While a part is decoded, next one is fetched.\n
+           A part is fetched into a spooled temp file (from download cache if it's there), So a file is never held in memory.
+        """
+        buffer_size = buffer_size or self._download_buffer_size
+        parts, is_encrypted, _, enc_format = await asyncio.to_thread(self._resolve_file_locked, file_id, is_encrypted)
+        fetch = asyncio.ensure_future(self._fetch_part(parts[0]["file_id"], buffer_size))
+        try:
+            for index, part in enumerate(parts):
+                content = await fetch
+                fetch = asyncio.ensure_future(self._fetch_part(parts[index + 1]["file_id"], buffer_size)) if index + 1 < len(parts) else None
+                with content:
+                    chunks, is_encrypted, enc_format = await asyncio.to_thread(self._decode_part, iter(lambda: content.read(buffer_size), b""), part, is_encrypted, enc_format, buffer_size)
+                    while (piece := await asyncio.to_thread(next, chunks, None)) is not None:
+                        yield piece
+        except Exception as e:
+            logger.error(f"Error streaming the file: {e}")
+            raise   # Download is cut short, instead of looking like a complete download to the user.
+        finally:
+            if fetch is not None:   # Given up midway, prefetched part isn't needed.
+                fetch.cancel()
+                fetch.add_done_callback(lambda done: done.cancelled() or done.exception() is not None or done.result().close())
+
+    async def _fetch_part(self, file_id: str, buffer_size: int):
+        """Content of a part as stored in telegram, in a spooled temp file (position at start). Caller closes it."""
+        content = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE)
+        try:
+            if self._disk_cache.contains(file_id):
+                await asyncio.to_thread(lambda: [content.write(chunk) for chunk in self._iter_part_content(file_id, buffer_size)])
+            else:
+                async with self._transfers:
+                    try:
+                        async for chunk in self._aio.iter_file((await self.get_file(file_id)).file_path, buffer_size):
+                            content.write(chunk)
+                    except FileLinkExpired:
+                        logger.info(f"Download link of part '{file_id}' has expired, getting a new one.")   # Cached link outlived telegram's, Nothing is written yet.
+                        async for chunk in self._aio.iter_file((await self.get_file(file_id, refresh=True)).file_path, buffer_size):
+                            content.write(chunk)
+            content.seek(0)
+            return content
+        except BaseException:
+            content.close()
+            raise
+
+    async def delete(self, full_path: str, message_id: int):
+        """Deletes a file's messages (all parts at once) and it's record from schema, same as `delete_file`. Returns a tuple of (success, error)."""
+        try:
+            file_info, shared, err = await asyncio.to_thread(self._take_file_record, full_path, message_id)
+            if err is not None:
+                return False, err
+            if not shared:  # Messages of a linked duplicate are left alone, other records still point to them.
+                message_ids = self._take_record_messages(file_info or {"message_id": int(message_id)})
+                errors = [f"Message ID {part_id}: {err}" for part_id, err in zip(message_ids, await self._delete_messages(message_ids)) if err is not None]
+                if errors:
+                    logger.error(f"Error deleting file with Message_ID: {message_id}, Error: {errors}")
+                    await asyncio.to_thread(self._restore_file_record, full_path, file_info)
+                    return False, "; ".join(errors)
+            await asyncio.to_thread(self._release_file_chunks, file_info)
+            return True, None
+        except Exception as e:
+            logger.error(f"Error deleting file: {e}")
+            return False, e
+
+    async def _delete_messages(self, message_ids: list[int]) -> list:
+        """Deletes messages concurrently, returns error (or None) per message. Messages already missing in telegram are treated as deleted."""
+        async def delete_one(message_id: int):
+            try:
+                await self._call(self._aio.delete_message, chat_id=self._channel_id, message_id=message_id)
+            except telegram_error.TelegramError as err:
+                if "Message to delete not found" not in str(err):
+                    return err
+            return None
+        return list(await asyncio.gather(*(delete_one(message_id) for message_id in message_ids)))
+
+    async def validate(self, directory: str = "", since: float = None):
+        """Runs `validate` job (same job key as `/validate/` route, So only one validation runs at a time across processes) and waits for it without blocking event loop.\n
+           Validation itself is `validate_job`'s: checkpoints, request budget, and a snapshot other processes reload. Returns a tuple of (success, error).
+        """
+        job_id, is_new = self.jobs.submit("validate", {"directory": directory, "since": since, "restart": False}, key="validate")
+        if not is_new:
+            logger.info("A validation job is already in progress, not starting another one.")
+            return False, "A validation job is already in progress."
+        while (job := self.jobs.get(job_id)) is not None and job["status"] in ACTIVE_STATUSES:
+            await asyncio.sleep(0.5)
+        if job is None or job["status"] != "completed":
+            return False, job["error"] if job is not None and job["error"] else f"Validation job {job_id} didn't complete."
+        return True, None
+
+
 class SchemaManipulations:
-    """Offload schema manipulations from other classes, provide methods for easy schema manipulation"""
+    """Offload schema manipulations from other classes, provide methods for easy schema manipulation.\n
+       Also keeps in-memory hash indexes over the schema: file_id -> records, message_id -> records, sha256 of content -> records (each as a tuple of (record, folder_path)), folder_path -> folder node.
+       Number of references to each chunk (from `parts` of chunked records) is counted as well, a chunk nothing refers to can be deleted.
+       Indexes are built once with `build_indexes`, callers keep them updated with `index_file`, `unindex_file`, `index_folder`, `unindex_folder` as they change the schema.
+    """
+    def __init__(self) -> None:
+        self._by_file_id: dict[str, list[tuple[dict, str]]] = {}
+        self._by_message_id: dict[int, list[tuple[dict, str]]] = {}
+        self._by_sha256: dict[str, list[tuple[dict, str]]] = {}
+        self._chunk_refs: dict[str, int] = {}   # Chunk key -> number of record parts pointing to it.
+        self._folders: dict[str, dict] = {}     # Folder path (Ex: "bkp/photos") -> folder node in schema. Root folder is not indexed, as it is the schema itself.
+        self.search_index = SearchIndex()   # File names, folder paths for `/search`, kept updated along with above indexes.
+
+    def get_path_key(self, full_path: str) -> str | bool:
+        """Normalized folder path used as key in indexes, Ex: "/bkp/photos/" -> "bkp/photos". Root is "". False if path is invalid."""
+        sanitized_path, _ = self.get_sanitized_file_path(full_path or "")
+        if sanitized_path is False:
+            return False
+        return "/".join(sanitized_path)
+
+    def build_indexes(self, schema: dict):
+        """(Re)builds all indexes from scratch by walking whole schema once."""
+        self._by_file_id, self._by_message_id, self._by_sha256, self._chunk_refs, self._folders = {}, {}, {}, {}, {}
+        self.search_index.clear()
+        self._index_node("", schema)
+
+    def _index_node(self, path_key: str, node: dict):
+        for key, value in node.items():
+            if key == "root" and isinstance(value, list):
+                for record in value:
+                    self._add_entry(record, path_key)
+            elif key != "meta" and isinstance(value, dict):
+                child_key = f"{path_key}/{key}" if path_key else key
+                self._folders[child_key] = value
+                self.search_index.add_folder(child_key)
+                self._index_node(child_key, value)
+
+    def _add_entry(self, record: dict, path_key: str):
+        self.search_index.add_file(record, path_key)
+        if "file_id" in record:
+            self._by_file_id.setdefault(record["file_id"], []).append((record, path_key))
+        if "message_id" in record:
+            self._by_message_id.setdefault(int(record["message_id"]), []).append((record, path_key))
+        if "sha256" in record:
+            self._by_sha256.setdefault(record["sha256"], []).append((record, path_key))
+        for part in record.get("parts", []) if record.get("chunked") else []:
+            self._chunk_refs[part["chunk"]] = self._chunk_refs.get(part["chunk"], 0) + 1
+
+    def _remove_entry(self, record: dict, path_key: str):
+        self.search_index.remove_file(record)
+        if any(entry[0] is record and entry[1] == path_key for entry in self._by_message_id.get(int(record.get("message_id", -1)), [])):   # Chunks are counted once per indexed record.
+            for part in record.get("parts", []) if record.get("chunked") else []:
+                count = self._chunk_refs.get(part["chunk"], 0) - 1
+                if count > 0:
+                    self._chunk_refs[part["chunk"]] = count
+                else:
+                    self._chunk_refs.pop(part["chunk"], None)
+        for index, key in ((self._by_file_id, record.get("file_id")), (self._by_message_id, record.get("message_id")), (self._by_sha256, record.get("sha256"))):
+            if key is None:
+                continue
+            key = int(key) if index is self._by_message_id else key
+            entries = [entry for entry in index.get(key, []) if not (entry[0] is record and entry[1] == path_key)]
+            if entries:
+                index[key] = entries
+            else:
+                index.pop(key, None)
+
+    def _index_folder_chain(self, schema: dict, path_key: str):
+        """Indexes each folder on the way to `path_key` that is not yet indexed (Schema manipulations create missing folders in a path)."""
+        node = schema
+        prefix = ""
+        for sub_dir in path_key.split("/") if path_key else []:
+            prefix = f"{prefix}/{sub_dir}" if prefix else sub_dir
+            node = node[sub_dir]
+            if prefix not in self._folders:
+                self._folders[prefix] = node
+                self.search_index.add_folder(prefix)
+
+    def index_file(self, schema: dict, record: dict, full_path: str):
+        """Adds a record that was just added to schema under `full_path` to indexes. Any folders created on the way are indexed too."""
+        path_key = self.get_path_key(full_path)
+        self._index_folder_chain(schema, path_key)
+        self._add_entry(record, path_key)
+
+    def unindex_file(self, record: dict, full_path: str):
+        self._remove_entry(record, self.get_path_key(full_path))
+
+    def index_folder(self, schema: dict, full_path: str):
+        """Adds a folder (that was just added / moved in schema to `full_path`) with all it's sub folders and files to indexes. Any folders created on the way are indexed too."""
+        path_key = self.get_path_key(full_path)
+        self._index_folder_chain(schema, path_key)
+        self._index_node(path_key, self._folders[path_key])
+
+    def unindex_folder(self, full_path: str):
+        """Removes a folder, with all it's sub folders and files from indexes."""
+        path_key = self.get_path_key(full_path)
+        node = self._folders.pop(path_key, None)
+        if node is None:
+            return
+        self.search_index.remove_folder(path_key)
+        for key, value in node.items():
+            if key == "root" and isinstance(value, list):
+                for record in value:
+                    self._remove_entry(record, path_key)
+            elif key != "meta" and isinstance(value, dict):
+                self.unindex_folder(f"{path_key}/{key}")
+
+    def lookup_file_id(self, file_id: str) -> list[tuple[dict, str]]:
+        """O(1) lookup of records with given file_id. Returns a list of (record, folder_path)."""
+        return list(self._by_file_id.get(file_id, []))
+
+    def lookup_sha256(self, sha256: str) -> list[tuple[dict, str]]:
+        """O(1) lookup of records whose content has given sha256 (hex). Returns a list of (record, folder_path)."""
+        return list(self._by_sha256.get(sha256, []))
+
+    def get_chunk_refcount(self, chunk_key: str) -> int:
+        """Number of references to a chunk from records in schema."""
+        return self._chunk_refs.get(chunk_key, 0)
+
+    def lookup_message_id(self, message_id: int) -> list[tuple[dict, str]]:
+        """O(1) lookup of records with given message_id. Returns a list of (record, folder_path)."""
+        return list(self._by_message_id.get(int(message_id), []))
+
+    def lookup_folder(self, schema: dict, full_path: str) -> dict | None:
+        """O(1) lookup of folder node at given path, None if there is no such folder."""
+        path_key = self.get_path_key(full_path)
+        if path_key is False:
+            return None
+        return schema if path_key == "" else self._folders.get(path_key)
 
     def get_sanitized_file_path(self, full_path: str) -> list[str]:
         disallowed_dir_names = ["root", "", " ", "meta", "/", "\\"]    # meta, root are reserved keywords for our schema.
@@ -405,10 +2040,26 @@ class SchemaManipulations:
 
 
 class EncDecHelper:
-    """Helper class to provide methods for encrypting and decrypting data from and to binary"""
+    """Helper class to provide methods for encrypting and decrypting data from and to binary.\n
+       Data is encrypted into a versioned binary envelope: A header followed by fixed size segments, each sealed with AES-GCM under its own nonce.
+       So data can be encrypted / decrypted as a stream, any segment can be decrypted on its own, and size overhead is only 16 bytes per segment.
+       Files uploaded before this envelope existed are Fernet tokens, which are still decrypted.
+    """
     def __init__(self, passwd: str) -> None:
         self.__enc_key = self.derive_key_from_password(passwd)
-        self.__cipher = Fernet(self.__enc_key)
+        self.__cipher = Fernet(self.__enc_key)    # Only for decrypting files uploaded with older versions.
+        self.__master_key = base64.urlsafe_b64decode(self.__enc_key)
+        self.__aead_v1 = AESGCM(self._derive_envelope_key(self.__master_key, None, b"telegram-cloud segmented envelope v1"))   # Only for decrypting v1 envelopes.
+
+    @staticmethod
+    def _derive_envelope_key(master_key: bytes, salt: bytes | None, info: bytes) -> bytes:
+        return HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=info, backend=default_backend()).derive(master_key)
+
+    def _get_envelope_aead(self, version: int, salt: bytes = None) -> AESGCM:
+        """AES-GCM of an envelope: v2 envelopes have a key of their own (from random salt in header), v1 ones share a single key."""
+        if version == 1:
+            return self.__aead_v1
+        return AESGCM(self._derive_envelope_key(self.__master_key, salt, b"telegram-cloud segmented envelope v2"))
 
     def derive_key_from_password(self, password, salt=b"salt", iterations=100000):
         kdf = PBKDF2HMAC(
@@ -421,10 +2072,103 @@ class EncDecHelper:
         key = kdf.derive(password.encode())
         return base64.urlsafe_b64encode(key).decode('utf-8')
 
+    @staticmethod
+    def is_envelope(data: bytes) -> bool:
+        """True if given data (at-least first few bytes of it) is the start of an encrypted envelope."""
+        return bytes(data[:len(ENVELOPE_MAGIC)]) == ENVELOPE_MAGIC and len(data) > len(ENVELOPE_MAGIC) and data[len(ENVELOPE_MAGIC)] in ENVELOPE_HEADERS
+
+    @staticmethod
+    def get_header_size(data: bytes) -> int:
+        """Size of header of the envelope `data` starts with (at-least first 5 bytes of it), it depends on envelope's version."""
+        return ENVELOPE_HEADERS[data[len(ENVELOPE_MAGIC)]].size
+
+    @staticmethod
+    def get_encrypted_size(plain_size: int, segment_size: int = SEGMENT_SIZE) -> int:
+        """Size of the envelope that `plain_size` bytes of data are encrypted into."""
+        return ENVELOPE_HEADER.size + plain_size + EncDecHelper.get_segment_count(plain_size, segment_size) * SEGMENT_TAG_SIZE
+
+    @staticmethod
+    def get_segment_count(plain_size: int, segment_size: int = SEGMENT_SIZE) -> int:
+        return max(1, -(-plain_size // segment_size))    # Empty data is still sealed into one empty segment.
+
+    @staticmethod
+    def get_segment_offset(index: int, segment_size: int = SEGMENT_SIZE, header_size: int = ENVELOPE_HEADER.size) -> int:
+        """Offset of segment number `index` in the envelope (`header_size` from `get_header_size` for an existing one), Segments can be decrypted individually with `get_decrypted_segments`."""
+        return header_size + index * (segment_size + SEGMENT_TAG_SIZE)
+
+    @staticmethod
+    def _iter_segments(chunks, segment_size: int):
+        """Re-slices given byte chunks into segments of `segment_size`, yields (segment, is_last_segment). Empty input gives one empty last segment."""
+        buffer = bytearray()
+        for chunk in chunks:
+            buffer += chunk
+            while len(buffer) > segment_size:    # More than a segment is buffered, so first segment is surely not the last one.
+                yield bytes(buffer[:segment_size]), False
+                del buffer[:segment_size]
+        yield bytes(buffer), True
+
+    @staticmethod
+    def _get_segment_nonce(nonce_prefix: bytes, index: int, is_last: bool) -> bytes:
+        # Last segment is sealed with a different nonce, So a truncated envelope can not pass as complete.
+        return nonce_prefix + struct.pack(">I?", index, is_last)
+
+    def get_encrypted_stream(self, chunks, segment_size: int = SEGMENT_SIZE):
+        """Encrypts given iterable of byte chunks as a stream, yields the envelope: header first, then each sealed segment."""
+        nonce_prefix, salt = os.urandom(NONCE_PREFIX_SIZE), os.urandom(KEY_SALT_SIZE)
+        header = ENVELOPE_HEADER.pack(ENVELOPE_MAGIC, ENVELOPE_VERSION, segment_size, nonce_prefix, salt)
+        aead = self._get_envelope_aead(ENVELOPE_VERSION, salt)
+        yield header
+        for index, (segment, is_last) in enumerate(self._iter_segments(chunks, segment_size)):
+            yield aead.encrypt(self._get_segment_nonce(nonce_prefix, index, is_last), segment, header)    # header is authenticated with every segment.
+
+    def _parse_header(self, header: bytes):
+        """Returns a tuple of (segment size, nonce prefix, AES-GCM of the envelope) from it's header."""
+        if not self.is_envelope(header):
+            raise ValueError("Data is not an encrypted envelope, or it's version is not supported!")
+        _, version, segment_size, nonce_prefix, *salt = ENVELOPE_HEADERS[header[len(ENVELOPE_MAGIC)]].unpack(header)
+        return segment_size, nonce_prefix, self._get_envelope_aead(version, *salt)
+
+    def get_decrypted_segments(self, header: bytes, chunks, first_index: int, segment_count: int):
+        """Random access decryption: Decrypts consecutive segments (as byte chunks) starting at segment number `first_index` of an envelope with given `header`. \n
+           `segment_count` is the total number of segments in the envelope, needed to know which one is the last.
+        """
+        segment_size, nonce_prefix, aead = self._parse_header(header)
+        index = first_index
+        for segment, _ in self._iter_segments(chunks, segment_size + SEGMENT_TAG_SIZE):
+            if segment:
+                yield aead.decrypt(self._get_segment_nonce(nonce_prefix, index, index == segment_count - 1), segment, header)
+                index += 1
+
+    def get_decrypted_stream(self, chunks, enc_format: str = None):
+        """Decrypts given iterable of byte chunks as a stream. `enc_format` is the format marker from schema record, if not known, format is detected from data.\n
+           Fernet tokens can only be decrypted as a whole, so they are buffered.
+        """
+        chunks = iter(chunks)
+        buffer = b""
+        header_size = len(ENVELOPE_MAGIC) + 1   # Until version byte is in, header's size isn't known.
+        while len(buffer) < header_size:
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            buffer += chunk
+            if header_size == len(ENVELOPE_MAGIC) + 1 and self.is_envelope(buffer):
+                header_size = self.get_header_size(buffer)
+        if enc_format == ENC_FORMAT_FERNET or (enc_format is None and not self.is_envelope(buffer)):
+            yield self.get_decrypted_data_binary(buffer + b"".join(chunks))
+            return
+        if not self.is_envelope(buffer) or len(buffer) < header_size:
+            raise ValueError("Encrypted data is truncated, envelope header is incomplete!")
+        header = buffer[:header_size]
+        segment_size, nonce_prefix, aead = self._parse_header(header)
+        for index, (segment, is_last) in enumerate(self._iter_segments(itertools.chain([buffer[header_size:]], chunks), segment_size + SEGMENT_TAG_SIZE)):
+            yield aead.decrypt(self._get_segment_nonce(nonce_prefix, index, is_last), segment, header)
+
     def get_encrypted_data_binary(self, file_binary):
-        return self.__cipher.encrypt(file_binary)
+        return b"".join(self.get_encrypted_stream([file_binary]))
 
     def get_decrypted_data_binary(self, encrypted_file_binary):
         if isinstance(encrypted_file_binary, bytearray):
             encrypted_file_binary = bytes(encrypted_file_binary)
+        if self.is_envelope(encrypted_file_binary):
+            return b"".join(self.get_decrypted_stream([encrypted_file_binary], ENC_FORMAT_ENVELOPE))
         return self.__cipher.decrypt(encrypted_file_binary)
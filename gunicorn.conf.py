@@ -0,0 +1,17 @@
+# gunicorn settings for production mode (SERVER_MODE=production in run.sh), read from env.
+# Workers are separate processes, each with `WEB_THREADS` threads. They share schema / shares / jobs through schema folder, one of them (leader) runs background jobs and schema snapshots.
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+bind = f"0.0.0.0:{os.getenv('WEB_PORT', '443')}"
+workers = int(os.getenv("WEB_WORKERS", 2))
+threads = int(os.getenv("WEB_THREADS", 8))
+worker_class = "gthread"    # Downloads / uploads are long, blocking requests. A thread per request, not a process.
+timeout = int(os.getenv("WEB_TIMEOUT", 120))
+preload_app = False     # Each worker loads app (and it's locks, threads) after fork.
+accesslog = "-"
+os.environ["WEB_WORKERS"] = str(workers)    # Workers split telegram rate limits, download cache among them (see `BotActions`).
+# Empty WEB_CERTFILE disables TLS (Ex: behind a reverse proxy that terminates it).
+certfile = os.getenv("WEB_CERTFILE", "certs/cert.pem") or None
+keyfile = os.getenv("WEB_KEYFILE", "certs/key.pem") or None
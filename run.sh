@@ -1,5 +1,8 @@
 openssl genrsa -out certs/key.pem 2048
 openssl req -new -key certs/key.pem -out certs/csr.pem -batch
 openssl x509 -req -days 365 -in certs/csr.pem -signkey certs/key.pem -out certs/cert.pem
+if [ "$SERVER_MODE" = "production" ]; then
+    exec gunicorn -c gunicorn.conf.py wsgi:app     # WEB_WORKERS processes, WEB_THREADS threads each.
+fi
 python -m bot   # If this fails, below will be executed
 python3 -m bot
@@ -0,0 +1,34 @@
+"""Shared fixtures. App is pointed to `benchmarks/fake_bot_api.py` on localhost, So tests need no network or telegram account. Run from repo root: `python -m pytest -q`"""
+import pytest
+import sys
+import os
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_FOLDER)
+
+from benchmarks.fake_bot_api import FakeBotApi
+
+
+@pytest.fixture(scope="session")
+def fake_api(tmp_path_factory):
+    api = FakeBotApi(storage_folder=str(tmp_path_factory.mktemp("telegram"))).start()
+    yield api
+    api.stop()
+
+
+@pytest.fixture
+def bot_env(fake_api, tmp_path, monkeypatch):
+    """Env of an app instance working in `tmp_path`, against fake Bot API. Telegram rate limits are off."""
+    monkeypatch.chdir(tmp_path)
+    env = {"API_KEY": "123:test", "CHANNEL_ID": "-100", "TELEGRAM_REQUESTS_PER_SECOND": "0", "TELEGRAM_CHAT_MESSAGES_PER_SECOND": "0",
+           "DOWNLOAD_CACHE_FOLDER": str(tmp_path / "cache"), **fake_api.get_env()}
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+    return tmp_path
+
+
+@pytest.fixture
+def make_bot(bot_env):
+    """Creates a `BotActions` on schema in `tmp_path`. Calling it again is same as a restart of the app."""
+    import core     # After env is set, it's read on import / init.
+    return lambda **kwargs: core.BotActions(str(bot_env / "schema" / "schema.json"), **kwargs)
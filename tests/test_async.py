@@ -0,0 +1,22 @@
+import asyncio
+import io
+
+
+def test_async_validate_drops_missing_files_for_every_process(make_bot, fake_api, bot_env):
+    import core
+    async def run():
+        bot = core.AsyncBotActions(str(bot_env / "schema" / "schema.json"))    # First one in schema folder, leader that runs jobs.
+        try:
+            for name in ("kept.txt", "gone.txt"):
+                success, err = await bot.upload(io.BytesIO(b"content of " + name.encode()), name, directory="docs")
+                assert success is not False, err
+            peer = make_bot()
+            assert len(peer.get_directory_listing("docs")[0]) == 2
+            fake_api.delete_message(bot.get_file_records("docs", "gone.txt")[0]["message_id"])
+            validations = await asyncio.gather(bot.validate(), bot.validate())
+            assert sorted(success for success, _ in validations) == [False, True]   # Second one finds first one's job running.
+            assert [record["filename"] for record in bot.get_directory_listing("docs")[0]] == ["kept.txt"]
+            assert [record["filename"] for record in peer.get_directory_listing("docs")[0]] == ["kept.txt"]
+        finally:
+            await bot.close()
+    asyncio.run(run())
@@ -0,0 +1,35 @@
+from utils.deletes import DeleteQueue
+
+
+def test_batches_are_journaled_and_compacted_at_the_end(tmp_path):
+    queue_filepath = tmp_path / "pending_deletes.json"
+    queue = DeleteQueue(str(queue_filepath))
+    job_id = queue.add("Folder 'docs'", list(range(1, 1001)))
+    queued = queue_filepath.read_bytes()
+    for _ in range(5):
+        batch = queue.next_batch(job_id)
+        queue.mark(job_id, batch[:-1], batch[-1:])
+    assert queue_filepath.read_bytes() == queued    # Only journal grows while job runs.
+    assert queue.get_counts(job_id) == {"total": 1000, "deleted": 495, "failed": 5, "pending": 500}
+    restarted = DeleteQueue(str(queue_filepath))
+    assert restarted.get_pending_jobs() == [job_id] and restarted.next_batch(job_id, 2) == [501, 502]
+    assert restarted.get_counts(job_id) == queue.get_counts(job_id)
+    with open(str(queue_filepath) + ".journal", 'ab') as journal_file:
+        journal_file.write(b'{"job": "' + job_id.encode() + b'", "dele')    # Crash in middle of a write.
+    restarted = DeleteQueue(str(queue_filepath))
+    while batch := restarted.next_batch(job_id):
+        restarted.mark(job_id, batch, [])
+    assert restarted.get_counts(job_id) == {"total": 1000, "deleted": 995, "failed": 5, "pending": 0}
+    assert (tmp_path / "pending_deletes.json.journal").read_bytes() == b""
+    assert DeleteQueue(str(queue_filepath)).get_counts(job_id) == {"total": 1000, "deleted": 995, "failed": 5, "pending": 0}
+
+
+def test_journal_left_by_a_crash_during_compaction_is_not_counted_twice(tmp_path):
+    queue_filepath = tmp_path / "pending_deletes.json"
+    queue = DeleteQueue(str(queue_filepath))
+    job_id = queue.add("Folder 'docs'", [1, 2, 3])
+    queue.mark(job_id, [1], [])
+    journal = (tmp_path / "pending_deletes.json.journal").read_bytes()
+    queue.mark(job_id, [2], [3])
+    (tmp_path / "pending_deletes.json.journal").write_bytes(journal)   # json file written, journal not yet emptied.
+    assert DeleteQueue(str(queue_filepath)).get_counts(job_id) == {"total": 3, "deleted": 2, "failed": 1, "pending": 0}
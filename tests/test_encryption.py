@@ -0,0 +1,85 @@
+from cryptography.exceptions import InvalidTag
+from core import EncDecHelper, SEGMENT_SIZE
+import pytest
+import io
+import os
+
+SIZES = [0, 1, SEGMENT_SIZE - 1, SEGMENT_SIZE, SEGMENT_SIZE * 3 + 5]
+
+
+def split(data: bytes, chunk_size: int):
+    return [data[start:start + chunk_size] for start in range(0, len(data), chunk_size)]
+
+
+@pytest.fixture(scope="module")
+def helper():
+    return EncDecHelper("123:test-100")
+
+
+@pytest.mark.parametrize("plain_size", SIZES)
+def test_envelope_round_trip(helper, plain_size):
+    data = os.urandom(plain_size)
+    envelope = b"".join(helper.get_encrypted_stream(split(data, 1000)))
+    assert helper.is_envelope(envelope)
+    assert len(envelope) == EncDecHelper.get_encrypted_size(plain_size)
+    assert b"".join(helper.get_decrypted_stream(split(envelope, 777))) == data
+    assert helper.get_decrypted_data_binary(envelope) == data
+
+
+def test_segments_decrypt_on_their_own(helper):
+    data = os.urandom(SEGMENT_SIZE * 4 + 100)
+    envelope = helper.get_encrypted_data_binary(data)
+    segment_count = EncDecHelper.get_segment_count(len(data))
+    header = envelope[:EncDecHelper.get_segment_offset(0)]
+    for first_index in (1, segment_count - 1):
+        segments = helper.get_decrypted_segments(header, [envelope[EncDecHelper.get_segment_offset(first_index):]], first_index, segment_count)
+        assert b"".join(segments) == data[first_index * SEGMENT_SIZE:]
+
+
+def test_tampered_or_truncated_envelope_is_rejected(helper):
+    envelope = bytearray(helper.get_encrypted_data_binary(os.urandom(SEGMENT_SIZE * 2)))
+    with pytest.raises(InvalidTag):     # Last segment cut off, the one before it can't pass as last.
+        b"".join(helper.get_decrypted_stream([bytes(envelope[:EncDecHelper.get_segment_offset(1)])]))
+    envelope[-1] ^= 1
+    with pytest.raises(InvalidTag):
+        b"".join(helper.get_decrypted_stream([bytes(envelope)]))
+
+
+def test_range_downloads(make_bot):
+    bot = make_bot()
+    bot._part_size = 150 * 1024     # Several parts, each several segments.
+    data = os.urandom(500 * 1024)
+    success, file_id = bot.upload_file(io.BytesIO(data), "ranges.bin")
+    assert success is not False, file_id
+    assert len(bot.get_file_records("", "ranges.bin")[0]["parts"]) == 4
+    file_info, _ = bot.get_download_info(file_id)
+    assert file_info["total_size"] == len(data)
+    for start, end in [(0, 1), (0, len(data)), (SEGMENT_SIZE - 1, SEGMENT_SIZE + 1), (150 * 1024 - 10, 150 * 1024 + 10), (len(data) - 1, len(data)), (12345, 400000)]:
+        stream, file_name = bot.stream_file(file_id, byte_range=(start, end))
+        assert file_name == "ranges.bin"
+        assert b"".join(stream) == data[start:end], (start, end)
+
+
+def test_every_envelope_has_its_own_key(helper):
+    data = os.urandom(100)
+    first, second = helper.get_encrypted_data_binary(data), helper.get_encrypted_data_binary(data)
+    assert first[:4] == b"TGCE" and first[4] == 2
+    assert first[16:32] != second[16:32]    # Random key salts.
+    with pytest.raises(InvalidTag):     # Segment moved to another envelope doesn't decrypt under it's key.
+        b"".join(helper.get_decrypted_stream([second[:EncDecHelper.get_segment_offset(0)] + first[EncDecHelper.get_segment_offset(0):]]))
+
+
+def test_v1_envelopes_still_decrypt(helper):
+    """Envelopes written before per envelope keys: 16 byte header, all sealed under one key."""
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from core import ENVELOPE_HEADERS
+    import base64
+    v1_key = EncDecHelper._derive_envelope_key(base64.urlsafe_b64decode(helper._EncDecHelper__enc_key), None, b"telegram-cloud segmented envelope v1")
+    data = os.urandom(SEGMENT_SIZE * 2 + 10)
+    header = ENVELOPE_HEADERS[1].pack(b"TGCE", 1, SEGMENT_SIZE, b"\x01" * 7)
+    segments = [AESGCM(v1_key).encrypt(helper._get_segment_nonce(b"\x01" * 7, index, index == 2), data[index * SEGMENT_SIZE:(index + 1) * SEGMENT_SIZE], header) for index in range(3)]
+    envelope = header + b"".join(segments)
+    assert helper.is_envelope(envelope) and EncDecHelper.get_header_size(envelope) == 16
+    assert b"".join(helper.get_decrypted_stream(split(envelope, 3))) == data
+    offset = EncDecHelper.get_segment_offset(1, header_size=16)
+    assert b"".join(helper.get_decrypted_segments(header, [envelope[offset:]], 1, 3)) == data[SEGMENT_SIZE:]
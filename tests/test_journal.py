@@ -0,0 +1,49 @@
+from utils.journal import SchemaJournal
+import io
+
+
+def append_all(journal: SchemaJournal, entries: list[dict]) -> int:
+    seq = None
+    for entry in entries:
+        seq = journal.append(entry)
+    journal.wait(seq)
+    return seq
+
+
+def test_replay_in_order(tmp_path):
+    journal_filepath = str(tmp_path / "schema.json.journal")
+    entries = [{"op": "add_file", "path": "", "record": {"message_id": index}} for index in range(1, 6)]
+    assert append_all(SchemaJournal(journal_filepath), entries) == 5
+    reopened = SchemaJournal(journal_filepath)
+    assert [entry["record"]["message_id"] for entry in reopened.replay(0)] == [1, 2, 3, 4, 5]
+    assert [entry["seq"] for entry in reopened.replay(3)] == [4, 5]     # Entries up to snapshot's seq are not replayed.
+    assert reopened.append({"op": "delete_folder", "path": "a"}) == 6
+
+
+def test_torn_last_line_is_dropped(tmp_path):
+    journal_filepath = tmp_path / "schema.json.journal"
+    append_all(SchemaJournal(str(journal_filepath)), [{"op": "delete_folder", "path": "a"}, {"op": "delete_folder", "path": "b"}])
+    good_length = journal_filepath.stat().st_size
+    with open(journal_filepath, 'ab') as journal_file:
+        journal_file.write(b'{"seq": 3, "op": "delete_fol')  # Crash in middle of a write.
+    recovered = SchemaJournal(str(journal_filepath))
+    assert [entry["path"] for entry in recovered.replay(0)] == ["a", "b"]
+    assert journal_filepath.stat().st_size == good_length
+    append_all(recovered, [{"op": "delete_folder", "path": "c"}])   # Not appended after garbage.
+    assert [(entry["seq"], entry["path"]) for entry in SchemaJournal(str(journal_filepath)).replay(0)] == [(1, "a"), (2, "b"), (3, "c")]
+
+
+def test_restart_replays_uploads(make_bot, bot_env):
+    bot = make_bot()
+    for index in range(3):
+        success, err = bot.upload_file(io.BytesIO(b"content %d" % index), f"file_{index}.txt", directory="docs")
+        assert success is not False, err
+    with open(bot_env / "schema" / "schema.json.journal", 'ab') as journal_file:
+        journal_file.write(b'{"seq": 99, "op": "add_fi')
+    restarted = make_bot()  # schema.json is only written at start, everything after is in journal.
+    files, _, _ = restarted.get_directory_listing("docs")
+    assert sorted(record["filename"] for record in files) == ["file_0.txt", "file_1.txt", "file_2.txt"]
+    assert restarted.upload_file(io.BytesIO(b"after restart"), "file_3.txt", directory="docs")[0] is not False
+    files, _, _ = make_bot().get_directory_listing("docs")
+    assert len(files) == 4
+    assert make_bot().download_file(files[3]["file_id"])[0] == b"after restart"
@@ -0,0 +1,27 @@
+import json
+import io
+
+
+def test_schema_backup_recovers_with_compression_on(make_bot, monkeypatch):
+    monkeypatch.setenv("COMPRESSION", "zlib")
+    bot = make_bot()
+    for index in range(20):
+        assert bot.upload_file(io.BytesIO(b"content %d" % index), f"file_{index}.txt", directory="docs")[0] is not False
+    file_id = bot._run_persist_schema_job(None)["file_id"]
+    content, err = bot.download_file(file_id)
+    assert content is not False, err
+    assert len(json.loads(content)["docs"]["root"]) == 20   # Uploaded as is, not compressed.
+    assert bot.save_schema(content) == (True, None)
+    assert bot.save_schema(b"\x78\x9c not a schema")[0] is False
+
+
+def test_schema_backup_bigger_than_a_message(make_bot, bot_env):
+    bot = make_bot()
+    for index in range(50):
+        assert bot.upload_file(io.BytesIO(b"content %d" % index), f"file_{index}.txt", directory="docs")[0] is not False
+    bot._part_size = 2048   # Schema is split in several parts.
+    file_id = bot._run_persist_schema_job(None)["file_id"]
+    content, err = bot.download_schema_backup(file_id)
+    assert content == (bot_env / "schema" / "schema.json").read_bytes(), err
+    assert bot.save_schema(content) == (True, None)
+    assert len(bot.get_directory_listing("docs")[0]) == 50
@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+from utils.shares import ShareStore
+import time
+
+
+def make_store(tmp_path, **kwargs) -> ShareStore:
+    return ShareStore(str(tmp_path / "shares.db"), expire_in_background=False, **kwargs)
+
+
+def test_attempts_run_out(tmp_path):
+    shares = make_store(tmp_path, attempts=2)
+    assert shares.add("F1")["attempts_left"] == 2
+    assert shares.add("F1") is None    # Already shared.
+    assert shares.use_attempt("F1") and shares.use_attempt("F1")
+    assert not shares.use_attempt("F1")
+    assert shares.get("F1") is None and shares.count() == 0
+    assert not shares.use_attempt("F2")    # Not shared at all.
+
+
+def test_refund_after_last_attempt(tmp_path):
+    shares = make_store(tmp_path, attempts=1)
+    shares.add("F1")
+    assert shares.use_attempt("F1")
+    assert shares.get("F1") is None
+    shares.refund_attempt("F1")     # Download failed, share is usable again.
+    assert shares.get("F1")["attempts_left"] == 1
+    shares.refund_attempt("F1")
+    assert shares.get("F1")["attempts_left"] == 1   # Never more than it was shared with.
+
+
+def test_concurrent_downloads_use_each_attempt_once(tmp_path):
+    shares = make_store(tmp_path, attempts=5)
+    shares.add("F1")
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        used = list(executor.map(lambda _: shares.use_attempt("F1"), range(20)))
+    assert used.count(True) == 5
+
+
+def test_expiry(tmp_path):
+    shares = make_store(tmp_path)
+    shares.add("expiring", expiry_seconds=0.2)
+    shares.add("exhausted", attempts=1)
+    shares.add("active")
+    shares.use_attempt("exhausted")
+    assert shares.next_expiry() <= time.time() + 0.2
+    time.sleep(0.3)
+    assert shares.get("expiring") is None and not shares.use_attempt("expiring")    # Not served past expiry, even before it's removed.
+    assert shares.expire() == 2
+    assert shares.count() == 1 and shares.get("active") is not None
+    assert shares.add("expiring") is not None   # Can be shared again.
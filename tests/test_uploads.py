@@ -0,0 +1,67 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from benchmarks.upload_memory_benchmark import make_file
+import multiprocessing
+import pytest
+import io
+import os
+
+MB = 1024 * 1024
+
+
+def upload_burst(schema_filepath: str, file_paths: list[str]) -> tuple[list, int]:
+    """Uploads files at once (a thread each), in a spawned process. Returns results and peak RSS of the process above what it was before uploads began."""
+    from benchmarks.upload_memory_benchmark import RssSampler, get_rss
+    import core
+    bot = core.BotActions(schema_filepath)
+    def upload(file_path: str):
+        with open(file_path, 'rb') as local_file:
+            return bot.upload_file(local_file, os.path.basename(file_path), directory="burst")
+    baseline = get_rss()
+    with RssSampler() as sampler, ThreadPoolExecutor(max_workers=len(file_paths)) as executor:
+        results = list(executor.map(upload, file_paths))
+    return results, sampler.peak - baseline
+
+
+def test_concurrent_uploads_memory_is_bounded(make_bot, bot_env):
+    """Uploads are streamed, memory depends on number of uploads / parts in flight, not on file size."""
+    file_paths = []
+    for index in range(4):
+        os.makedirs(bot_env / f"data_{index}")
+        file_paths.append(make_file(str(bot_env / f"data_{index}"), 32 * MB))
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:  # Fake Bot API buffers what it's sent, So it's kept out of measured process.
+        results, growth = executor.submit(upload_burst, str(bot_env / "schema" / "schema.json"), file_paths).result()
+    assert all(success is not False for success, _ in results), results
+    assert growth < 64 * MB, f"RSS grew by {growth / MB:.1f} MB for 128 MB of uploads"
+    files, _, _ = make_bot().get_directory_listing("burst")
+    assert sorted(record["total_size"] for record in files) == [32 * MB] * 4
+
+
+def test_upload_download_round_trip(make_bot):
+    bot = make_bot(encrypted=False)
+    data = os.urandom(3 * MB)
+    success, file_id = bot.upload_file(io.BytesIO(data), "plain.bin")
+    assert success is not False, file_id
+    assert bot.download_file(file_id) == (data, "plain.bin")
+    assert bot.get_file_records("", "plain.bin")[0]["is_encrypted"] is False
+
+
+@pytest.mark.parametrize("failure", ["commit", "exception"])
+def test_batch_not_added_to_schema_is_deleted(make_bot, fake_api, monkeypatch, failure):
+    """Messages of a batch that couldn't be saved to schema are deleted, nothing would reach them otherwise."""
+    bot = make_bot()
+    sent = []
+    upload_record = bot.upload_record
+    def record_sent(*args, **kwargs):
+        file_info, err = upload_record(*args, **kwargs)
+        sent.append(file_info)
+        return file_info, err
+    monkeypatch.setattr(bot, "upload_record", record_sent)
+    if failure == "commit":
+        monkeypatch.setattr(bot, "_commit", lambda seq: (False, "disk full"))
+    else:
+        monkeypatch.setattr(bot, "_apply_add_files", lambda records, directory: 1 / 0)
+    results = bot.upload_files([(io.BytesIO(b"content %d" % index), f"file_{index}.txt") for index in range(3)], "docs")
+    assert [success for success, _ in results] == [False] * 3
+    assert len(sent) == 3 and not any(fake_api.has_message(file_info["message_id"]) for file_info in sent)
+    monkeypatch.undo()
+    assert bot.get_directory_listing("docs")[0] in (False, [])
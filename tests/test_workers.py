@@ -0,0 +1,19 @@
+import io
+import os
+
+
+def test_download_from_another_worker(make_bot, monkeypatch):
+    """Two app instances on same schema folder, like gunicorn workers. A file uploaded through one is served whole by the other."""
+    monkeypatch.setenv("COMPRESSION", "zlib")
+    uploader, server = make_bot(), make_bot()
+    uploader._part_size = 1024 * 1024
+    data = (b"telegram cloud " * 100000)[:3 * 1024 * 1024] + os.urandom(3 * 1024 * 1024)
+    success, file_id = uploader.upload_file(io.BytesIO(data), "big.bin", directory="docs")
+    assert success is not False, file_id
+    file_info, err = server.get_download_info(file_id)
+    assert file_info is not False, err
+    assert file_info["file_name"] == "big.bin" and file_info["total_size"] == len(data)
+    stream, _ = server.stream_file(file_id)
+    assert b"".join(stream) == data
+    stream, _ = server.stream_file(file_id, byte_range=(len(data) // 2, len(data) // 2 + 100))
+    assert b"".join(stream) == data[len(data) // 2:len(data) // 2 + 100]
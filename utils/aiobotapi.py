@@ -0,0 +1,137 @@
+from telegram import error as telegram_error
+import importlib.util
+import urllib.parse
+import logging
+import os
+try:
+    import httpx    # Optional, only `AsyncBotActions` needs it.
+except ImportError:
+    httpx = None
+logger = logging.getLogger()
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None    # httpx speaks HTTP/2 only if `h2` is installed (pip install 'httpx[http2]').
+
+
+def is_available() -> bool:
+    return httpx is not None
+
+
+class FileLinkExpired(Exception):
+    """Download link (`file_path` from getFile) is no longer valid, get a new one."""
+
+
+class AsyncBotApi:
+    """asyncio client for the Bot API methods `BotActions` uses, on a single `httpx.AsyncClient`: keep-alive connections are pooled and reused (at most `max_connections` open),
+       with HTTP/2 where available, So many concurrent requests share a few connections instead of a connection (and a thread) each.\n
+       Errors are raised as python-telegram-bot's exceptions, same as sync `Bot` raises them. So `ApiScheduler` (rate limits, retries) and callers handle both alike.
+       Client is created on first call, in the event loop that makes it. Call `close()` once done, in same loop.
+    """
+    def __init__(self, token: str, base_url: str = "https://api.telegram.org/bot", base_file_url: str = "https://api.telegram.org/file/bot", max_connections: int = 32, timeout: float = 60) -> None:
+        if httpx is None:
+            raise RuntimeError("Async Bot API client needs httpx, install it with: pip install 'httpx[http2]'")
+        self._url = f"{base_url}{token}"
+        self._file_url = f"{base_file_url}{token}"
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._timeout = httpx.Timeout(timeout, connect=min(timeout, 10))
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(http2=HTTP2_AVAILABLE, limits=self._limits, timeout=self._timeout)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @staticmethod
+    def _get_error(status_code: int, payload: dict) -> telegram_error.TelegramError:
+        """Same exception python-telegram-bot raises for an error response."""
+        description = payload.get("description", "Unknown HTTPError")
+        parameters = payload.get("parameters") or {}
+        if "retry_after" in parameters:
+            return telegram_error.RetryAfter(parameters["retry_after"])
+        if "migrate_to_chat_id" in parameters:
+            return telegram_error.ChatMigrated(parameters["migrate_to_chat_id"])
+        if status_code in (401, 403):
+            return telegram_error.Unauthorized(description)
+        if status_code == 400:
+            return telegram_error.BadRequest(description)
+        if status_code == 404:
+            return telegram_error.InvalidToken()
+        if status_code == 409:
+            return telegram_error.Conflict(description)
+        return telegram_error.NetworkError(f"{description} ({status_code})")
+
+    async def _post(self, method: str, params: dict, files: dict = None, timeout: float = None):
+        """Calls a Bot API method, returns it's result. Params are sent as json, or as form fields along with `files` (multipart)."""
+        options = {"timeout": timeout} if timeout is not None else {}
+        try:
+            if files is None:
+                response = await self.client.post(f"{self._url}/{method}", json=params, **options)
+            else:
+                response = await self.client.post(f"{self._url}/{method}", data={name: str(value) for name, value in params.items()}, files=files, **options)
+        except httpx.TimeoutException as err:
+            raise telegram_error.TimedOut() from err
+        except httpx.HTTPError as err:
+            raise telegram_error.NetworkError(f"httpx.{type(err).__name__}: {err}") from err
+        try:
+            payload = response.json()
+        except ValueError:
+            raise telegram_error.NetworkError(f"Invalid server response ({response.status_code})")
+        if payload.get("ok"):
+            return payload["result"]
+        raise self._get_error(response.status_code, payload)
+
+    async def send_document(self, chat_id, document, filename: str, caption: str = None, timeout: float = None) -> dict:
+        """Sends a document (bytes, or a seekable file object read as request is sent), returns the message."""
+        return await self._post("sendDocument", {"chat_id": chat_id, "caption": caption or ""}, files={"document": (filename, document, "application/octet-stream")}, timeout=timeout)
+
+    async def get_file(self, file_id: str, timeout: float = None) -> dict:
+        """File info with it's `file_path` (download link, see `iter_file`) and `file_size`."""
+        return await self._post("getFile", {"file_id": file_id}, timeout=timeout)
+
+    async def copy_message(self, chat_id, from_chat_id, message_id: int, timeout: float = None) -> dict:
+        return await self._post("copyMessage", {"chat_id": chat_id, "from_chat_id": from_chat_id, "message_id": message_id}, timeout=timeout)
+
+    async def delete_message(self, chat_id, message_id: int, timeout: float = None) -> bool:
+        return await self._post("deleteMessage", {"chat_id": chat_id, "message_id": message_id}, timeout=timeout)
+
+    async def delete_messages(self, chat_id, message_ids: list[int], timeout: float = None) -> bool:
+        """Deletes up to 100 messages in one call."""
+        return await self._post("deleteMessages", {"chat_id": chat_id, "message_ids": list(message_ids)}, timeout=timeout)
+
+    async def get_chat_members_count(self, chat_id, timeout: float = None) -> int:
+        return await self._post("getChatMemberCount", {"chat_id": chat_id}, timeout=timeout)
+
+    def get_file_url(self, file_path: str) -> str:
+        """Download link of a `file_path` from `get_file`, as python-telegram-bot's `File.file_path` has it. A local path (Bot API server in local mode) is returned as is."""
+        if os.path.isfile(file_path) or file_path.startswith(("http://", "https://")):
+            return file_path
+        return f"{self._file_url}/{file_path}"
+
+    async def iter_file(self, file_path: str, chunk_size: int = 256 * 1024):
+        """Yields content of a file in telegram (`file_path` from `get_file`) as it arrives. A local path (Bot API server in local mode) is read from disk.\n
+           Raises `FileLinkExpired` if telegram no longer knows the link, before anything is yielded.
+        """
+        if os.path.isfile(file_path):
+            with open(file_path, 'rb') as local_file:
+                while chunk := local_file.read(chunk_size):
+                    yield chunk
+            return
+        url = urllib.parse.urlsplit(self.get_file_url(file_path))
+        url = url._replace(path=urllib.parse.quote(url.path)).geturl()   # Convert any UTF-8 char in file path into a url encoded ASCII string.
+        try:
+            async with self.client.stream("GET", url) as response:
+                if response.status_code == 404:
+                    raise FileLinkExpired(file_path)
+                if response.status_code != 200:
+                    raise telegram_error.NetworkError(f"Download failed with status {response.status_code}")
+                async for chunk in response.aiter_bytes(chunk_size):
+                    yield chunk
+        except httpx.TimeoutException as err:
+            raise telegram_error.TimedOut() from err
+        except httpx.HTTPError as err:
+            raise telegram_error.NetworkError(f"httpx.{type(err).__name__}: {err}") from err
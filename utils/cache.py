@@ -0,0 +1,332 @@
+from collections import OrderedDict
+from utils.journal import write_file_atomically
+import threading
+import asyncio
+import hashlib
+import logging
+import json
+import time
+import os
+logger = logging.getLogger()
+
+class MemoryCache:
+    """Thread safe, size bounded LRU cache of binary values held in memory. Least recently used values are evicted once `max_bytes` is crossed."""
+    def __init__(self, max_bytes: int) -> None:
+        self._max_bytes = max_bytes
+        self._used_bytes = 0
+        self._items: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)    # Most recently used.
+            return value
+
+    def put(self, key: str, value: bytes):
+        if len(value) > self._max_bytes:    # Would evict everything else, and still not fit.
+            return
+        with self._lock:
+            if key in self._items:
+                self._used_bytes -= len(self._items.pop(key))
+            self._items[key] = value
+            self._used_bytes += len(value)
+            while self._used_bytes > self._max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._used_bytes -= len(evicted)
+
+    def keys(self) -> list[str]:
+        with self._lock:
+            return list(self._items.keys())
+
+    def invalidate(self, key: str):
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is not None:
+                self._used_bytes -= len(value)
+
+
+class DiskCache:
+    """Thread safe, size bounded LRU cache of files (content as stored in telegram, So encrypted files stay encrypted on disk) in a local folder. Index of entries survives restarts.\n
+       Concurrent requests for same uncached key share a single fetch: First one fetches (and streams it to it's caller as it arrives), others wait for it and read from disk.
+       Hits, misses, requests that waited on another fetch (coalesced), evictions, invalidations are counted in `stats`.
+    """
+    def __init__(self, cache_folder: str, max_bytes: int) -> None:
+        self._folder = cache_folder
+        self._max_bytes = max_bytes
+        self._index_filepath = os.path.join(self._folder, "index.json")
+        self._entries: OrderedDict[str, int] = OrderedDict()    # key -> size in bytes, least recently used first.
+        self._used_bytes = 0
+        self._in_flight: dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._index_saved_at = 0.0
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "invalidations": 0}
+        if self._max_bytes > 0:
+            os.makedirs(self._folder, exist_ok=True)
+            self._load_index()
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self._folder, hashlib.sha256(key.encode('utf8')).hexdigest())
+
+    def _load_index(self):
+        """Reads index saved by a previous run, drops entries whose file is gone / incomplete and files no entry points to (Ex: interrupted fetches)."""
+        try:
+            with open(self._index_filepath, 'r') as index_file:
+                saved_entries = json.load(index_file)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            saved_entries = []
+        for key, entry_size in saved_entries:
+            try:
+                if os.path.getsize(self._get_path(key)) == entry_size:
+                    self._entries[key] = entry_size
+                    self._used_bytes += entry_size
+            except OSError:
+                continue
+        known_files = {os.path.basename(self._get_path(key)) for key in self._entries} | {os.path.basename(self._index_filepath)}
+        for file_name in os.listdir(self._folder):
+            if file_name not in known_files:
+                try:
+                    os.remove(os.path.join(self._folder, file_name))
+                except OSError:
+                    pass
+        self._evict()
+        logger.info(f"Download cache has {len(self._entries)} files, {self._used_bytes} bytes from previous runs.")
+
+    def _save_index(self):
+        """Called under lock."""
+        try:
+            write_file_atomically(self._index_filepath, json.dumps(list(self._entries.items())).encode('utf8'))
+            self._index_saved_at = time.monotonic()
+        except OSError as err:
+            logger.warning(f"Unable to save download cache index, Error: {err}")
+
+    def _evict(self):
+        """Drops least recently used entries till cache is within budget. Called under lock. Files being read by someone stay readable till they're closed."""
+        while self._used_bytes > self._max_bytes and self._entries:
+            key, entry_size = self._entries.popitem(last=False)
+            self._used_bytes -= entry_size
+            self.stats["evictions"] += 1
+            try:
+                os.remove(self._get_path(key))
+            except OSError:
+                pass
+
+    def _open(self, key: str):
+        """Open file of a cached entry (marked as recently used), None if key isn't cached."""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            if time.monotonic() - self._index_saved_at > 60:   # Recency of hits is saved once in a while, not on every hit.
+                self._save_index()
+            try:
+                return open(self._get_path(key), 'rb')
+            except OSError:     # Removed behind our back.
+                self._used_bytes -= self._entries.pop(key)
+                return None
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def keys(self) -> list[str]:
+        with self._lock:
+            return list(self._entries.keys())
+
+    def iter_cached(self, key: str, fetch, buffer_size: int = 256 * 1024):
+        """Yields content of `key` from cache. If it's not cached, `fetch()` is called to get an iterable of content chunks, which are yielded as they arrive and saved in cache.\n
+           Content is cached only if it was read till the end (a fetch given up midway isn't). While a fetch for `key` is on, others asking for same key wait for it.
+        """
+        if self._max_bytes <= 0:    # Cache disabled.
+            yield from fetch()
+            return
+        waited = False
+        while True:
+            cached_file = self._open(key)
+            if cached_file is not None:
+                with self._lock:
+                    self.stats["coalesced" if waited else "hits"] += 1
+                with cached_file:
+                    while chunk := cached_file.read(buffer_size):
+                        yield chunk
+                return
+            with self._lock:
+                event = self._in_flight.get(key)
+                if event is None:
+                    event = self._in_flight[key] = threading.Event()
+                    self.stats["misses"] += 1
+                    break
+            event.wait()    # Someone else is fetching it. If their fetch fails / is given up, we try fetching it ourselves.
+            waited = True
+        try:
+            yield from self._fetch_into_cache(key, fetch)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            event.set()
+
+    def _fetch_into_cache(self, key: str, fetch):
+        file_path = self._get_path(key)
+        tmp_filepath, written = file_path + ".tmp", 0
+        tmp_file = open(tmp_filepath, 'wb')
+        try:
+            for chunk in fetch():
+                if tmp_file is not None:
+                    written += len(chunk)
+                    if written > self._max_bytes:   # Bigger than whole cache, not cached.
+                        tmp_file.close()
+                        tmp_file = None
+                        os.remove(tmp_filepath)
+                    else:
+                        tmp_file.write(chunk)
+                yield chunk
+            if tmp_file is not None:
+                tmp_file.close()
+                tmp_file = None
+                os.replace(tmp_filepath, file_path)
+                with self._lock:
+                    if key in self._entries:
+                        self._used_bytes -= self._entries.pop(key)
+                    self._entries[key] = written
+                    self._used_bytes += written
+                    self._evict()
+                    self._save_index()
+        finally:
+            if tmp_file is not None:    # Fetch failed, or reader stopped midway.
+                tmp_file.close()
+                try:
+                    os.remove(tmp_filepath)
+                except OSError:
+                    pass
+
+    def invalidate(self, key: str):
+        with self._lock:
+            entry_size = self._entries.pop(key, None)
+            if entry_size is None:
+                return
+            self._used_bytes -= entry_size
+            self.stats["invalidations"] += 1
+            try:
+                os.remove(self._get_path(key))
+            except OSError:
+                pass
+            self._save_index()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries), "used_bytes": self._used_bytes, "max_bytes": self._max_bytes}
+
+
+class TTLCache:
+    """Thread safe cache of values that go out of date (Ex: metadata from telegram), each call type (`kind`) has it's own TTL and staleness window: `ttls = {kind: (ttl, max_age)}`.\n
+       A value younger than `ttl` is served as is. One older than that but younger than `max_age` is served right away (stale) while a fresh one is loaded in background.
+       Past `max_age` (or if it was never loaded) caller waits for load. A failed background load leaves stale value in place, it's served till `max_age` (Ex: telegram is slow / down).
+    """
+    def __init__(self, ttls: dict[str, tuple[float, float]]) -> None:
+        self._ttls = ttls
+        self._items: dict[tuple[str, str], tuple[float, object]] = {}   # (kind, key) -> (loaded at, value)
+        self._refreshing: set[tuple[str, str]] = set()
+        self._tasks: set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "load_errors": 0, "invalidations": 0}
+
+    def _count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _load(self, item_key: tuple[str, str], loader):
+        return self._store(item_key, loader())
+
+    def _store(self, item_key: tuple[str, str], value):
+        with self._lock:
+            self._items[item_key] = (time.monotonic(), value)
+        return value
+
+    def _refresh(self, item_key: tuple[str, str], loader):
+        try:
+            self._load(item_key, loader)
+            self._count("refreshes")
+        except Exception as err:
+            self._count("load_errors")
+            logger.warning(f"Unable to refresh '{item_key[0]}' for '{item_key[1]}', stale value is served meanwhile. Error: {err}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(item_key)
+
+    async def _refresh_async(self, item_key: tuple[str, str], loader):
+        try:
+            self._store(item_key, await loader())
+            self._count("refreshes")
+        except Exception as err:
+            self._count("load_errors")
+            logger.warning(f"Unable to refresh '{item_key[0]}' for '{item_key[1]}', stale value is served meanwhile. Error: {err}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(item_key)
+
+    def refresh_in_background(self, kind: str, key: str, loader):
+        """Loads a fresh value in a background thread, unless one is being loaded already. Ex: to warm up cache at start."""
+        item_key = (kind, key)
+        with self._lock:
+            if item_key in self._refreshing:
+                return
+            self._refreshing.add(item_key)
+        threading.Thread(target=self._refresh, args=(item_key, loader), daemon=True).start()
+
+    def get(self, kind: str, key: str, loader):
+        """Cached value of `key`, `loader()` is called to get a fresh value when needed. Exceptions from `loader` are raised only if there's no value within `max_age` to fall back on."""
+        ttl, max_age = self._ttls[kind]
+        item_key = (kind, key)
+        with self._lock:
+            loaded_at, value = self._items.get(item_key, (None, None))
+        age = time.monotonic() - loaded_at if loaded_at is not None else None
+        if age is not None and age < ttl:
+            self._count("hits")
+            return value
+        if age is not None and age < max_age:
+            self._count("stale_hits")
+            self.refresh_in_background(kind, key, loader)
+            return value
+        self._count("misses")
+        try:
+            return self._load(item_key, loader)
+        except Exception:
+            self._count("load_errors")
+            raise
+
+    async def get_async(self, kind: str, key: str, loader):
+        """Same as `get`, for asyncio callers. `loader` is a coroutine function, a stale value is refreshed in a task on running event loop. Values are shared with `get`."""
+        ttl, max_age = self._ttls[kind]
+        item_key = (kind, key)
+        with self._lock:
+            loaded_at, value = self._items.get(item_key, (None, None))
+        age = time.monotonic() - loaded_at if loaded_at is not None else None
+        if age is not None and age < ttl:
+            self._count("hits")
+            return value
+        if age is not None and age < max_age:
+            self._count("stale_hits")
+            with self._lock:
+                refreshing = item_key in self._refreshing
+                self._refreshing.add(item_key)
+            if not refreshing:
+                task = asyncio.get_running_loop().create_task(self._refresh_async(item_key, loader))
+                self._tasks.add(task)   # Event loop holds only a weak reference to tasks.
+                task.add_done_callback(self._tasks.discard)
+            return value
+        self._count("misses")
+        try:
+            return self._store(item_key, await loader())
+        except Exception:
+            self._count("load_errors")
+            raise
+
+    def invalidate(self, kind: str, key: str):
+        with self._lock:
+            if self._items.pop((kind, key), None) is not None:
+                self.stats["invalidations"] += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "entries": len(self._items)}
@@ -0,0 +1,202 @@
+from utils.journal import SchemaJournal, write_file_atomically
+from utils.locks import InterProcessLock
+import threading
+import logging
+import random
+import json
+import time
+logger = logging.getLogger()
+
+_gear_random = random.Random(0x7E1E6CA)    # Fixed seed, chunk boundaries must be same on every run.
+GEAR = tuple(_gear_random.getrandbits(64) for _ in range(256))  # Random value per byte, for the rolling gear hash.
+HASH_MASK = (1 << 64) - 1
+
+
+def _get_cut_mask(bits: int) -> int:
+    """Mask of `bits` high bits of the 64 bit gear hash. High bits depend on last 64 bytes seen, So boundaries depend only on content near them."""
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+def find_cut_point(data: bytes | bytearray | memoryview, min_size: int, avg_size: int, max_size: int) -> int:
+    """Length of first chunk in `data`, FastCDC style: no boundary before `min_size`, a stricter mask until `avg_size` and a looser one after it (chunk sizes stay close to average), forced cut at `max_size`."""
+    if len(data) <= min_size:
+        return len(data)
+    bits = max(avg_size.bit_length() - 1, 2)
+    strict_mask, loose_mask = _get_cut_mask(bits + 1), _get_cut_mask(bits - 1)
+    view, gear, hash_value = memoryview(data), GEAR, 0
+    normal_end, end = min(avg_size, len(data)), min(max_size, len(data))
+    for offset, byte in enumerate(view[min_size:normal_end], min_size):
+        hash_value = ((hash_value << 1) + gear[byte]) & HASH_MASK
+        if not hash_value & strict_mask:
+            return offset + 1
+    for offset, byte in enumerate(view[normal_end:end], normal_end):
+        hash_value = ((hash_value << 1) + gear[byte]) & HASH_MASK
+        if not hash_value & loose_mask:
+            return offset + 1
+    return end
+
+
+def iter_chunks(blocks, min_size: int, avg_size: int, max_size: int):
+    """Splits a stream of bytes (iterable of blocks of any size) into content defined chunks, yields each chunk as bytes.\n
+       A boundary is placed where a rolling hash of last few bytes matches a pattern, So an edit in middle of a file only changes chunks around it, rest of the chunks (and their hashes) stay same.
+    """
+    buffer = bytearray()
+    for block in blocks:
+        buffer += block
+        while len(buffer) >= max_size:  # Enough data to find a boundary, irrespective of what comes next.
+            cut = find_cut_point(buffer, min_size, avg_size, max_size)
+            yield bytes(buffer[:cut])
+            del buffer[:cut]
+    while buffer:
+        cut = find_cut_point(buffer, min_size, avg_size, max_size)
+        yield bytes(buffer[:cut])
+        del buffer[:cut]
+
+
+class ChunkStore:
+    """Registry of content chunks stored in channel, chunk key -> {message_id, file_id, size, added, compression (if any)}. Persisted same way as schema, a json snapshot + journal of changes.\n
+       Which chunks are still in use is not stored here, that comes from schema (records reference chunks in their `parts`), So a chunk's refcount is always in line with schema.
+       A chunk being uploaded / linked into a record that is not yet in schema is pinned, it's not collected even though nothing references it yet. (Pins are only known to the process that made them.)
+       Several processes can share a store (Ex: gunicorn workers), changes are made under a lock held across processes, on top of what others journaled meanwhile.
+    """
+    def __init__(self, store_filepath: str, compact_after: int = 1000) -> None:
+        self._filepath = store_filepath
+        self._pins: dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._process_lock = InterProcessLock(self._filepath + ".lock")
+        with self._process_lock.hold():     # No other process is half way through writing journal.
+            snapshot = self._load_snapshot()
+            self._chunks: dict[str, dict] = snapshot["chunks"]
+            self._journal = SchemaJournal(self._filepath + ".journal", start_seq=snapshot.get("journal_seq", 0), compact_after=compact_after)
+            self._apply_entries(self._journal.replay(snapshot.get("journal_seq", 0)))
+            self.save()
+
+    def _load_snapshot(self) -> dict:
+        try:
+            with open(self._filepath, 'r') as store_file:
+                return json.load(store_file)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return {"chunks": {}, "journal_seq": 0}
+
+    def _apply_entries(self, entries: list[dict]):
+        for entry in entries:
+            if entry.get("op") == "put":
+                self._chunks[entry["key"]] = entry["info"]
+            elif entry.get("op") == "drop":
+                self._chunks.pop(entry["key"], None)
+
+    def _refresh(self):
+        """Applies changes other processes journaled since. Called under lock."""
+        if not self._journal.has_changes():
+            return
+        entries = self._journal.read_new()
+        if entries is None:     # Another process compacted journal past what this process has seen, it's all in snapshot.
+            snapshot = self._load_snapshot()
+            self._chunks = snapshot["chunks"]
+            self._journal.skip_to(snapshot.get("journal_seq", 0))
+            entries = self._journal.read_new() or []
+        self._apply_entries(entries)
+
+    def save(self):
+        """Writes a snapshot of the store, drops journal entries it covers."""
+        try:
+            with self._process_lock.hold():
+                with self._lock:
+                    self._refresh()
+                    snapshot_seq = self._journal.last_seq
+                    content = json.dumps({"chunks": self._chunks, "journal_seq": snapshot_seq}).encode('utf8')
+                write_file_atomically(self._filepath, content)
+                self._journal.compact(snapshot_seq)
+        except Exception as err:
+            logger.error(f"Unable to save chunk store snapshot, Error: {err}")
+
+    def save_if_changed(self):
+        if self._journal.entries_since_snapshot > 0 or self._journal.has_changes():
+            self.save()
+
+    def _journal_change(self, entry: dict) -> int | None:
+        """Called under lock, same as schema changes."""
+        try:
+            return self._journal.append(entry)
+        except OSError as err:
+            logger.error(f"{err}. Chunk store change will be saved in next snapshot.")
+            return None
+
+    def _commit(self, seq: int | None):
+        try:
+            if seq is not None:
+                self._journal.wait(seq)
+                return
+        except OSError as err:
+            logger.error(f"{err}. Saving a full chunk store snapshot instead.")
+        self.save()
+
+    def acquire(self, key: str) -> dict | None:
+        """Info of a stored chunk (copy), pinned until `release(key)`. None if chunk is not in store."""
+        with self._lock:
+            self._refresh()
+            info = self._chunks.get(key)
+            if info is None:
+                return None
+            self._pins[key] = self._pins.get(key, 0) + 1
+            return dict(info)
+
+    def add(self, key: str, message_id: int, file_id: str, size: int, compression: str = None, pin: bool = True):
+        """Registers a chunk that was just uploaded (pinned, unless `pin=False`), `size` is it's plain size and `compression` the codec it was stored with. Returns once it's on disk."""
+        info = {"message_id": message_id, "file_id": file_id, "size": size, "added": time.time()}
+        if compression is not None:
+            info["compression"] = compression
+        with self._process_lock.hold(), self._lock:
+            self._refresh()
+            self._chunks[key] = info
+            if pin:
+                self._pins[key] = self._pins.get(key, 0) + 1
+            seq = self._journal_change({"op": "put", "key": key, "info": info})
+        self._commit(seq)
+
+    def release(self, keys):
+        """Unpins chunks, once the record referencing them is in schema (or it's upload failed)."""
+        with self._lock:
+            for key in keys:
+                count = self._pins.get(key, 0) - 1
+                if count > 0:
+                    self._pins[key] = count
+                else:
+                    self._pins.pop(key, None)
+
+    def pop_unreferenced(self, keys, get_refcount, added_before: float = None) -> list[tuple[str, dict]]:
+        """Drops chunks in `keys` that no record references (`get_refcount(key) == 0`) and no one has pinned, returns them as a list of (key, info) for their messages to be deleted.\n
+           Call under schema lock, So refcounts don't change meanwhile. `added_before` (epoch) leaves alone chunks added after it (Ex: by an upload running in another process).
+        """
+        dropped, seq = [], None
+        with self._process_lock.hold(), self._lock:
+            self._refresh()
+            for key in dict.fromkeys(keys):   # Unique, in order.
+                info = self._chunks.get(key)
+                if info is None or self._pins.get(key, 0) > 0 or get_refcount(key) > 0:
+                    continue
+                if added_before is not None and info.get("added", 0) > added_before:
+                    continue
+                self._chunks.pop(key)
+                dropped.append((key, info))
+                seq = self._journal_change({"op": "drop", "key": key})
+        if dropped:
+            self._commit(seq)
+        return dropped
+
+    def keys(self) -> list[str]:
+        with self._lock:
+            self._refresh()
+            return list(self._chunks)
+
+    def get_stats(self, get_refcount) -> dict:
+        """Chunk count, bytes stored in channel, bytes referenced by files (a chunk used by N files counts N times) and dedup ratio of the two."""
+        with self._lock:
+            self._refresh()
+            chunks = list(self._chunks.items())
+            pinned = len(self._pins)
+        stored_bytes = sum(info["size"] for _, info in chunks)
+        refcounts = [get_refcount(key) for key, _ in chunks]
+        referenced_bytes = sum(info["size"] * refcount for (_, info), refcount in zip(chunks, refcounts))
+        return {"chunks": len(chunks), "unreferenced_chunks": sum(1 for refcount in refcounts if refcount == 0), "pinned_chunks": pinned, "stored_bytes": stored_bytes,
+                "referenced_bytes": referenced_bytes, "dedup_ratio": round(referenced_bytes / stored_bytes, 3) if stored_bytes else 1.0}
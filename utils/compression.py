@@ -0,0 +1,77 @@
+import logging
+import zlib
+import os
+try:
+    import zstandard    # Optional, zlib is used if it's not installed.
+except ImportError:
+    zstandard = None
+logger = logging.getLogger()
+
+CODECS = ("zlib", "zstd")
+DEFAULT_LEVELS = {"zlib": 6, "zstd": 3}
+# Formats that are already compressed, compressing them again only costs CPU.
+COMPRESSED_EXTENSIONS = {
+    "jpg", "jpeg", "png", "gif", "webp", "heic", "avif", "mp4", "mkv", "avi", "mov", "webm", "m4v", "mp3", "aac", "ogg", "opus", "flac", "m4a",
+    "zip", "gz", "tgz", "bz2", "xz", "7z", "rar", "zst", "lz4", "jar", "apk", "docx", "xlsx", "pptx", "odt", "epub", "pdf",
+}
+SAMPLE_SIZE = 64 * 1024     # Bytes compressed to decide if rest of the file is worth compressing.
+FEED_SIZE = 1024 * 1024     # Bytes fed to compressor at a time, output size is checked after each.
+
+
+def is_codec_available(codec: str) -> bool:
+    return codec == "zlib" or (codec == "zstd" and zstandard is not None)
+
+
+class Compressor:
+    """Streaming compressor for one codec. `compress()` returns all output for data given so far (output is flushed each time, so it's size is known), `finish()` ends the stream."""
+    def __init__(self, codec: str, level: int = None) -> None:
+        level = DEFAULT_LEVELS[codec] if level is None else level
+        if codec == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+            self._sync_flag = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            self._compressor = zlib.compressobj(level)
+            self._sync_flag = zlib.Z_SYNC_FLUSH
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(self._sync_flag)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+def compress(data: bytes, codec: str, level: int = None) -> bytes:
+    compressor = Compressor(codec, level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def iter_decompressed(chunks, codec: str, buffer_size: int = 256 * 1024):
+    """Decompresses a stream of compressed chunks as they come, yields plain bytes. Whole data is never held in memory."""
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("File is compressed with zstd, `zstandard` package must be installed to download it.")
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        for chunk in chunks:
+            if plain := decompressor.decompress(chunk):
+                yield plain
+    elif codec == "zlib":
+        decompressor = zlib.decompressobj()
+        for chunk in chunks:
+            while chunk:    # Output is limited to `buffer_size` per call, highly compressed data doesn't blow up in memory.
+                if plain := decompressor.decompress(chunk, buffer_size):
+                    yield plain
+                chunk = decompressor.unconsumed_tail
+        if plain := decompressor.flush():
+            yield plain
+    else:
+        raise ValueError(f"Unknown compression codec: '{codec}'")
+
+
+def is_worth_compressing(file_name: str, sample: bytes, codec: str, level: int = None, min_saving: float = 0.1) -> bool:
+    """False for file types that are already compressed (by extension), or if a sample from start of the file doesn't shrink by at least `min_saving` (Ex: 0.1 = 10%)."""
+    extension = os.path.splitext(file_name or "")[1].lower().lstrip(".")
+    if extension in COMPRESSED_EXTENSIONS or not sample:
+        return False
+    sample = sample[:SAMPLE_SIZE]
+    return len(compress(sample, codec, level)) <= len(sample) * (1 - min_saving)
+
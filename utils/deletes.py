@@ -0,0 +1,147 @@
+from utils.journal import SharedJsonFile, write_file_atomically
+import itertools
+import logging
+import json
+import os
+import time
+import uuid
+logger = logging.getLogger()
+
+DELETE_BATCH_SIZE = 100     # Most messages `deleteMessages` takes in one call.
+
+
+def delete_messages(bot, chat_id, message_ids: list[int], timeout: float = None) -> bool:
+    """`deleteMessages` Bot API method, deletes up to 100 messages in one call (Messages that can't be found are skipped by telegram). python-telegram-bot 13 doesn't have it."""
+    return bot._post('deleteMessages', {"chat_id": chat_id, "message_ids": list(message_ids)}, timeout=timeout)
+
+
+class DeleteQueue:
+    """Persisted queue of telegram messages waiting to be deleted, grouped into jobs (Ex: one per deleted folder). Jobs are saved to a json file (atomically) when they're added,\n
+       outcome of each batch is appended to a small journal next to it instead, So a job of n messages isn't rewritten n / 100 times. Journal is folded into json file (compacted) once a job finishes.
+       Messages still pending after a crash / restart are picked up again on next start. Counts of each job (total, deleted, failed, pending) are kept, for last `keep_finished` finished jobs too.
+       Files are shared by every process using them (Ex: gunicorn workers), they're read and changed under a lock held across processes (see `SharedJsonFile`).
+       Each job is drained by a background job of `JobManager` (see `BotActions._run_delete_job`).
+    """
+    def __init__(self, queue_filepath: str, keep_finished: int = 20) -> None:
+        self._state = SharedJsonFile(queue_filepath, {"jobs": {}})
+        self._journal_filepath = queue_filepath + ".journal"
+        self._keep_finished = keep_finished
+        self._snapshot = None   # Content of json file `self._jobs` was built on, rebuilt when it changes.
+        self._jobs: dict = {}
+        self._journal_offset = 0    # Journal is applied to `self._jobs` upto here.
+        self._journal_torn = False  # Last journal line is incomplete (crash in middle of a write).
+
+    def _refresh(self) -> dict:
+        """Jobs as in json file, with batch outcomes journaled since it was compacted applied. Pending messages of a job are a dict (ordered, removed from in O(1)). Call holding `self._state.hold()`."""
+        snapshot = self._state.load()
+        if snapshot is not self._snapshot:
+            self._snapshot, self._journal_offset = snapshot, 0
+            self._jobs = {job_id: {**job, "pending": dict.fromkeys(job["pending"]), "failed": list(job["failed"])} for job_id, job in snapshot["jobs"].items()}
+        try:
+            with open(self._journal_filepath, 'rb') as journal_file:
+                journal_file.seek(self._journal_offset)
+                lines = journal_file.read().split(b"\n")
+        except FileNotFoundError:
+            lines = [b""]
+        for line in lines[:-1]:
+            self._journal_offset += len(line) + 1
+            try:
+                self._apply(self._jobs, json.loads(line))
+            except ValueError:
+                logger.warning(f"Skipping an incomplete line in '{self._journal_filepath}', left by a crash. Those messages are tried again.")
+        self._journal_torn = lines[-1] != b""
+        return self._jobs
+
+    @staticmethod
+    def _apply(jobs: dict, entry: dict):
+        """Applies outcome of a batch to a job. Only messages still pending are counted, So applying an entry twice (Ex: crash during compaction) changes nothing."""
+        job = jobs.get(entry["job"])
+        if job is None:
+            return
+        pending = job["pending"]
+        for message_id in entry["deleted"]:
+            if message_id in pending:
+                del pending[message_id]
+                job["deleted"] += 1
+        for message_id in entry["failed"]:
+            if message_id in pending:
+                del pending[message_id]
+                job["failed"].append(message_id)
+
+    def _compact(self, jobs: dict):
+        """Writes `jobs` (as returned by `_refresh`) to json file, finishing ones with nothing pending, and empties journal. Call holding `self._state.hold()`."""
+        with self._state.transaction() as state:
+            state["jobs"] = {job_id: {**job, "pending": list(job["pending"])} for job_id, job in jobs.items()}
+            for job in list(state["jobs"].values()):
+                if not job["pending"] and not job["finished"]:
+                    self._finish(state["jobs"], job)
+        self._snapshot = None   # Rebuilt from json file on next `_refresh`.
+        if self._state.data is not state:   # json file couldn't be written (it's logged), journal is kept.
+            return
+        try:
+            write_file_atomically(self._journal_filepath, b"")
+        except OSError as err:
+            logger.error(f"Unable to empty '{self._journal_filepath}', Error: {err}")
+
+    def add(self, description: str, message_ids: list[int]) -> str | None:
+        """Queues messages for deletion as a new job, returns it's id once it's on disk. None if there is nothing to delete."""
+        message_ids = list(dict.fromkeys(message_ids))    # Unique, in order.
+        if not message_ids:
+            return None
+        job_id = uuid.uuid4().hex[:12]
+        with self._state.transaction() as state:
+            state["jobs"][job_id] = {"id": job_id, "description": description, "total": len(message_ids), "deleted": 0, "failed": [], "pending": message_ids, "created": time.time(), "finished": None}
+        return job_id
+
+    def next_batch(self, job_id: str, batch_size: int = DELETE_BATCH_SIZE) -> list[int]:
+        """Pending messages of a job (at most `batch_size`). They stay pending till `mark` is called. Empty once nothing is pending."""
+        with self._state.hold():
+            job = self._refresh().get(job_id)
+            return list(itertools.islice(job["pending"], batch_size)) if job is not None else []
+
+    def get_pending_jobs(self) -> list[str]:
+        """Ids of jobs with messages still pending, oldest first."""
+        with self._state.hold():
+            return [job_id for job_id, job in sorted(self._refresh().items(), key=lambda item: item[1]["created"]) if job["pending"]]
+
+    def mark(self, job_id: str, deleted: list[int], failed: list[int]):
+        """Records outcome of a batch (appended to journal), messages in `deleted` / `failed` are no longer pending. Failures are kept in job, for user to see."""
+        with self._state.hold():
+            jobs = self._refresh()
+            if job_id not in jobs:
+                return
+            line = json.dumps({"job": job_id, "deleted": list(deleted), "failed": list(failed)}).encode('utf8') + b"\n"
+            with open(self._journal_filepath, 'ab') as journal_file:
+                journal_file.write((b"\n" if self._journal_torn else b"") + line)  # Incomplete line left by a crash is ended first, So this one is read on it's own.
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            jobs = self._refresh()
+            if not jobs[job_id]["pending"]:
+                self._compact(jobs)
+
+    def _finish(self, jobs: dict, job: dict):
+        """Called in a transaction."""
+        job["finished"] = time.time()
+        finished = sorted((job for job in jobs.values() if job["finished"]), key=lambda job: job["finished"])
+        for old_job in finished[:max(len(finished) - self._keep_finished, 0)]:
+            jobs.pop(old_job["id"])
+
+    def discard(self, job_id: str) -> int:
+        """Drops messages still pending in a job (Ex: it was cancelled), they're left in channel. Returns how many were dropped."""
+        with self._state.hold():
+            jobs = self._refresh()
+            job = jobs.get(job_id)
+            if job is None or not job["pending"]:
+                return 0
+            dropped = len(job["pending"])
+            job["pending"] = {}
+            self._compact(jobs)
+            return dropped
+
+    def get_counts(self, job_id: str) -> dict | None:
+        """Counts of total, deleted, failed and pending messages of a job. None if there is no such job."""
+        with self._state.hold():
+            job = self._refresh().get(job_id)
+            if job is None:
+                return None
+            return {"total": job["total"], "deleted": job["deleted"], "failed": len(job["failed"]), "pending": len(job["pending"])}
@@ -0,0 +1,66 @@
+from utils.journal import write_file_atomically
+import threading
+import hashlib
+import logging
+import json
+import os
+logger = logging.getLogger()
+
+
+class HashCache:
+    """Local cache of file path -> (size, mtime, sha256), persisted as json. A file whose size & mtime didn't change since it was hashed is not read again (Ex: nightly backups of mostly unchanged folders)."""
+    def __init__(self, cache_filepath: str) -> None:
+        self._filepath = cache_filepath
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with open(self._filepath, 'r') as cache_file:
+                self._entries: dict[str, list] = json.load(cache_file)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            self._entries = {}
+
+    @staticmethod
+    def _get_key(file_path: str) -> str:
+        return os.path.abspath(file_path)
+
+    def get(self, file_path: str, stat: os.stat_result) -> str | None:
+        """Cached sha256 of file, None if file changed (or was never hashed)."""
+        with self._lock:
+            entry = self._entries.get(self._get_key(file_path))
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        return None
+
+    def put(self, file_path: str, stat: os.stat_result, sha256: str):
+        with self._lock:
+            self._entries[self._get_key(file_path)] = [stat.st_size, stat.st_mtime_ns, sha256]
+            self._dirty = True
+
+    def get_sha256(self, file_path: str) -> str:
+        """sha256 of file content (hex), from cache if file is unchanged, else file is read (in chunks) and cache is updated."""
+        stat = os.stat(file_path)
+        sha256 = self.get(file_path, stat)
+        if sha256 is None:
+            sha256 = self.hash_file(file_path)
+            self.put(file_path, stat, sha256)
+        return sha256
+
+    @staticmethod
+    def hash_file(file_path: str) -> str:
+        """sha256 of file content (hex), read in chunks so that big files are not loaded in memory."""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as local_file:
+            while chunk := local_file.read(1024 * 1024):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            content = json.dumps(self._entries).encode('utf8')
+            self._dirty = False
+        try:
+            write_file_atomically(self._filepath, content)
+        except OSError as err:
+            logger.warning(f"Unable to save hash cache to '{self._filepath}', Error: {err}")
@@ -0,0 +1,302 @@
+from contextlib import contextmanager
+from utils.journal import SharedJsonFile
+import threading
+import logging
+import queue
+import time
+import uuid
+import os
+logger = logging.getLogger()
+
+ACTIVE_STATUSES = ("queued", "running", "paused")
+FINISHED_STATUSES = ("completed", "failed", "cancelled", "interrupted")
+PROGRESS_FIELDS = ("items_total", "items_done", "bytes_total", "bytes_done", "data")
+
+
+class JobCancelled(Exception):
+    """Raised inside a job's function by `Job.checkpoint()` once the job is cancelled."""
+
+
+class Job:
+    """Handle given to a job's function. It reports progress through it, and calls `checkpoint()` between units of work, which blocks while job is paused and raises `JobCancelled` once it's cancelled.\n
+       `data` is a dict the function can keep it's own state in (Ex: how far it got), it's persisted with the job, So a resumed job can carry on from there.
+    """
+    def __init__(self, manager: "JobManager", job_id: str) -> None:
+        self._manager = manager
+        self.id = job_id
+
+    @property
+    def data(self) -> dict:
+        return self._manager._controls[self.id]["progress"]["data"]
+
+    def set_total(self, items: int = None, bytes: int = None):
+        self._manager._update(self.id, items_total=items, bytes_total=bytes)
+
+    def set_done(self, items: int = None, bytes: int = None):
+        """Work already done before this run (Ex: resumed from a checkpoint), not counted in rate."""
+        self._manager._update(self.id, items_done=items, bytes_done=bytes, reset_rate=True)
+
+    def advance(self, items: int = 1, bytes: int = 0):
+        self._manager._advance(self.id, items, bytes)
+
+    def save(self):
+        """Persists progress and `data` right away (Ex: after a step that must not be repeated)."""
+        self._manager._flush()
+
+    def checkpoint(self):
+        self._manager._checkpoint(self.id)
+
+    def sleep(self, seconds: float):
+        """Sleeps, but wakes up (and raises `JobCancelled`) if job is cancelled meanwhile."""
+        if self._manager._controls[self.id]["cancel"].wait(seconds):
+            raise JobCancelled()
+
+
+class JobManager:
+    """Runs long operations (validation, folder deletes, bulk uploads...) as jobs on a bounded pool of worker threads. Each kind of job has a function registered for it with `register()`.\n
+       Job state (status, progress counters, params, job's own `data`) is kept in a json file shared by every process using it (Ex: gunicorn workers), any of them can submit, list, pause, resume or cancel jobs.
+       Jobs are run only by the process that called `start()`, it picks up what other processes asked for by polling the file. Progress of running jobs is saved every couple of seconds.
+       Jobs unfinished when their runner stopped are queued again on next start if their kind is resumable, marked interrupted otherwise.
+       A job is submitted with an optional `key`, only one unfinished job per kind & key runs (Ex: one validation at a time).
+    """
+    def __init__(self, state_filepath: str, workers: int = 4, keep_finished: int = 100) -> None:
+        self._state = SharedJsonFile(state_filepath, {"jobs": {}})
+        self._workers = max(workers, 1)
+        self._keep_finished = keep_finished
+        self._handlers: dict[str, tuple] = {}   # kind -> (function, resumable)
+        self._controls: dict[str, dict] = {}    # Jobs this process is running -> cancel / resume events, rate marks, progress not saved yet.
+        self._queue = queue.Queue()
+        self._dispatched: set[str] = set()      # Queued jobs already put on `_queue`.
+        self._lock = threading.RLock()
+        self._saved_at = 0.0
+        self._running = False
+
+    def register(self, kind: str, handler, resumable: bool = False):
+        """`handler(job, **params)` does the work of a job of this `kind`, it's return value is saved as job's result. `resumable` kinds are queued again if they were unfinished at shutdown."""
+        self._handlers[kind] = (handler, resumable)
+
+    def start(self, poll_interval: float = 1.0):
+        """Makes this process the one running jobs, Call once every kind is registered. Only one process sharing the state file may call it (Ex: leader of gunicorn workers).
+           Unfinished jobs of previous runner are queued again (or marked interrupted).
+        """
+        with self._transaction() as jobs:
+            for job_id, job in sorted(jobs.items(), key=lambda item: item[1]["created"]):
+                if job["status"] not in ACTIVE_STATUSES:
+                    continue
+                job["runner"] = None
+                if self._handlers.get(job["kind"], (None, False))[1]:
+                    logger.info(f"Resuming {job['kind']} job {job_id} left unfinished by last run.")
+                    if job["status"] == "running":
+                        job["status"] = "queued"
+                else:
+                    job.update(status="interrupted", finished=time.time(), error="Server was restarted while job was unfinished.")
+            self._running = True
+            for job_id, job in sorted(jobs.items(), key=lambda item: item[1]["created"]):
+                if job["status"] == "queued":
+                    self._dispatch(job_id)
+        for index in range(self._workers):
+            threading.Thread(target=self._worker, name=f"job-worker-{index}", daemon=True).start()
+        threading.Thread(target=self._poll_loop, args=(poll_interval, ), daemon=True).start()
+
+    @contextmanager
+    def _transaction(self):
+        """Yields jobs (latest from disk) to be changed, they're saved with progress of jobs this process runs once block exits."""
+        with self._lock, self._state.transaction() as state:
+            jobs = state["jobs"]
+            yield jobs
+            for job_id in self._controls:
+                if job_id in jobs:
+                    jobs[job_id].update(self._get_progress(job_id))
+            self._trim_finished(jobs)
+            self._saved_at = time.monotonic()
+
+    def _trim_finished(self, jobs: dict):
+        """Drops oldest finished jobs beyond `keep_finished`."""
+        finished = sorted((job for job in jobs.values() if job["status"] in FINISHED_STATUSES), key=lambda job: job["finished"] or 0)
+        for job in finished[:max(len(finished) - self._keep_finished, 0)]:
+            jobs.pop(job["id"])
+
+    def _flush(self, throttle: bool = False):
+        """Saves progress of jobs this process runs. `throttle` skips it, if it was saved less than 2 seconds ago."""
+        if throttle and time.monotonic() - self._saved_at < 2:
+            return
+        try:
+            with self._transaction():
+                pass
+        except OSError as err:
+            logger.error(f"Unable to save job state, Error: {err}")
+
+    def submit(self, kind: str, params: dict = None, key: str = None) -> tuple[str, bool]:
+        """Queues a job, returns a tuple of (job id, True if it was queued now). If an unfinished job of same kind & `key` exists, it's id is returned instead (with False)."""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: '{kind}'")
+        with self._transaction() as jobs:
+            if key is not None:
+                for job_id, job in jobs.items():
+                    if job["kind"] == kind and job["key"] == key and job["status"] in ACTIVE_STATUSES:
+                        return job_id, False
+            job_id = uuid.uuid4().hex[:12]
+            jobs[job_id] = {"id": job_id, "kind": kind, "key": key, "params": params or {}, "status": "queued", "error": None, "result": None, "data": {}, "runner": None, "cancel_requested": False,
+                            "created": time.time(), "started": None, "finished": None, "items_total": None, "items_done": 0, "bytes_total": None, "bytes_done": 0,
+                            "items_per_second": None, "bytes_per_second": None, "eta_seconds": None}
+            self._dispatch(job_id)
+        return job_id, True
+
+    def _dispatch(self, job_id: str):
+        """Puts a queued job on queue of worker threads, if this process runs jobs. Called under lock."""
+        if self._running and job_id not in self._dispatched:
+            self._dispatched.add(job_id)
+            self._queue.put(job_id)
+
+    def _poll_loop(self, interval: float):
+        """Picks up jobs submitted, paused, resumed or cancelled by other processes."""
+        while True:
+            time.sleep(interval)
+            try:
+                with self._lock:
+                    for job_id, job in self._state.load()["jobs"].items():
+                        if job["status"] == "queued":
+                            self._dispatch(job_id)
+                        elif job_id in self._controls:
+                            self._apply_controls(job_id, job)
+            except Exception as err:
+                logger.error(f"Unable to read job state, Error: {err}")
+
+    def _apply_controls(self, job_id: str, job: dict):
+        """Sets events of a job this process runs as per it's saved state. Called under lock."""
+        controls = self._controls[job_id]
+        if job.get("cancel_requested"):
+            controls["cancel"].set()
+            controls["resume"].set()
+        elif job["status"] == "paused" and controls["resume"].is_set():
+            controls["resume"].clear()
+            controls["paused_at"] = time.monotonic()
+        elif job["status"] == "running" and not controls["resume"].is_set():
+            if controls.get("paused_at"):   # Time spent paused doesn't count towards rate.
+                started, items, bytes_done = controls["marks"]
+                controls["marks"] = (started + time.monotonic() - controls.pop("paused_at"), items, bytes_done)
+            controls["resume"].set()
+
+    def _worker(self):
+        while True:
+            job_id = self._queue.get()
+            with self._transaction() as jobs:
+                self._dispatched.discard(job_id)
+                job = jobs.get(job_id)
+                if job is None or job["status"] != "queued":    # Cancelled / paused while it was waiting.
+                    continue
+                job.update(status="running", started=job["started"] or time.time(), runner=os.getpid())
+                resume = threading.Event()
+                resume.set()
+                self._controls[job_id] = {"cancel": threading.Event(), "resume": resume, "marks": (time.monotonic(), job["items_done"], job["bytes_done"]),
+                                          "progress": {field: job[field] for field in PROGRESS_FIELDS}}
+                kind, params = job["kind"], dict(job["params"])
+            handler, _ = self._handlers[kind]
+            try:
+                result = handler(Job(self, job_id), **params)
+                status, error = "completed", None
+            except JobCancelled:
+                result, status, error = None, "cancelled", None
+            except Exception as err:
+                logger.error(f"{kind} job {job_id} failed, Error: {err}")
+                result, status, error = None, "failed", str(err)
+            with self._transaction() as jobs:
+                if job_id in jobs:
+                    jobs[job_id].update(self._get_progress(job_id))
+                    jobs[job_id].update(status=status, error=error, result=result, finished=time.time(), runner=None, items_per_second=None, bytes_per_second=None, eta_seconds=None)
+                self._controls.pop(job_id)
+            logger.info(f"{kind} job {job_id} {status}.")
+
+    def _get_progress(self, job_id: str) -> dict:
+        """Progress of a job this process runs, with rate (per second, for current run) and ETA in seconds if they can be known. Called under lock."""
+        controls = self._controls[job_id]
+        progress = dict(controls["progress"])
+        rate_items = rate_bytes = eta = None
+        if controls["resume"].is_set():
+            started, items, bytes_done = controls["marks"]
+            elapsed = max(time.monotonic() - started, 1e-6)
+            rate_items, rate_bytes = (progress["items_done"] - items) / elapsed, (progress["bytes_done"] - bytes_done) / elapsed
+            if progress["bytes_total"] and rate_bytes > 0:
+                eta = (progress["bytes_total"] - progress["bytes_done"]) / rate_bytes
+            elif progress["items_total"] and rate_items > 0:
+                eta = (progress["items_total"] - progress["items_done"]) / rate_items
+        progress.update(items_per_second=rate_items and round(rate_items, 2), bytes_per_second=rate_bytes and round(rate_bytes), eta_seconds=eta and round(max(eta, 0), 1))
+        return progress
+
+    def _update(self, job_id: str, reset_rate: bool = False, **counters):
+        with self._lock:
+            controls = self._controls[job_id]
+            controls["progress"].update({name: value for name, value in counters.items() if value is not None})
+            if reset_rate:
+                controls["marks"] = (time.monotonic(), controls["progress"]["items_done"], controls["progress"]["bytes_done"])
+        self._flush(throttle=True)
+
+    def _advance(self, job_id: str, items: int, bytes: int):
+        with self._lock:
+            progress = self._controls[job_id]["progress"]
+            progress["items_done"] += items
+            progress["bytes_done"] += bytes
+        self._flush(throttle=True)
+
+    def _checkpoint(self, job_id: str):
+        controls = self._controls[job_id]
+        while not controls["resume"].wait(timeout=1):
+            if controls["cancel"].is_set():
+                break
+        if controls["cancel"].is_set():
+            raise JobCancelled()
+
+    def cancel(self, job_id: str) -> tuple[bool, str | None]:
+        """Cancels a queued / running / paused job. A running job stops at it's next checkpoint."""
+        with self._transaction() as jobs:
+            job = jobs.get(job_id)
+            if job is None or job["status"] not in ACTIVE_STATUSES:
+                return False, "No such job, or it has already finished."
+            if job["runner"] is None:   # Not being run, nothing to stop.
+                job.update(status="cancelled", finished=time.time())
+            else:
+                job["cancel_requested"] = True
+                if job_id in self._controls:
+                    self._apply_controls(job_id, job)
+        return True, None
+
+    def pause(self, job_id: str) -> tuple[bool, str | None]:
+        """Pauses a job, a running job pauses at it's next checkpoint. A queued job is not started till it's resumed."""
+        with self._transaction() as jobs:
+            job = jobs.get(job_id)
+            if job is None or job["status"] not in ("queued", "running"):
+                return False, "Only a queued or running job can be paused."
+            job["status"] = "paused"
+            if job_id in self._controls:
+                self._apply_controls(job_id, job)
+        return True, None
+
+    def resume(self, job_id: str) -> tuple[bool, str | None]:
+        with self._transaction() as jobs:
+            job = jobs.get(job_id)
+            if job is None or job["status"] != "paused":
+                return False, "Only a paused job can be resumed."
+            job["status"] = "queued" if job["runner"] is None else "running"
+            if job["status"] == "queued":
+                self._dispatch(job_id)
+            elif job_id in self._controls:
+                self._apply_controls(job_id, job)
+        return True, None
+
+    def _get_view(self, job: dict) -> dict:
+        """Public state of a job. Progress is current if this process runs it, as of it's last save (a couple of seconds old at most) otherwise. Called under lock."""
+        view = {key: value for key, value in job.items() if key not in ("runner", "cancel_requested")}
+        if job["id"] in self._controls:
+            view.update(self._get_progress(job["id"]))
+        return view
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            job = self._state.load()["jobs"].get(job_id)
+            return self._get_view(job) if job is not None else None
+
+    def list(self, kind: str = None) -> list[dict]:
+        """Jobs (optionally only of a `kind`), newest first."""
+        with self._lock:
+            jobs = sorted((job for job in self._state.load()["jobs"].values() if kind is None or job["kind"] == kind), key=lambda job: job["created"], reverse=True)
+            return [self._get_view(job) for job in jobs]
@@ -0,0 +1,257 @@
+from contextlib import contextmanager
+from utils.locks import InterProcessLock
+import threading
+import logging
+import json
+import os
+logger = logging.getLogger()
+
+
+class SchemaJournal:
+    """Append-only write ahead log of schema operations, one json line per operation, each with an increasing `seq` number.\n
+       Each entry is written to file as it's appended, fsync-s are done by a single writer thread for everything written meanwhile (group commit), So a bulk upload costs one fsync per batch, not a full schema dump per file.
+       Snapshot of schema records the `seq` it includes, journal entries before that `seq` are dropped with `compact()`. At startup, entries after snapshot's `seq` are replayed on top of it.
+       Several processes can share a journal (Ex: gunicorn workers): `read_new()` returns entries other processes appended since. Appends and compaction must then be done under a lock held across processes, after `read_new()`.
+    """
+    def __init__(self, journal_filepath: str, start_seq: int = 0, compact_after: int = 1000) -> None:
+        self._filepath = journal_filepath
+        self._entries = self._recover()     # Entries found on disk at startup, for replay.
+        self._last_seq = max([start_seq] + [entry["seq"] for entry in self._entries])  # Last seq written (by any process).
+        self._written_seq = self._last_seq  # Last seq this process wrote.
+        self._committed_seq = self._last_seq    # Last seq that is durable on disk.
+        self._error: Exception | None = None    # Set if a write failed, until next compaction. Appends fail meanwhile, so callers fall back to a full snapshot.
+        self._cond = threading.Condition()
+        self._file_lock = threading.Lock()
+        self._fd = os.open(self._filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._inode = os.fstat(self._fd).st_ino
+        self._compact_after = compact_after
+        self.entries_since_snapshot = len(self._entries)
+        self.compaction_due = threading.Event()     # Set once `compact_after` entries pile up, background compaction waits on this.
+        threading.Thread(target=self._write_loop, daemon=True).start()
+
+    def _recover(self) -> list[dict]:
+        """Reads all entries in journal. A torn last line (crash in middle of a write) is cut off, so that new entries are not appended after garbage."""
+        entries, good_length = [], 0
+        try:
+            with open(self._filepath, 'rb') as journal_file:
+                for line in journal_file:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        entries.append(json.loads(line))
+                    except json.decoder.JSONDecodeError:
+                        break
+                    good_length += len(line)
+                torn = journal_file.seek(0, os.SEEK_END) > good_length
+        except FileNotFoundError:
+            self._read_offset = 0
+            return entries
+        if torn:
+            logger.warning(f"Schema journal '{self._filepath}' has an incomplete last entry (interrupted write), dropping it.")
+            with open(self._filepath, 'r+b') as journal_file:
+                journal_file.truncate(good_length)
+        self._read_offset = good_length     # Bytes of journal file this process has seen.
+        return entries
+
+    @property
+    def last_seq(self) -> int:
+        return self._last_seq
+
+    def replay(self, after_seq: int):
+        """Entries found on disk at startup that are newer than `after_seq` (seq of snapshot), in the order they were written."""
+        return [entry for entry in self._entries if entry["seq"] > after_seq]
+
+    def has_changes(self) -> bool:
+        """If another process appended to (or compacted) journal since this process last read / wrote it. Just a `stat`, cheap enough to call before every read."""
+        try:
+            stat = os.stat(self._filepath)
+        except FileNotFoundError:
+            return False
+        return stat.st_ino != self._inode or stat.st_size != self._read_offset
+
+    def read_new(self) -> list[dict] | None:
+        """Entries other processes appended since this process last read / wrote journal. \n
+           None if some of them are gone, journal was compacted by another process meanwhile. Reload snapshot then, call `skip_to(snapshot's seq)` and `read_new()` again.
+        """
+        with self._file_lock:
+            with open(self._filepath, 'rb') as journal_file:
+                inode = os.fstat(journal_file.fileno()).st_ino
+                if inode != self._inode:    # Compacted, replaced by a new file. Entries this process hasn't seen are either in it, or in snapshot.
+                    os.close(self._fd)
+                    self._fd = os.open(self._filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                    self._inode, self._read_offset = inode, 0
+                journal_file.seek(self._read_offset)
+                entries = []
+                for line in journal_file:
+                    if not line.endswith(b"\n"):   # Still being written.
+                        break
+                    self._read_offset += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except json.decoder.JSONDecodeError:    # Remains of a write cut short by a crash.
+                        continue
+                    if entry["seq"] > self._last_seq:
+                        entries.append(entry)
+            if entries and entries[0]["seq"] != self._last_seq + 1:
+                self._read_offset = 0   # Read again from start after `skip_to`.
+                return None
+        with self._cond:
+            if entries:
+                self._last_seq = entries[-1]["seq"]
+            self.entries_since_snapshot += len(entries)
+        return entries
+
+    def skip_to(self, seq: int):
+        """Entries up to `seq` are not returned by `read_new()` (Ex: they're in a snapshot that was loaded)."""
+        with self._cond:
+            self._last_seq = max(self._last_seq, seq)
+            self._committed_seq = max(self._committed_seq, seq)
+
+    def append(self, entry: dict) -> int:
+        """Writes an operation to journal, returns it's seq. Call this in the same order as operations are applied to schema (under schema lock), and `wait(seq)` outside of it."""
+        with self._cond:
+            if self._error is not None:
+                raise OSError(f"Schema journal is not writable: {self._error}")
+            seq = self._last_seq + 1
+            try:
+                with self._file_lock:
+                    os.write(self._fd, (json.dumps({"seq": seq, **entry}) + "\n").encode('utf8'))
+                    self._read_offset = os.lseek(self._fd, 0, os.SEEK_END)  # Nobody else appends meanwhile, see class doc.
+            except OSError as err:
+                logger.error(f"Unable to write to schema journal, Error: {err}")
+                self._error = err
+                raise
+            self._last_seq = self._written_seq = seq
+            self.entries_since_snapshot += 1
+            self._cond.notify_all()
+            if self.entries_since_snapshot >= self._compact_after:
+                self.compaction_due.set()
+            return seq
+
+    def wait(self, seq: int):
+        """Blocks until entry with `seq` is on disk. Raises OSError if it couldn't be written."""
+        with self._cond:
+            while self._committed_seq < seq and self._error is None:
+                self._cond.wait()
+            if self._committed_seq < seq:
+                raise OSError(f"Schema journal write failed: {self._error}")
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while self._written_seq <= self._committed_seq:
+                    self._cond.wait()
+                written_seq = self._written_seq     # Everything written while previous fsync was on goes in one fsync.
+            try:
+                with self._file_lock:
+                    os.fsync(self._fd)
+                with self._cond:
+                    self._committed_seq = max(self._committed_seq, written_seq)
+                    self._cond.notify_all()
+            except Exception as err:
+                logger.error(f"Unable to fsync schema journal, Error: {err}")
+                with self._cond:
+                    self._error = err
+                    self._cond.notify_all()
+
+    def compact(self, snapshot_seq: int):
+        """Drops entries before `snapshot_seq`, call this once a snapshot holding them is safely on disk. Entries from snapshot's seq on are kept, journal is swapped atomically.\n
+           (Entry at snapshot's seq is kept, So another process reading new journal can tell if it missed entries that were dropped.)
+        """
+        with self._file_lock:
+            kept = []
+            with open(self._filepath, 'rb') as journal_file:
+                for line in journal_file:
+                    try:
+                        if json.loads(line)["seq"] >= snapshot_seq:
+                            kept.append(line)
+                    except (json.decoder.JSONDecodeError, KeyError):
+                        continue
+            write_file_atomically(self._filepath, b"".join(kept))
+            os.close(self._fd)
+            self._fd = os.open(self._filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._inode, self._read_offset = os.fstat(self._fd).st_ino, sum(len(line) for line in kept)
+        with self._cond:
+            self._error = None  # Snapshot holds everything that failed to be written, journal is usable again.
+            self._committed_seq = max(self._committed_seq, snapshot_seq)
+            self._written_seq = max(self._written_seq, self._committed_seq)
+            self.entries_since_snapshot = max(len(kept) - 1, 0)
+            self._entries = []
+            self.compaction_due.clear()
+            self._cond.notify_all()
+
+
+class SharedJsonFile:
+    """Json state file that several processes (Ex: gunicorn workers) read and change. Changes are made in `transaction()`: under a lock held across processes,\n
+       on latest content from disk, written back atomically at the end. `load()` reads file again only if it changed since it was last read (`stat`), So polling it is cheap.
+    """
+    def __init__(self, filepath: str, default: dict) -> None:
+        self._filepath = filepath
+        self._default = default
+        self._signature = None
+        self._lock = threading.RLock()
+        self._process_lock = InterProcessLock(filepath + ".lock")
+        self.data: dict = json.loads(json.dumps(default))
+
+    def _get_signature(self):
+        try:
+            stat = os.stat(self._filepath)
+            return stat.st_ino, stat.st_size, stat.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load(self) -> dict:
+        """Latest content, same dict object till file is changed (Don't change it, see `transaction()`)."""
+        with self._lock:
+            signature = self._get_signature()
+            if signature != self._signature:
+                try:
+                    with open(self._filepath, 'r') as state_file:
+                        self.data = {**json.loads(json.dumps(self._default)), **json.load(state_file)}
+                except (FileNotFoundError, json.decoder.JSONDecodeError):
+                    self.data = json.loads(json.dumps(self._default))
+                self._signature = signature
+            return self.data
+
+    @contextmanager
+    def hold(self):
+        """Holds file's lock (across processes) without changing it, Ex: to keep a side file in step with it. `transaction()` can be used within."""
+        with self._lock, self._process_lock.hold():
+            yield
+
+    @contextmanager
+    def transaction(self):
+        """Yields a copy of latest content to be changed, it's written to disk when block exits (unless it raises). Dicts returned by `load()` are never changed in place, So they can be read without a lock."""
+        with self._lock, self._process_lock.hold():
+            data = json.loads(json.dumps(self.load()))
+            yield data
+            try:
+                write_file_atomically(self._filepath, json.dumps(data).encode('utf8'))
+                self.data, self._signature = data, self._get_signature()
+            except OSError as err:
+                logger.error(f"Unable to save '{self._filepath}', Error: {err}")
+
+
+def fsync_directory(file_path: str):
+    """fsync the directory of file_path, So that a rename / creation of file in it survives a crash."""
+    try:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(file_path)), os.O_RDONLY)
+    except OSError:
+        return  # Not supported (Ex: windows), rename is still atomic.
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def write_file_atomically(file_path: str, content: bytes):
+    """Writes content to a temp file next to file_path, fsync-s it and renames it over file_path. Readers (and a crash) see either old or new file, never a partial one."""
+    tmp_filepath = file_path + ".tmp"
+    with open(tmp_filepath, 'wb') as tmp_file:
+        tmp_file.write(content)
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+    os.replace(tmp_filepath, file_path)
+    fsync_directory(file_path)
@@ -0,0 +1,128 @@
+from contextlib import contextmanager
+import threading
+import os
+try:
+    import fcntl
+except ImportError:     # Windows.
+    fcntl = None
+
+
+class ReadWriteLock:
+    """Lets many readers in at once, or a single writer. Waiting writers are let in first, so a steady stream of readers can't starve them.\n
+       The thread holding write lock can take read / write lock again (Ex: a write operation calling a read helper). Read lock must not be taken again by a reader.
+    """
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer: int | None = None     # Thread ident of writer.
+        self._write_depth = 0
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        if self._writer == threading.get_ident():   # Writer reading it's own changes.
+            yield
+            return
+        with self._cond:
+            while self._writer is not None or self._waiting_writers > 0:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+            else:
+                self._waiting_writers += 1
+                while self._writer is not None or self._readers > 0:
+                    self._cond.wait()
+                self._waiting_writers -= 1
+                self._writer, self._write_depth = me, 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+class InterProcessLock:
+    """Exclusive lock held across processes (Ex: gunicorn workers sharing schema folder), an `flock` on a lock file. Threads of a process take turns on it too, it's re-entrant for a thread.\n
+       Where `flock` isn't available (Ex: windows), it only locks between threads of this process.
+    """
+    def __init__(self, lock_filepath: str) -> None:
+        self._filepath = lock_filepath
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def _flock(self, blocking: bool = True) -> bool:
+        if fcntl is None:
+            return True
+        if self._fd is None:
+            self._fd = os.open(self._filepath, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    @contextmanager
+    def hold(self):
+        with self._thread_lock:
+            if self._depth == 0:
+                self._flock()
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0 and fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def try_acquire(self, blocking: bool = False) -> bool:
+        """Takes lock for rest of this process's life (Ex: leader election), it's released when process exits. False if another process holds it (and not `blocking`).\n
+           A lock taken this way is not to be used with `hold()`.
+        """
+        return self._flock(blocking)
+
+
+class SharedReadWriteLock(ReadWriteLock):
+    """ReadWriteLock over state that other processes change too, through files (Ex: schema journal). Write lock is held across processes as well (`process_lock`),\n
+       and before a read / write lock is given, `apply_changes()` brings state up to date with what other processes wrote, if `has_changes()` says there is something new.
+    """
+    def __init__(self, process_lock: InterProcessLock, has_changes, apply_changes) -> None:
+        super().__init__()
+        self.process_lock = process_lock
+        self._has_changes = has_changes
+        self._apply_changes = apply_changes
+
+    @contextmanager
+    def read(self):
+        if self._writer != threading.get_ident() and self._has_changes():
+            with self.process_lock.hold(), super().write():
+                self._apply_changes()
+        with super().read():
+            yield
+
+    @contextmanager
+    def write(self):
+        if self._writer == threading.get_ident():
+            with super().write():
+                yield
+            return
+        with self.process_lock.hold(), super().write():
+            if self._has_changes():
+                self._apply_changes()
+            yield
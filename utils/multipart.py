@@ -0,0 +1,74 @@
+from telegram import Message
+import logging
+import uuid
+import io
+import os
+try:
+    # Same urllib3 that python-telegram-bot sends it's requests with.
+    from telegram.vendor.ptb_urllib3.urllib3.fields import RequestField
+    from telegram.vendor.ptb_urllib3.urllib3.util.timeout import Timeout
+except ImportError:
+    from urllib3.fields import RequestField
+    from urllib3.util.timeout import Timeout
+logger = logging.getLogger()
+
+
+class MultipartBody:
+    """Read only, seekable file like multipart/form-data body, with a file field whose content is read from a seekable file object as the body is sent (never held in memory as a whole).\n
+       Size is known upfront (sent as Content-Length), body can be rewound with `seek(0)` for a retry.
+    """
+    def __init__(self, fields: dict, file_field: str, file_name: str, file_obj, content_type: str = "application/octet-stream") -> None:
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        head = io.BytesIO()
+        for name, value in fields.items():
+            field = RequestField(name=name, data=str(value))
+            field.make_multipart()
+            head.write(f"--{self.boundary}\r\n".encode('latin-1') + field.render_headers().encode('utf8') + str(value).encode('utf8') + b"\r\n")
+        field = RequestField(name=file_field, data=b"", filename=file_name)
+        field.make_multipart(content_type=content_type)
+        head.write(f"--{self.boundary}\r\n".encode('latin-1') + field.render_headers().encode('utf8'))
+        file_obj.seek(0, os.SEEK_END)
+        file_size = file_obj.tell()
+        self._pieces = [(head.getvalue(), None), (file_obj, file_size), (f"\r\n--{self.boundary}--\r\n".encode('latin-1'), None)]    # (bytes or file object, size of file object)
+        self.size = sum(len(piece) if piece_size is None else piece_size for piece, piece_size in self._pieces)
+        self._position = 0
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        self._position = max(0, min({os.SEEK_SET: 0, os.SEEK_CUR: self._position, os.SEEK_END: self.size}[whence] + offset, self.size))
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        """Reads from the piece current position falls in, So a read never returns more than one piece (`http.client` reads till it gets b"")."""
+        size = self.size - self._position if size is None or size < 0 else size
+        piece_start = 0
+        for piece, piece_size in self._pieces:
+            piece_end = piece_start + (len(piece) if piece_size is None else piece_size)
+            if self._position < piece_end:
+                offset, length = self._position - piece_start, min(size, piece_end - self._position)
+                if piece_size is None:
+                    data = piece[offset:offset + length]
+                else:
+                    piece.seek(offset)
+                    data = piece.read(length)
+                self._position += len(data)
+                return data
+            piece_start = piece_end
+        return b""
+
+
+def send_document_stream(bot, chat_id, document, filename: str, caption: str = None, timeout: float = 60) -> Message:
+    """`sendDocument` that streams `document` (a seekable file object, Ex: a spooled temp file) into request body, instead of building whole multipart body in memory like `bot.send_document` does.\n
+       Goes through bot's own connection pool, So errors are same telegram errors (`RetryAfter`, `TimedOut`, `BadRequest`...) `bot.send_document` raises. Returns the sent message.
+    """
+    fields = {"chat_id": chat_id}
+    if caption is not None:
+        fields["caption"] = caption
+    body = MultipartBody(fields, "document", filename, document)
+    request = bot.request
+    data = request._request_wrapper('POST', f"{bot.base_url}/sendDocument", body=body, headers={"Content-Type": body.content_type, "Content-Length": str(body.size)},
+                                    timeout=Timeout(read=timeout, connect=request._connect_timeout))
+    return Message.de_json(request._parse(data), bot)
@@ -0,0 +1,202 @@
+from contextlib import contextmanager
+from telegram import error as telegram_error
+import itertools
+import threading
+import asyncio
+import logging
+import random
+import time
+logger = logging.getLogger()
+
+## Priority lanes, lower goes first.
+INTERACTIVE = 0     # Things a user is waiting on in UI (downloads, single uploads, deletes).
+BACKGROUND = 1      # Bulk jobs (validation, CLI backups), they get what interactive calls leave.
+## Method classes, each has it's own rate limit.
+METHOD_CLASSES = {
+    "send_document": "send", "send_document_stream": "send", "copy_message": "send",
+    "delete_message": "delete", "delete_messages": "delete",
+}   # Anything else (get_file, get_chat_member_count, ...) is "read".
+
+
+class TokenBucket:
+    """Thread safe token bucket. Allows `rate` acquisitions per second on average, with bursts of up to `burst`. `acquire()` blocks until a token is available."""
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self._rate = rate
+        self._burst = max(burst, 1)
+        self._tokens = float(self._burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0     # Set when telegram asks to back off (flood control), no tokens are handed out until then.
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def time_until_available(self, now: float) -> float:
+        """Seconds until a token can be taken, 0 if one is available now."""
+        if self._rate <= 0:     # No limit.
+            return max(0.0, self._blocked_until - now)
+        with self._lock:
+            self._refill(now)
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self._rate
+            return max(wait, self._blocked_until - now)
+
+    def take(self, now: float):
+        if self._rate <= 0:
+            return
+        with self._lock:
+            self._refill(now)
+            self._tokens -= 1
+
+    def block(self, seconds: float):
+        """No tokens for next `seconds` (telegram's retry_after)."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def acquire(self):
+        while True:
+            now = time.monotonic()
+            wait = self.time_until_available(now)
+            if wait <= 0:
+                self.take(now)
+                return
+            time.sleep(wait)
+
+
+class ApiScheduler:
+    """Single gate for all Bot API calls of a bot. Every call takes a token from global bucket, it's method class bucket, and (for sends) bucket of target chat.\n
+       Waiting calls are served by priority lane first, then in arrival order. A call only waits behind calls that need one of the same buckets, So a throttled chat doesn't hold up downloads.
+       `RetryAfter` from telegram blocks the buckets of that call for exactly `retry_after` seconds. Time outs / network errors are retried with jittered exponential backoff.
+       Coroutine methods (Ex: of `AsyncBotApi`) are called with `call_async`, they share buckets with sync calls, So both together stay within limits.
+    """
+    def __init__(self, global_rate: float = 30, class_rates: dict[str, float] = None, chat_rate: float = 1, chat_burst: int = 5, max_retries: int = 5, backoff_base: float = 0.5, backoff_cap: float = 30) -> None:
+        class_rates = {"send": 20, "delete": 20, "read": 30, **(class_rates or {})}
+        self._global = TokenBucket(global_rate, burst=max(int(global_rate), 1))
+        self._classes = {name: TokenBucket(rate, burst=max(int(rate), 1)) for name, rate in class_rates.items()}
+        self._chat_rate, self._chat_burst = chat_rate, chat_burst
+        self._chats: dict[str, TokenBucket] = {}
+        self._max_retries = max_retries
+        self._backoff_base, self._backoff_cap = backoff_base, backoff_cap
+        self._cond = threading.Condition()
+        self._waiting: list[tuple[int, int, tuple]] = []    # (priority, arrival, buckets) of calls waiting for tokens.
+        self._arrivals = itertools.count()
+        self._local = threading.local()
+        self.stats = {"calls": 0, "retries": 0, "flood_waits": 0, "flood_wait_seconds": 0.0}
+
+    @contextmanager
+    def lane(self, priority: int):
+        """Calls made by current thread inside this block use given priority lane. Ex: `with scheduler.lane(BACKGROUND): ...`"""
+        previous = getattr(self._local, "priority", INTERACTIVE)
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def current_lane(self) -> int:
+        """Lane of current thread, pass it on to worker threads with `lane()`."""
+        return getattr(self._local, "priority", INTERACTIVE)
+
+    def _get_buckets(self, method_name: str, chat_id) -> tuple[TokenBucket, ...]:
+        method_class = METHOD_CLASSES.get(method_name, "read")
+        buckets = [self._global, self._classes[method_class]]
+        if method_class == "send" and chat_id:
+            with self._cond:
+                if str(chat_id) not in self._chats:
+                    self._chats[str(chat_id)] = TokenBucket(self._chat_rate, burst=self._chat_burst)
+                buckets.append(self._chats[str(chat_id)])
+        return tuple(buckets)
+
+    def _acquire(self, buckets: tuple, priority: int):
+        with self._cond:
+            ticket = (priority, next(self._arrivals), buckets)
+            self._waiting.append(ticket)
+            try:
+                while True:
+                    ahead = any(other[:2] < ticket[:2] and any(bucket in other[2][1:] for bucket in buckets[1:]) for other in self._waiting)
+                    if ahead:   # Someone with higher priority (or earlier, in same lane) needs same method class / chat bucket. Global bucket is shared by all, not considered here.
+                        self._cond.wait()
+                        continue
+                    now = time.monotonic()
+                    wait = max(bucket.time_until_available(now) for bucket in buckets)
+                    if wait <= 0:
+                        for bucket in buckets:
+                            bucket.take(now)
+                        self.stats["calls"] += 1
+                        return
+                    self._cond.wait(timeout=wait)
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+
+    def _try_acquire(self, buckets: tuple, priority: int) -> float:
+        """Takes tokens of `buckets` if they're available and no waiting call of same or higher priority needs them, returns 0 then. Else seconds to wait before trying again."""
+        with self._cond:
+            if any(other[0] <= priority and any(bucket in other[2][1:] for bucket in buckets[1:]) for other in self._waiting):
+                return 0.05     # Waiting sync calls are woken up as tokens free up, async callers poll.
+            now = time.monotonic()
+            wait = max(bucket.time_until_available(now) for bucket in buckets)
+            if wait > 0:
+                return wait
+            for bucket in buckets:
+                bucket.take(now)
+            self.stats["calls"] += 1
+            return 0
+
+    def _get_backoff(self, attempt: int) -> float:
+        """Full jitter, So that many workers failing together don't retry together."""
+        return random.uniform(0, min(self._backoff_cap, self._backoff_base * 2 ** attempt))
+
+    def _count(self, stat: str, value: float = 1):
+        with self._cond:
+            self.stats[stat] += value
+
+    def call(self, method, *args, priority: int = None, retry_timeouts: bool = True, **kwargs):
+        """Calls a bot method (Ex: `bot.get_file`) once rate limits allow it. `chat_id` keyword argument is used for per chat limits of sends.\n
+           `retry_timeouts=False` for calls that are not safe to repeat if telegram may have acted on them (Ex: a send that timed out may have been delivered).
+        """
+        priority = self.current_lane() if priority is None else priority
+        buckets = self._get_buckets(getattr(method, "__name__", ""), kwargs.get("chat_id"))
+        attempt = 0
+        while True:
+            self._acquire(buckets, priority)
+            try:
+                return method(*args, **kwargs)
+            except telegram_error.TelegramError as err:
+                delay, is_retry = self._get_retry_delay(err, method, buckets, attempt, retry_timeouts)
+                attempt += is_retry
+                time.sleep(delay)
+
+    async def call_async(self, method, *args, priority: int = INTERACTIVE, retry_timeouts: bool = True, **kwargs):
+        """`call()` for coroutine methods, waits for tokens / backoff without blocking event loop. Lanes are per thread, async callers pass `priority` instead."""
+        buckets = self._get_buckets(getattr(method, "__name__", ""), kwargs.get("chat_id"))
+        attempt = 0
+        while True:
+            while (wait := self._try_acquire(buckets, priority)) > 0:
+                await asyncio.sleep(wait)
+            try:
+                return await method(*args, **kwargs)
+            except telegram_error.TelegramError as err:
+                delay, is_retry = self._get_retry_delay(err, method, buckets, attempt, retry_timeouts)
+                attempt += is_retry
+                await asyncio.sleep(delay)
+
+    def _get_retry_delay(self, err: Exception, method, buckets: tuple, attempt: int, retry_timeouts: bool) -> tuple[float, bool]:
+        """Decides if a failed call is retried, returns a tuple of (seconds to wait before retrying, True if it counts as a retry). Raises `err` if call isn't to be retried."""
+        if isinstance(err, telegram_error.RetryAfter):  # Flood control, wait exactly as long as telegram asked to.
+            logger.warning(f"Flood control on {getattr(method, '__name__', method)}, no calls for {err.retry_after} seconds.")
+            self._count("flood_waits")
+            self._count("flood_wait_seconds", err.retry_after)
+            for bucket in buckets[1:]:  # Method class & chat are blocked, global bucket is left alone, so that other kind of calls go on.
+                bucket.block(err.retry_after)
+            with self._cond:
+                self._cond.notify_all()
+            return 0, False
+        if isinstance(err, (telegram_error.BadRequest, telegram_error.Unauthorized, telegram_error.ChatMigrated, telegram_error.InvalidToken)):
+            raise err   # Not transient, no point in retrying.
+        if isinstance(err, telegram_error.TimedOut) and not retry_timeouts:
+            raise err
+        if not isinstance(err, telegram_error.NetworkError) or attempt >= self._max_retries:
+            raise err
+        self._count("retries")
+        return self._get_backoff(attempt + 1), True
@@ -0,0 +1,121 @@
+from array import array
+import threading
+import logging
+logger = logging.getLogger()
+
+START_MARKER = "\x02"   # Names are indexed with two of these in front, so that prefix of any length (even 1 char) maps to a trigram.
+
+
+class SearchIndex:
+    """Trigram inverted index over file names and folder paths in schema, for fast substring / prefix search.\n
+       Each indexed item (document) gets an increasing integer id, each trigram of it's lower cased name maps to an array of ids (postings) in which it occurs.
+       A query only scans postings of it's rarest trigram, and verifies those candidates. Removed documents are left as tombstones, and cleared when they pile up.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self._docs: list[tuple | None] = []   # doc_id -> (kind, lower cased name, folder path, item). None once removed.
+        self._postings: dict[str, array] = {}
+        self._by_extension: dict[str, array] = {}
+        self._file_doc_ids: dict[int, int] = {}     # id() of record -> doc_id
+        self._folder_doc_ids: dict[str, int] = {}   # folder path -> doc_id
+        self._removed = 0
+
+    @staticmethod
+    def _trigrams(text: str, anchored: bool = True) -> set[str]:
+        """Trigrams of text. `anchored` ones include trigrams with start marker, that only match at the start of a name."""
+        if anchored:
+            text = START_MARKER * 2 + text
+        return {text[pos:pos + 3] for pos in range(len(text) - 2)}
+
+    @staticmethod
+    def get_extension(file_name: str) -> str:
+        return file_name.rsplit(".", 1)[-1].lower() if "." in file_name else ""
+
+    def _add(self, kind: str, name: str, path_key: str, item) -> int:
+        doc_id = len(self._docs)
+        name = name.lower()
+        self._docs.append((kind, name, path_key, item))
+        for trigram in self._trigrams(name):
+            self._postings.setdefault(trigram, array("I")).append(doc_id)
+        if kind == "file":
+            self._by_extension.setdefault(self.get_extension(name), array("I")).append(doc_id)
+        return doc_id
+
+    def _remove(self, doc_id: int | None):
+        if doc_id is None:
+            return
+        self._docs[doc_id] = None
+        self._removed += 1
+        if self._removed > 1000 and self._removed > len(self._docs) // 2:    # Mostly tombstones, rebuild.
+            self._compact()
+
+    def _compact(self):
+        docs = [doc for doc in self._docs if doc is not None]
+        logger.debug(f"Compacting search index, dropping {self._removed} removed entries.")
+        self._clear()
+        for kind, _, path_key, item in docs:
+            if kind == "file":
+                self._file_doc_ids[id(item)] = self._add(kind, item["filename"], path_key, item)
+            else:
+                self._folder_doc_ids[item] = self._add(kind, item, path_key, item)
+
+    def add_file(self, record: dict, path_key: str):
+        with self._lock:
+            if "filename" in record and id(record) not in self._file_doc_ids:
+                self._file_doc_ids[id(record)] = self._add("file", record["filename"], path_key, record)
+
+    def remove_file(self, record: dict):
+        with self._lock:
+            self._remove(self._file_doc_ids.pop(id(record), None))
+
+    def add_folder(self, path_key: str):
+        """Folders are searched by their full path. Ex: "bkp/photos" is found by "photos" as well as "bkp/ph"."""
+        with self._lock:
+            if path_key and path_key not in self._folder_doc_ids:
+                self._folder_doc_ids[path_key] = self._add("folder", path_key, path_key.rsplit("/", 1)[0] if "/" in path_key else "", path_key)
+
+    def remove_folder(self, path_key: str):
+        with self._lock:
+            self._remove(self._folder_doc_ids.pop(path_key, None))
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def search(self, text: str = "", prefix: bool = False, extension: str = None, path: str = None, kind: str = "file", limit: int = 50, offset: int = 0):
+        """Finds files (`kind="file"`) or folders (`kind="folder"`) whose name contains `text` (or starts with it, if `prefix`). \n
+           `extension` limits results to files with that extension (Ex: "pdf"), `path` limits results to that folder and it's sub folders.
+           Returns a tuple of (results, has_more). results is a list of (record, folder_path) for files, (folder_path, parent_folder_path) for folders, in the order they were added.
+        """
+        text = text.lower()
+        extension = extension.lower().lstrip(".") if extension else None
+        path = path.strip("/") if path else ""
+        with self._lock:
+            candidate_lists = []
+            if text:
+                for trigram in self._trigrams(text, anchored=prefix):
+                    candidate_lists.append(self._postings.get(trigram, array("I")))
+            if extension is not None and kind == "file":
+                candidate_lists.append(self._by_extension.get(extension, array("I")))
+            candidates = min(candidate_lists, key=len) if candidate_lists else range(len(self._docs))   # Rarest trigram, Too short query (< 3 chars) scans everything.
+            results = []
+            for doc_id in candidates:
+                doc = self._docs[doc_id]
+                if doc is None or doc[0] != kind:
+                    continue
+                _, name, doc_path, item = doc
+                if prefix and not name.startswith(text):
+                    continue
+                if not prefix and text not in name:
+                    continue
+                if extension is not None and self.get_extension(name) != extension:
+                    continue
+                if path and not (doc_path == path or doc_path.startswith(path + "/")):
+                    continue
+                results.append((item, doc_path))
+                if len(results) > offset + limit:   # One extra, to know if there are more results.
+                    break
+            return results[offset:offset + limit], len(results) > offset + limit
@@ -0,0 +1,98 @@
+import threading
+import sqlite3
+import logging
+import time
+logger = logging.getLogger()
+
+
+class ShareStore:
+    """Files shared by link, with an expiry time and a limit on download attempts per share. Kept in a sqlite database, So shares survive restarts,\n
+       and every worker process (Ex: gunicorn workers) sees same shares. Attempts are used up in a single `UPDATE`, concurrent downloads can't use the same attempt twice.
+       Shares are ordered by expiry time in an index, expired ones are removed in background by a thread that sleeps till the next one is due. Each pass costs O(expired shares), not O(all shares).
+       Lookups check expiry on their own, So a share is never served past it's expiry even if it's not removed yet.
+    """
+    def __init__(self, db_filepath: str, expiry_seconds: int = 6000, attempts: int = 2, expire_in_background: bool = True) -> None:
+        self._filepath = db_filepath
+        self.default_expiry_seconds = expiry_seconds
+        self.default_attempts = attempts
+        self._local = threading.local()     # A connection per thread, sqlite connections can't be shared between threads.
+        self._wakeup = threading.Event()    # Set when a share is added, expiry thread recalculates when to wake up.
+        with self._connection() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")   # Readers don't block writer (and other way round), across processes too.
+            connection.execute("CREATE TABLE IF NOT EXISTS shares (file_id TEXT PRIMARY KEY, created REAL NOT NULL, expires_at REAL NOT NULL, attempts_left INTEGER NOT NULL, max_attempts INTEGER NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS shares_by_expiry ON shares (expires_at)")
+            connection.execute("CREATE INDEX IF NOT EXISTS shares_exhausted ON shares (attempts_left) WHERE attempts_left <= 0")  # Only shares out of attempts are in it.
+        if expire_in_background:
+            threading.Thread(target=self._expiry_loop, daemon=True).start()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._filepath, timeout=30)    # Waits this long for a lock held by another process.
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    def add(self, file_id: str, expiry_seconds: int = None, attempts: int = None) -> dict | None:
+        """Shares a file for `expiry_seconds` or `attempts` downloads, whichever runs out first (defaults of the store if not given). Returns the share, None if file is already shared."""
+        now = time.time()
+        expiry_seconds = self.default_expiry_seconds if expiry_seconds is None else expiry_seconds
+        attempts = self.default_attempts if attempts is None else attempts
+        with self._connection() as connection:  # One transaction, commits on exit.
+            connection.execute("DELETE FROM shares WHERE file_id = ? AND (expires_at <= ? OR attempts_left <= 0)", (file_id, now))   # An expired share not removed yet doesn't block sharing again.
+            added = connection.execute("INSERT OR IGNORE INTO shares (file_id, created, expires_at, attempts_left, max_attempts) VALUES (?, ?, ?, ?, ?)",
+                                       (file_id, now, now + expiry_seconds, attempts, attempts)).rowcount
+        if not added:
+            return None
+        self._wakeup.set()
+        return {"file_id": file_id, "created": now, "expires_at": now + expiry_seconds, "attempts_left": attempts, "max_attempts": attempts}
+
+    def get(self, file_id: str) -> dict | None:
+        """Share of a file, None if it's not shared (or share has expired / run out of attempts)."""
+        row = self._connection().execute("SELECT * FROM shares WHERE file_id = ? AND expires_at > ? AND attempts_left > 0", (file_id, time.time())).fetchone()
+        return dict(row) if row is not None else None
+
+    def use_attempt(self, file_id: str) -> bool:
+        """Uses up one download attempt of a share, atomically. False if file isn't shared or has no attempts left.\n
+           A share out of attempts is kept (lookups skip it) till `expire()` removes it, So the attempt of a download that fails can still be given back.
+        """
+        with self._connection() as connection:
+            used = connection.execute("UPDATE shares SET attempts_left = attempts_left - 1 WHERE file_id = ? AND expires_at > ? AND attempts_left > 0", (file_id, time.time())).rowcount
+        return used > 0
+
+    def refund_attempt(self, file_id: str):
+        """Gives back an attempt used for a download that couldn't be served (Ex: telegram was unreachable). Does nothing if share is gone meanwhile."""
+        with self._connection() as connection:
+            connection.execute("UPDATE shares SET attempts_left = MIN(attempts_left + 1, max_attempts) WHERE file_id = ?", (file_id, ))
+
+    def remove(self, file_id: str) -> bool:
+        with self._connection() as connection:
+            return connection.execute("DELETE FROM shares WHERE file_id = ?", (file_id, )).rowcount > 0
+
+    def count(self) -> int:
+        """Active shares."""
+        return self._connection().execute("SELECT COUNT(*) FROM shares WHERE expires_at > ? AND attempts_left > 0", (time.time(), )).fetchone()[0]
+
+    def expire(self) -> int:
+        """Removes shares past their expiry time or out of attempts, returns how many were removed. Only those rows are visited (range scan on expiry index, and the index of exhausted shares)."""
+        with self._connection() as connection:
+            expired = connection.execute("DELETE FROM shares WHERE expires_at <= ?", (time.time(), )).rowcount
+            return expired + connection.execute("DELETE FROM shares WHERE attempts_left <= 0").rowcount
+
+    def next_expiry(self) -> float | None:
+        """Expiry time of share that expires first, None if nothing is shared. Read from expiry index, not by scanning shares."""
+        return self._connection().execute("SELECT MIN(expires_at) FROM shares").fetchone()[0]
+
+    def _expiry_loop(self):
+        """Removes expired shares, sleeping till next share is due. Wakes up at least every minute for shares added by other processes."""
+        while True:
+            try:
+                expired = self.expire()
+                if expired:
+                    logger.info(f"Pulled {expired} expired file shares.")
+                next_expiry = self.next_expiry()
+            except sqlite3.Error as err:
+                logger.error(f"Unable to expire file shares, Error: {err}")
+                next_expiry = None
+            self._wakeup.wait(timeout=60 if next_expiry is None else min(max(next_expiry - time.time(), 0.5), 60))
+            self._wakeup.clear()
@@ -0,0 +1,8 @@
+"""Production entry point, Ex: `gunicorn -c gunicorn.conf.py wsgi:app`. Each worker process loads `bot` on it's own, they share schema, shares, jobs through files in schema folder."""
+from dotenv import load_dotenv
+import logging
+import os
+load_dotenv()
+logging.basicConfig(level=os.getenv("LOGGING_LEVEL", 'INFO').upper(), format="%(asctime)s [%(process)d] %(levelname)s %(message)s")
+
+from bot import app     # noqa: E402, Logging is set up before bot logs anything.